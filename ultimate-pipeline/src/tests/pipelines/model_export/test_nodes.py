@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import src.ultimate_pipeline.pipelines.model_export.nodes as nodes
+
+PARAMS = {"model_path": "data/models/best.pt", "imgsz": 640, "data_config": "data/dataset.yaml", "max_map_drop": 0.02}
+
+def test_create_model_card_recommends_fastest_accurate_enough_variant(tmp_path):
+    variants = {}
+    for variant, size_bytes in [("torch", 2**20), ("onnx", 2**19), ("onnx_int8", 2**18)]:
+        variants[variant] = str(tmp_path / f"{variant}.model")
+        (tmp_path / f"{variant}.model").write_bytes(b"0" * size_bytes)
+    accuracy = pd.DataFrame({"variant": ["torch", "onnx", "onnx_int8"], "map50": [0.7, 0.7, 0.6], "map50_95": [0.5, 0.49, 0.4]})
+    latency = pd.DataFrame({"variant": ["torch", "onnx", "onnx_int8"], "latency_ms_median": [100.0, 50.0, 20.0],
+                            "latency_ms_p90": [120.0, 60.0, 25.0]})
+
+    model_card = nodes.create_model_card(PARAMS, variants, accuracy, latency)
+
+    # The INT8 variant is the fastest, but loses too much accuracy
+    assert model_card["recommended_variant"] == "onnx"
+    assert model_card["reference_map50_95"] == 0.5
+    assert [variant["size_mb"] for variant in model_card["variants"]] == [1.0, 0.5, 0.25]
+    assert [variant["web_app_backend"] for variant in model_card["variants"]] == ["torch", "onnx", "onnx"]
+
+def test_create_model_card_without_torch_variant_compares_to_most_accurate(tmp_path):
+    (tmp_path / "best.onnx").write_bytes(b"0")
+    (tmp_path / "best_openvino_model").mkdir()
+    (tmp_path / "best_openvino_model" / "best.bin").write_bytes(b"0")
+    variants = {"onnx": str(tmp_path / "best.onnx"), "openvino": str(tmp_path / "best_openvino_model")}
+    accuracy = pd.DataFrame({"variant": ["onnx", "openvino"], "map50": [0.7, 0.7], "map50_95": [0.5, 0.45]})
+    latency = pd.DataFrame({"variant": ["onnx", "openvino"], "latency_ms_median": [50.0, 30.0], "latency_ms_p90": [60.0, 40.0]})
+
+    model_card = nodes.create_model_card(PARAMS, variants, accuracy, latency)
+
+    assert model_card["reference_map50_95"] == 0.5
+    assert model_card["recommended_variant"] == "onnx"
+
+def test_letterbox_keeps_aspect_ratio_and_pads_with_grey():
+    image = Image.new("RGB", (200, 100), (255, 0, 0))
+
+    letterboxed = nodes._letterbox(image, imgsz=64)
+
+    assert letterboxed.shape == (1, 3, 64, 64)
+    assert letterboxed.dtype == np.float32
+    # The image is scaled to 64x32 and centered vertically
+    np.testing.assert_allclose(letterboxed[0, :, 0, 0], [114 / 255] * 3)
+    np.testing.assert_allclose(letterboxed[0, :, 63, 63], [114 / 255] * 3)
+    np.testing.assert_allclose(letterboxed[0, :, 32, 0], [1.0, 0.0, 0.0])
+    assert (letterboxed[0, 0, 16:48] == 1.0).all()
@@ -12,5 +12,6 @@ def register_pipelines() -> dict[str, Pipeline]:
         A mapping from pipeline names to ``Pipeline`` objects.
     """
     pipelines = find_pipelines()
-    pipelines["__default__"] = sum(pipelines.values())
+    # NB - model export needs a trained model, which is produced outside of Kedro, so it isn't run by default
+    pipelines["__default__"] = sum(pipeline for name, pipeline in pipelines.items() if name != "model_export")
     return pipelines
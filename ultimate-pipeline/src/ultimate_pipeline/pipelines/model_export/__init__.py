@@ -0,0 +1,9 @@
+"""
+'model_export' pipeline for Ultimate, exporting and quantizing the trained YOLO model for CPU inference.
+"""
+
+from .pipeline import create_pipeline
+
+__all__ = ["create_pipeline"]
+
+__version__ = "0.1"
@@ -0,0 +1,214 @@
+"""
+Kedro nodes for 'model_export' pipeline.
+"""
+from typing import Callable, Any
+import os
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+import onnx
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+from PIL import Image
+try:
+    from ultralytics import YOLO
+except ModuleNotFoundError:
+    # NB - ultralytics isn't in requirements.txt (it pulls torch, see the CPU-only install command there)
+    YOLO = None
+
+logger = logging.getLogger(__name__)
+
+# Model variants: the trained PyTorch model and its exports (FP32 and INT8)
+TORCH_VARIANT = "torch"
+ONNX_VARIANT = "onnx"
+ONNX_INT8_VARIANT = "onnx_int8"
+OPENVINO_VARIANT = "openvino"
+OPENVINO_INT8_VARIANT = "openvino_int8"
+MODEL_VARIANTS = [TORCH_VARIANT, ONNX_VARIANT, ONNX_INT8_VARIANT, OPENVINO_VARIANT, OPENVINO_INT8_VARIANT]
+
+def export_model_variants(params: dict[str, Any], calibration_images: dict[str, Callable[[], Image.Image]]) -> dict[str, str]:
+    """
+    Export the trained YOLO model to the model variants (the exported files are placed next to the model).
+    Args:
+        params (dict) - model_export parameters
+        calibration_images (dict) - a dictionary (keyed by file names) containing functions to load the val images,
+            used to calibrate the ONNX INT8 quantization (OpenVINO INT8 is calibrated by Ultralytics on the val split of data_config)
+    Return:
+        dict of model paths keyed by variant
+    """
+    unknown_variants = set(params["variants"]) - set(MODEL_VARIANTS)
+    if unknown_variants:
+        raise ValueError(f"Unknown model variants {sorted(unknown_variants)}, expected some of {MODEL_VARIANTS}")
+
+    model_path = params["model_path"]
+    imgsz = _get_imgsz(params)
+    variants = {}
+    for variant in params["variants"]:
+        logger.info(f"Exporting model {model_path} to {variant} variant (image size {imgsz})")
+        if variant == TORCH_VARIANT:
+            variants[variant] = model_path
+        elif variant == ONNX_VARIANT:
+            variants[variant] = _load_yolo_model(model_path).export(format="onnx", imgsz=imgsz)
+        elif variant == ONNX_INT8_VARIANT:
+            onnx_path = variants.get(ONNX_VARIANT) or _load_yolo_model(model_path).export(format="onnx", imgsz=imgsz)
+            variants[variant] = _quantize_onnx_model(onnx_path, calibration_images, imgsz=imgsz,
+                                                     max_images=params["calibration_images"])
+        elif variant == OPENVINO_VARIANT:
+            variants[variant] = _load_yolo_model(model_path).export(format="openvino", imgsz=imgsz)
+        elif variant == OPENVINO_INT8_VARIANT:
+            variants[variant] = _load_yolo_model(model_path).export(format="openvino", imgsz=imgsz, int8=True, data=params["data_config"])
+    return variants
+
+def evaluate_model_variants(params: dict[str, Any], variants: dict[str, str]) -> pd.DataFrame:
+    """
+    Evaluate the accuracy of the model variants on the val split of data_config (on CPU).
+    Return:
+        DataFrame with "variant", "map50" and "map50_95" columns
+    """
+    imgsz = _get_imgsz(params)
+    rows = []
+    for variant, path in variants.items():
+        logger.info(f"Evaluating {variant} variant {path}")
+        # NB - the exported models have a static batch size of 1
+        metrics = _load_yolo_model(path, task="detect").val(data=params["data_config"], split="val", imgsz=imgsz, batch=1,
+                                                              device="cpu", plots=False)
+        rows.append(dict(variant=variant, map50=float(metrics.box.map50), map50_95=float(metrics.box.map)))
+    return pd.DataFrame(rows, columns=["variant", "map50", "map50_95"])
+
+def measure_model_variants_latency(params: dict[str, Any], variants: dict[str, str],
+                                   images: dict[str, Callable[[], Image.Image]]) -> pd.DataFrame:
+    """
+    Measure the CPU inference latency of the model variants, image by image, after a warm-up inference.
+    Args:
+        params (dict) - model_export parameters
+        variants (dict) - model paths keyed by variant
+        images (dict) - a dictionary (keyed by file names) containing functions to load the val images
+    Return:
+        DataFrame with "variant", "latency_ms_median" and "latency_ms_p90" columns
+    """
+    imgsz = _get_imgsz(params)
+    latency_images = [load_image() for load_image in list(images.values())[:params["latency_images"]]]
+    if not latency_images:
+        raise ValueError("No images to measure the model latency on")
+
+    rows = []
+    for variant, path in variants.items():
+        logger.info(f"Measuring the latency of {variant} variant {path} on {len(latency_images)} images")
+        model = _load_yolo_model(path, task="detect")
+        model.predict(source=latency_images[0], imgsz=imgsz, device="cpu", verbose=False)
+        latencies_ms = []
+        for image in latency_images:
+            start = time.perf_counter()
+            model.predict(source=image, imgsz=imgsz, device="cpu", verbose=False)
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+        rows.append(dict(variant=variant, latency_ms_median=float(np.median(latencies_ms)),
+                         latency_ms_p90=float(np.percentile(latencies_ms, 90))))
+    return pd.DataFrame(rows, columns=["variant", "latency_ms_median", "latency_ms_p90"])
+
+def create_model_card(params: dict[str, Any], variants: dict[str, str], accuracy: pd.DataFrame, latency: pd.DataFrame) -> dict[str, Any]:
+    """
+    Create a model card listing the accuracy, CPU latency and file size of each model variant.
+    The recommended variant is the fastest one whose mAP50-95 is at most max_map_drop below the torch variant
+    (or the most accurate variant, if torch wasn't evaluated).
+    Return:
+        The model card as a dict (JSON serializable)
+    """
+    variants_df = accuracy.merge(latency, on="variant")
+    variants_df["path"] = variants_df["variant"].map(variants)
+    variants_df["size_mb"] = variants_df["path"].map(lambda path: round(_get_size_bytes(path) / 2**20, 2))
+    # The backend (MODEL_BACKEND) to run the variant with in the web app
+    variants_df["web_app_backend"] = variants_df["variant"].map(lambda variant: variant.removesuffix("_int8"))
+
+    is_torch = variants_df["variant"] == TORCH_VARIANT
+    reference_map = variants_df.loc[is_torch, "map50_95"].iloc[0] if is_torch.any() else variants_df["map50_95"].max()
+    accurate_enough_df = variants_df[variants_df["map50_95"] >= reference_map - params["max_map_drop"]]
+    recommended_variant = accurate_enough_df.sort_values(by="latency_ms_median").iloc[0]["variant"]
+    logger.info(f"Recommended model variant: {recommended_variant}")
+
+    return {
+        "model_path": params["model_path"],
+        "imgsz": _get_imgsz(params),
+        "data_config": params["data_config"],
+        "reference_map50_95": float(reference_map),
+        "max_map_drop": params["max_map_drop"],
+        "recommended_variant": recommended_variant,
+        "variants": variants_df.to_dict(orient="records"),
+    }
+
+class _ImageCalibrationReader(CalibrationDataReader):
+    """
+    Feeds the calibration images to ONNX Runtime static quantization, preprocessed like Ultralytics does
+    (letterboxed to a square, RGB, CHW, scaled to 0-1).
+    """
+    def __init__(self, images: dict[str, Callable[[], Image.Image]], input_name: str, imgsz: int, max_images: int):
+        self._load_images = iter(list(images.values())[:max_images])
+        self._input_name = input_name
+        self._imgsz = imgsz
+
+    def get_next(self) -> dict[str, np.ndarray]:
+        load_image = next(self._load_images, None)
+        if load_image is None:
+            return None
+        return {self._input_name: _letterbox(load_image(), self._imgsz)}
+
+def _quantize_onnx_model(onnx_path: str, calibration_images: dict[str, Callable[[], Image.Image]], imgsz: int, max_images: int) -> str:
+    """
+    Quantize the ONNX model to INT8 (static quantization calibrated on the images).
+    Return:
+        path to the quantized model (<name>_int8.onnx next to the ONNX model)
+    """
+    if not calibration_images:
+        raise ValueError("No images to calibrate the INT8 quantization on")
+    int8_path = f"{os.path.splitext(onnx_path)[0]}_int8.onnx"
+    fp32_model = onnx.load(onnx_path)
+    calibration_reader = _ImageCalibrationReader(calibration_images, input_name=fp32_model.graph.input[0].name,
+                                                 imgsz=imgsz, max_images=max_images)
+    quantize_static(onnx_path, int8_path, calibration_reader, quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+
+    # Keep the Ultralytics metadata (class names, image size, ...), so that the quantized model loads like the FP32 one
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+    logger.info(f"Quantized ONNX model {onnx_path} to {int8_path}")
+    return int8_path
+
+def _letterbox(image: Image.Image, imgsz: int) -> np.ndarray:
+    """
+    Resize the image to fit a imgsz x imgsz square, keeping the aspect ratio and padding with grey.
+    Return:
+        np.ndarray of shape (1,3,imgsz,imgsz), float32 in range 0-1
+    """
+    image = image.convert("RGB")
+    scale = imgsz / max(image.size)
+    resized = image.resize((round(image.width * scale), round(image.height * scale)), Image.BILINEAR)
+    padded = Image.new("RGB", (imgsz, imgsz), (114, 114, 114))
+    padded.paste(resized, ((imgsz - resized.width) // 2, (imgsz - resized.height) // 2))
+    return (np.asarray(padded, dtype=np.float32) / 255).transpose(2, 0, 1)[None]
+
+def _load_yolo_model(path: str, **kwargs) -> Any:
+    """
+    Load a YOLO model (or an exported model) with Ultralytics, failing with the install instructions if it's missing.
+    """
+    if YOLO is None:
+        raise ModuleNotFoundError("The model_export pipeline requires ultralytics, install it with: "
+                                  "pip install torch torchvision ultralytics --extra-index-url https://download.pytorch.org/whl/cpu")
+    return YOLO(path, **kwargs)
+
+def _get_imgsz(params: dict[str, Any]) -> int:
+    """
+    Get the inference image size: the imgsz parameter, or the image size the model was trained with.
+    """
+    if params["imgsz"] is not None:
+        return params["imgsz"]
+    return _load_yolo_model(params["model_path"]).overrides.get("imgsz", 640)
+
+def _get_size_bytes(path: str) -> int:
+    """
+    Get the size of a model file, or the total size of a model directory (OpenVINO models).
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
@@ -0,0 +1,36 @@
+"""
+'model_export' pipeline for Ultimate, exporting the trained YOLO model to ONNX/OpenVINO (FP32 and INT8)
+and comparing the variants in a model card.
+"""
+
+from kedro.pipeline import Pipeline, pipeline, node
+from .nodes import (export_model_variants, evaluate_model_variants,
+                    measure_model_variants_latency, create_model_card)
+
+def create_pipeline(**kwargs) -> Pipeline:
+    return pipeline([
+        node(
+            export_model_variants,
+            inputs=["params:model_export", "yolo_detect_images_val"],
+            outputs="model_variants",
+            name="export_model_variants_node",
+        ),
+        node(
+            evaluate_model_variants,
+            inputs=["params:model_export", "model_variants"],
+            outputs="model_variants_accuracy",
+            name="evaluate_model_variants_node",
+        ),
+        node(
+            measure_model_variants_latency,
+            inputs=["params:model_export", "model_variants", "yolo_detect_images_val"],
+            outputs="model_variants_latency",
+            name="measure_model_variants_latency_node",
+        ),
+        node(
+            create_model_card,
+            inputs=["params:model_export", "model_variants", "model_variants_accuracy", "model_variants_latency"],
+            outputs="model_card",
+            name="create_model_card_node",
+        ),
+    ])
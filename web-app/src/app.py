@@ -19,6 +19,8 @@ def create_app() -> Flask:
             broker_url=os.getenv("REDIS_URL", "redis://localhost:6379"),
             result_backend=os.getenv("REDIS_URL", "redis://localhost:6379"),
             task_ignore_result=True,
+            # NB - the worker processes load and warm up the model before reporting ready (default timeout: 4s)
+            worker_proc_alive_timeout=float(os.getenv("WORKER_PROC_ALIVE_TIMEOUT", 60)),
         ),
     )
     app.config.from_prefixed_env()
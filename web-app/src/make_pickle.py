@@ -1,13 +1,13 @@
-import pickle
 import sys
-from tasks.precalculated import _calculate_sha256sum
+from tasks.precalculated import PrecalculatedResults, get_results_file_name, convert_pickled_results
+from tasks.video_hash import get_video_sha256sum
 from tasks.tasks import video_analysis
 from pathlib import Path
 import os
 
 def main():
     """
-    Command line tool to run Ultimate board detection and pickle the results.
+    Command line tool to run Ultimate board detection and save the results as precalculated results.
     The result data is a Pythondictionary in the following format:
         key (str): frame number
         value (object):
@@ -16,33 +16,46 @@ def main():
             y (float): mid-point y coordinate of the detected object, expressed in 'real ultimate pitch' units
             team (int): team number (typically 0 or 1)
             id (int): YOLO instance id of the detected object; can be used to keep track of objects across multiple frames
+    It is saved in a columnar format, memory-mapped when the results are looked up (see tasks.precalculated.PrecalculatedResults).
+    With frame_stride n > 1, only every n-th frame is tracked and the coordinates in the other frames are interpolated;
+    the stride is part of the file name, so that the results are only used by analyses with the same stride.
+    With --convert, results pickled by previous versions of the tool are converted to the columnar format instead.
     """
     if len(sys.argv) < 2:
-        print(f"{sys.argv[0]} is a tool to run Ultimate board detection and pickle the results for a given Ultimate Frisbee video.")
-        print("The results are saved to a file <video_sha256>.pickle in [output_dir].")
-        print(f"Usage: {sys.argv[0]} path_to_video [output_dir]")
+        print(f"{sys.argv[0]} is a tool to run Ultimate board detection and save the results for a given Ultimate Frisbee video.")
+        print(f"The results are saved to a file {get_results_file_name('<video_sha256>')} "
+              f"(or {get_results_file_name('<video_sha256>', frame_stride=2)} for frame_stride 2) in [output_dir].")
+        print(f"Usage: {sys.argv[0]} path_to_video [output_dir] [frame_stride]")
+        print(f"       {sys.argv[0]} --convert path_to_pickle [path_to_pickle ...]")
         sys.exit(-1)
 
+    if sys.argv[1] == "--convert":
+        for pickle_path in sys.argv[2:]:
+            print(f"Converted {pickle_path} to {convert_pickled_results(pickle_path)}")
+        return
+
     video_path = sys.argv[1]
     output_dir = sys.argv[2] if len(sys.argv) >= 3 else "./data/precalculated"
+    frame_stride = int(sys.argv[3]) if len(sys.argv) >= 4 else 1
     print(f"Using output_dir: {output_dir}")
     if not os.path.exists(output_dir) or not os.path.isdir(output_dir):
         print(f"Error: {output_dir} needs to be an existing directory")
         sys.exit(-1)
 
-    video_sha_sum = _calculate_sha256sum(video_path)
+    video_sha_sum = get_video_sha256sum(video_path)
     print(f"SHA-256 checksum of {video_path} is {video_sha_sum}")
 
-    analysis_results = video_analysis(video_path)
+    analysis_results = video_analysis(video_path, frame_stride=frame_stride)
     if analysis_results is not None and "coordinates" in analysis_results:
         streamlined_results = analysis_results["coordinates"]
+        if "inferred_frames" in analysis_results:
+            print(f"Tracked {len(analysis_results['inferred_frames'])} frames, interpolated the others")
     else:
         raise RuntimeError("Unexpected results returned from Ultimate Board video_analysis")
     
-    output_file = Path(output_dir)/f"{video_sha_sum}.pickle"
-    with open(output_file, "wb") as f:
-            pickle.dump(streamlined_results, f)
+    output_file = Path(output_dir)/get_results_file_name(video_sha_sum, frame_stride=frame_stride)
+    PrecalculatedResults.from_dict(streamlined_results).save(str(output_file))
     print(f"Saved results as {output_file}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
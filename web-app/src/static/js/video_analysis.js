@@ -1,20 +1,57 @@
 import { drawPitchOutline, drawCircle, standardCoordsToCanvasCoords } from './render_pitch.js';
 
+// The video is uploaded in chunks, a failed chunk is retried from the offset received by the server
+const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+const UPLOAD_RETRIES = 5
+
+const uploadInChunks = async (file, streaming) => {
+  const created = await fetch("/tasks/uploads", {
+    method: "POST",
+    headers: {"Content-Type": "application/json"},
+    body: JSON.stringify({filename: file.name, size: file.size, streaming: streaming})
+  }).then(response => response.json())
+
+  let status = created
+  let retries = 0
+  while (status["result_id"] == null) {
+    try {
+      const offset = status["offset"]
+      const response = await fetch(`/tasks/uploads/${created["upload_id"]}`, {
+        method: "PUT",
+        headers: {"Upload-Offset": offset},
+        body: file.slice(offset, offset + UPLOAD_CHUNK_BYTES)
+      })
+      if (!response.ok) {
+        throw new Error(`Upload of chunk at offset ${offset} failed with status ${response.status}`)
+      }
+      status = await response.json()
+      retries = 0
+    } catch (error) {
+      retries += 1
+      if (retries > UPLOAD_RETRIES) {
+        throw error
+      }
+      console.log(error, "resuming the upload")
+      await new Promise(resolve => setTimeout(resolve, 1000 * retries))
+      const statusResponse = await fetch(`/tasks/uploads/${created["upload_id"]}`)
+      if (!statusResponse.ok) {
+        // NB - the upload is removed once complete or expired, it can only be started again
+        throw new Error(`Upload ${created["upload_id"]} can't be resumed, status ${statusResponse.status}`)
+      }
+      status = await statusResponse.json()
+    }
+  }
+  return status
+}
+
 const taskForm = (formName, doPoll, report) => {
     document.forms[formName].addEventListener("submit", (event) => {
       event.preventDefault()
 
       const fileInput = document.querySelector('input[type="file"]');
-      const videoPlayer = document.getElementById('videoplayer');
-      
       const formData = new FormData(event.target)
-      formData.append('file', fileInput.files[0]);
 
-      fetch(event.target.action, {
-        method: "POST",
-        body: formData
-      })
-        .then(response => response.json())
+      uploadInChunks(fileInput.files[0], formData.get("streaming") === "true")
         .then(data => {
           report(null)
 
@@ -41,28 +78,53 @@ const taskForm = (formName, doPoll, report) => {
 
 taskForm("video-upload-form", true, data => {
   const progressbar = document.getElementById("progressbar");
-  const tacticalboard = document.getElementById("tacticalboard");
-  const fileInput = document.querySelector('input[type="file"]');
-  const videoPlayer = document.getElementById('videoplayer');
 
 
   if (data === null) {
     console.log("uploading...")
     progressbar.value = 0;
+    person_coords = null;
+    received_frames_end = 0;
   } else if (!data["ready"]) {
     progressbar.value = data["value"]?.["status"] ?? 0
+    // In streaming mode, the coordinates of the last analysed chunk of frames arrive with the progress
+    const chunk_coords = data["value"]?.["coordinates"]
+    if (chunk_coords) {
+      const [start, end] = data["value"]["frames"]
+      if (start > received_frames_end) {
+        console.log(`missed the coordinates of frames ${received_frames_end}-${start - 1}, shown once the analysis finished`)
+      }
+      received_frames_end = Math.max(received_frames_end, end)
+      startTacticalBoard(Object.assign(person_coords ?? {}, chunk_coords))
+    }
   } else if (!data["successful"]) {
     console.log("error, check console")
   } else {
     progressbar.value = 1;
+    startTacticalBoard(data["value"]["coordinates"])
+  }
+})
+
+// coordinates of the players by frame, null until the first results arrive
+let person_coords = null;
+// end of the frames of the coordinate chunks received so far (streaming mode)
+let received_frames_end = 0;
+
+const startTacticalBoard = (coords) => {
+    const alreadyStarted = person_coords !== null;
+    person_coords = coords;
+    if (alreadyStarted) {
+      return;
+    }
+
+    const tacticalboard = document.getElementById("tacticalboard");
+    const fileInput = document.querySelector('input[type="file"]');
+    const videoPlayer = document.getElementById('videoplayer');
 
     var url = URL.createObjectURL(fileInput.files[0]);
     videoPlayer.src = url;
     videoPlayer.style.display = 'block';
 
-    // get the coordinates of the players
-    let person_coords = data["value"]["coordinates"]
-
     // create a backbuffer canvas to draw the pitch on
     let backBuffer = document.createElement('canvas');
     backBuffer.width = tacticalboard.width;
@@ -92,7 +154,8 @@ taskForm("video-upload-form", true, data => {
       console.log(shown_frame)
     
       // render players on backbuffer
-      for (let person of person_coords[shown_frame]) {
+      // NB - frames without detections (or from chunks not received yet) are missing
+      for (let person of person_coords[shown_frame] ?? []) {
         if (person.cls == 0) {
 
           const {x, y} = standardCoordsToCanvasCoords(person.x, person.y, backBuffer);
@@ -114,5 +177,4 @@ taskForm("video-upload-form", true, data => {
     };
 
   videoplayer.requestVideoFrameCallback(updateCanvas);
-  }
-})
\ No newline at end of file
+}
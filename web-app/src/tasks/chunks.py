@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+def split_frame_ranges(total_frames: int, chunk_frames: int, overlap: int) -> list[tuple[int, int]]:
+    """
+    Split the video frames into consecutive ranges, each overlapping the previous one.
+    Args:
+        total_frames (int): number of video frames
+        chunk_frames (int): number of frames per range, not counting the overlap with the previous range
+        overlap (int): number of frames shared by consecutive ranges
+    Return:
+        list of (start frame, end frame) tuples, the end frame is exclusive
+    """
+    if chunk_frames < 1:
+        raise ValueError(f"Chunk must contain at least 1 frame, got {chunk_frames}")
+    if overlap < 0 or overlap > chunk_frames:
+        raise ValueError(f"Overlap must be between 0 and {chunk_frames} frames, got {overlap}")
+    return [(max(start - overlap, 0), min(start + chunk_frames, total_frames))
+            for start in range(0, total_frames, chunk_frames)]
+
+def stitch_chunk_tables(chunk_tables: list[pd.DataFrame], frame_ranges: list[tuple[int, int]], iou_threshold: float=0.3) -> pd.DataFrame:
+    """
+    Merge the tracking tables of overlapping frame ranges, tracked independently, into a single table.
+    The tracks of each range are matched to the tracks of the previous range by the mean IoU of their boxes
+    in the overlapping frames (greedily, best match first). Matched tracks take over the id of the previous range,
+    the other tracks get new unique ids. In the overlapping frames, the detections of the previous range are kept,
+    as the tracker of the next range is only starting there.
+    Args:
+        chunk_tables (list[pd.DataFrame]): tracking tables with "cls", "x", "y", "w", "h", "id" and "frame" columns
+            (absolute frame numbers), one per frame range
+        frame_ranges (list[tuple[int, int]]): (start frame, end frame) of each table, as returned by split_frame_ranges
+        iou_threshold (float): minimum mean IoU of two tracks to be considered the same object
+    Return:
+        pd.DataFrame with all the columns of the chunk tables, sorted by frame
+    """
+    if len(chunk_tables) != len(frame_ranges):
+        raise ValueError(f"Expected a tracking table for each of {len(frame_ranges)} frame ranges, got {len(chunk_tables)}")
+    if len(chunk_tables) == 0:
+        return pd.DataFrame(columns=["cls", "x", "y", "w", "h", "id", "frame"])
+
+    stitched_tables = [chunk_tables[0]]
+    next_id = _max_id(chunk_tables[0]) + 1
+    for i in range(1, len(chunk_tables)):
+        previous_df, df = stitched_tables[-1], chunk_tables[i].copy()
+        overlap_end = frame_ranges[i-1][1]
+        id_map = _match_tracks(previous_df[previous_df["frame"] >= frame_ranges[i][0]],
+                               df[df["frame"] < overlap_end], iou_threshold=iou_threshold)
+        # Tracks which weren't matched get new ids (0 means "no track id" and is kept)
+        for track_id in np.unique(df["id"]):
+            if track_id not in id_map and track_id != 0:
+                id_map[track_id] = next_id
+                next_id += 1
+        df["id"] = df["id"].map(lambda track_id: id_map.get(track_id, track_id))
+        stitched_tables.append(df[df["frame"] >= overlap_end])
+
+    stitched_df = pd.concat(stitched_tables, ignore_index=True)
+    return stitched_df.sort_values(by="frame", kind="stable", ignore_index=True)
+
+def _match_tracks(previous_df: pd.DataFrame, df: pd.DataFrame, iou_threshold: float) -> dict:
+    """
+    Match the track ids of df to the track ids of previous_df (both limited to the overlapping frames).
+    Only tracks of the same class are matched.
+    Return:
+        dict mapping the track ids of df to the track ids of previous_df
+    """
+    pairs = previous_df[previous_df["id"] != 0].merge(df[df["id"] != 0], on=["frame", "cls"], suffixes=("_prev", ""))
+    if len(pairs) == 0:
+        return {}
+    pairs["iou"] = _box_iou(pairs[["x_prev", "y_prev", "w_prev", "h_prev"]].to_numpy(),
+                            pairs[["x", "y", "w", "h"]].to_numpy())
+    # Frames in which only the track of df is present count as IoU 0
+    iou_sums = pairs.groupby(["id_prev", "id"])["iou"].sum()
+    track_frames = df.groupby("id")["frame"].nunique()
+    mean_iou = iou_sums / track_frames.reindex(iou_sums.index.get_level_values("id")).to_numpy()
+    mean_iou = mean_iou[mean_iou >= iou_threshold].sort_values(ascending=False)
+
+    id_map = {}
+    matched_previous_ids = set()
+    for (previous_id, track_id), _ in mean_iou.items():
+        if track_id in id_map or previous_id in matched_previous_ids:
+            continue
+        id_map[track_id] = previous_id
+        matched_previous_ids.add(previous_id)
+    return id_map
+
+def _box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Calculate the IoU of pairs of boxes.
+    Args:
+        boxes_a (np.ndarray): boxes of shape (N,4) in xywh format (centre, width, height)
+        boxes_b (np.ndarray): boxes of shape (N,4) in xywh format
+    Return:
+        np.ndarray of shape (N,)
+    """
+    a_min, a_max = boxes_a[:, 0:2] - boxes_a[:, 2:4]/2, boxes_a[:, 0:2] + boxes_a[:, 2:4]/2
+    b_min, b_max = boxes_b[:, 0:2] - boxes_b[:, 2:4]/2, boxes_b[:, 0:2] + boxes_b[:, 2:4]/2
+    intersection = np.clip(np.minimum(a_max, b_max) - np.maximum(a_min, b_min), 0, None).prod(axis=1)
+    union = boxes_a[:, 2:4].prod(axis=1) + boxes_b[:, 2:4].prod(axis=1) - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def _max_id(df: pd.DataFrame) -> int:
+    return int(df["id"].max()) if len(df) > 0 else 0
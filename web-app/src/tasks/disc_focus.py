@@ -0,0 +1,120 @@
+from typing import Union
+import numpy as np
+import torch
+import ultralytics
+
+# Class of the frisbee disc
+DISC_CLASS = 29
+
+class DiscFocus:
+    """
+    High-resolution crop around the disc, which is too small to be detected reliably in frames inferred at a low image size.
+    The disc position in the next frame is predicted from its recent trajectory (constant velocity between its last two positions),
+    and the crop_size x crop_size crop around the predicted position (in full-frame pixels) is inferred at its native resolution.
+    The disc detected in the crop replaces the disc detections of the low-resolution pass.
+    The trajectory is forgotten when the disc wasn't seen for max_missing_frames frames, the disc is then searched in full frames only.
+    Args:
+        crop_size (int): side of the square crop in pixels of the full frame (also the inference image size of the crop)
+        conf_threshold (float): confidence threshold to recognize a disc detection as a trajectory point
+        max_missing_frames (int): number of frames after the last disc detection the disc position is still predicted
+    """
+    def __init__(self, crop_size: int=320, conf_threshold: float=0.25, max_missing_frames: int=15):
+        if crop_size < 1:
+            raise ValueError(f"Crop size must be at least 1 pixel, got {crop_size}")
+        self._crop_size = crop_size
+        self._conf_threshold = conf_threshold
+        self._max_missing_frames = max_missing_frames
+        # Last two disc positions (frame index, x, y) in full-frame pixels, the latest last
+        self._trajectory = []
+
+    """Side of the square crop in pixels of the full frame"""
+    @property
+    def crop_size(self):
+        return self._crop_size
+
+    def predict_position(self, frame_index: int) -> Union[tuple[float, float], None]:
+        """
+        Predict the disc centre (x, y) in the frame from its trajectory, or None if the disc wasn't seen recently.
+        Args:
+            frame_index (int): frame number counted from the first tracked frame
+        """
+        if not self._trajectory:
+            return None
+        last_index, last_x, last_y = self._trajectory[-1]
+        if frame_index - last_index > self._max_missing_frames:
+            return None
+        if len(self._trajectory) == 1:
+            return last_x, last_y
+        previous_index, previous_x, previous_y = self._trajectory[0]
+        steps = (frame_index - last_index) / (last_index - previous_index)
+        return last_x + (last_x - previous_x) * steps, last_y + (last_y - previous_y) * steps
+
+    def get_crop_box(self, frame_index: int, frame_shape: tuple[int, int]) -> Union[tuple[int, int, int, int], None]:
+        """
+        Get the crop box (x1, y1, x2, y2) around the predicted disc position, shifted to lie within the frame,
+        or None if the disc position can't be predicted.
+        Args:
+            frame_index (int): frame number counted from the first tracked frame
+            frame_shape (tuple[int, int]): shape of the full frame (height, width)
+        """
+        position = self.predict_position(frame_index)
+        if position is None:
+            return None
+        height, width = frame_shape[:2]
+        x1 = self._get_crop_start(position[0], width)
+        y1 = self._get_crop_start(position[1], height)
+        return x1, y1, min(x1 + self._crop_size, width), min(y1 + self._crop_size, height)
+
+    def crop(self, frame: np.ndarray, box: tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Crop the frame to the crop box (without copying).
+        """
+        x1, y1, x2, y2 = box
+        return frame[y1:y2, x1:x2]
+
+    def merge(self, result: ultralytics.engine.results.Results, crop_result: ultralytics.engine.results.Results,
+              box: tuple[int, int, int, int]) -> ultralytics.engine.results.Results:
+        """
+        Merge the disc detected in the crop into the detections in the full frame: the most confident disc of the crop
+        replaces the disc detections of the full frame. If no disc was detected in the crop, the full-frame detections are kept.
+        Args:
+            result (ultralytics.engine.results.Results): detections (N,6) in the full frame
+            crop_result (ultralytics.engine.results.Results): detections in the frame cropped to the crop box
+            box (tuple[int, int, int, int]): crop box (x1, y1, x2, y2)
+        Return:
+            Results with the merged detections
+        """
+        crop_data = torch.as_tensor(crop_result.boxes.data)
+        crop_data = crop_data[crop_data[:, 5] == DISC_CLASS]
+        if len(crop_data) == 0:
+            return result
+        disc_data = crop_data[crop_data[:, 4].argmax()][None].clone()
+        x1, y1, _, _ = box
+        disc_data[:, [0, 2]] += x1
+        disc_data[:, [1, 3]] += y1
+        data = torch.as_tensor(result.boxes.data)
+        data = torch.cat([data[data[:, 5] != DISC_CLASS], disc_data.to(data.device)])
+        return ultralytics.engine.results.Results(orig_img=result.orig_img, path=result.path, names=result.names, boxes=data,
+                                                  speed=result.speed)
+
+    def observe(self, frame_index: int, result: ultralytics.engine.results.Results) -> None:
+        """
+        Add the most confident disc detection of the frame to the trajectory.
+        Args:
+            frame_index (int): frame number counted from the first tracked frame
+            result (ultralytics.engine.results.Results): detections in the frame, in full-frame coordinates
+        """
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            return
+        conf = boxes.conf.cpu().numpy()
+        is_disc = (boxes.cls.cpu().numpy() == DISC_CLASS) & (conf > self._conf_threshold)
+        if not is_disc.any():
+            return
+        best = np.flatnonzero(is_disc)[conf[is_disc].argmax()]
+        x, y = boxes.xywh.cpu().numpy()[best, 0:2]
+        self._trajectory = [*self._trajectory[-1:], (frame_index, float(x), float(y))]
+
+    def _get_crop_start(self, centre: float, frame_size: int) -> int:
+        start = int(round(centre - self._crop_size / 2))
+        return min(max(start, 0), max(frame_size - self._crop_size, 0))
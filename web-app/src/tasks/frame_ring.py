@@ -0,0 +1,147 @@
+import multiprocessing
+import queue
+from multiprocessing import resource_tracker, shared_memory
+from typing import Union
+import billiard
+import cv2
+import numpy as np
+
+class SharedFrameRing:
+    """
+    Ring of video frame slots in shared memory, so that the frames are decoded once and read by several processes without copying.
+    The writer puts a frame into a free slot and hands the slot number over to the readers (e.g. in a multiprocessing queue).
+    Every reader releases the slot once it's done with the frame; the slot is reused after the last reader released it.
+    The ring can be passed to spawned child processes as an argument; only the process which created it unlinks the shared memory.
+    Args:
+        frame_shape (tuple[int, int, int]): shape of the frames (height, width, channels)
+        slots (int): number of frame slots, i.e. frames being processed at once
+        readers (int): number of readers releasing each frame
+        context (billiard.context.BaseContext): context of the child processes (default: billiard spawn context)
+    """
+    def __init__(self, frame_shape: tuple[int, int, int], slots: int=16, readers: int=2,
+                 context: Union[billiard.context.BaseContext, None]=None):
+        if slots < 1:
+            raise ValueError(f"Ring must have at least 1 slot, got {slots}")
+        if readers < 1:
+            raise ValueError(f"Ring must have at least 1 reader, got {readers}")
+        context = context or billiard.get_context("spawn")
+        self._frame_shape = tuple(frame_shape)
+        self._slots = slots
+        self._readers = readers
+        frame_nbytes = int(np.prod(self._frame_shape))
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * frame_nbytes)
+        self._owner = True
+        self._ref_counts = context.Array("i", slots)
+        self._free_slots = context.Queue()
+        for slot in range(slots):
+            self._free_slots.put(slot)
+        self._frames = self._map_frames()
+
+    """Shape of the frames (height, width, channels)"""
+    @property
+    def frame_shape(self):
+        return self._frame_shape
+
+    """Number of frame slots"""
+    @property
+    def slots(self):
+        return self._slots
+
+    def put(self, frame: np.ndarray, timeout: Union[float, None]=None) -> int:
+        """
+        Copy the frame into a free slot, waiting until the readers release one.
+        Args:
+            frame (np.ndarray): frame image of the ring's frame shape (uint8)
+            timeout (float): seconds to wait for a free slot (None = wait forever)
+        Return:
+            slot number, to be handed over to the readers
+        """
+        if frame.shape != self._frame_shape:
+            raise ValueError(f"Expected a frame of shape {self._frame_shape}, got {frame.shape}")
+        try:
+            slot = self._free_slots.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No free frame slot within {timeout}s") from None
+        self._frames[slot] = frame
+        with self._ref_counts.get_lock():
+            self._ref_counts[slot] = self._readers
+        return slot
+
+    def get(self, slot: int) -> np.ndarray:
+        """
+        Get the frame in the slot, without copying.
+        NB - the frame is only valid until the reader releases the slot, it must not be modified nor kept afterwards.
+        """
+        return self._frames[slot]
+
+    def release(self, slot: int) -> None:
+        """
+        Release the slot by one reader; the slot is reused once all the readers released it.
+        """
+        with self._ref_counts.get_lock():
+            if self._ref_counts[slot] <= 0:
+                raise ValueError(f"Frame slot {slot} isn't in use")
+            self._ref_counts[slot] -= 1
+            free = self._ref_counts[slot] == 0
+        if free:
+            self._free_slots.put(slot)
+
+    def close(self) -> None:
+        """
+        Detach from the shared memory; the process which created the ring also frees it.
+        """
+        # NB - the frame views must be dropped before the shared memory can be closed
+        self._frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def __enter__(self) -> "SharedFrameRing":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_frames"]
+        state["_owner"] = False
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        # NB - attached shared memory is registered with the resource tracker of the child process, which would unlink it
+        # when the child exits, while the other processes still use it
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._frames = self._map_frames()
+
+    def _map_frames(self) -> np.ndarray:
+        return np.ndarray((self._slots, *self._frame_shape), dtype=np.uint8, buffer=self._shm.buf)
+
+def get_video_frame_shape(video_path: str) -> tuple[int, int, int]:
+    """
+    Get the shape of the decoded video frames (height, width, channels).
+    """
+    video = cv2.VideoCapture(video_path)
+    try:
+        return int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), 3
+    finally:
+        video.release()
+
+def decode_video_into_ring(video_path: str, ring: SharedFrameRing, frames_queue: multiprocessing.Queue) -> None:
+    """
+    Decode the video into the frame ring (target of the decoder process).
+    The (frame number, slot) tuples are put into frames_queue, followed by None at the end of the video.
+    """
+    video = cv2.VideoCapture(video_path)
+    try:
+        frame_no = 0
+        success, frame = video.read()
+        while success:
+            frames_queue.put((frame_no, ring.put(frame)))
+            frame_no += 1
+            success, frame = video.read()
+    finally:
+        video.release()
+        ring.close()
+    frames_queue.put(None)
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+from typing import Iterator, Union
+import cv2
+import numpy as np
+
+_END_OF_VIDEO = None
+
+class PrefetchingFrameReader:
+    """
+    Video frame source decoding the frames with OpenCV in a background thread into a bounded queue,
+    so that decoding overlaps with the inference on the consuming thread (OpenCV releases the GIL while decoding).
+    Args:
+        video_path (str): path of the video
+        start_frame (int): first frame to read
+        end_frame (int): frame to stop at (exclusive); None = read until the end of the video
+        frame_stride (int): read every n-th frame only (start_frame, start_frame + n, ...), the others are skipped without decoding
+        max_size (int): downscale the frames so that their longer side is at most max_size pixels (None = keep the original size)
+        prefetch (int): maximum number of decoded frames waiting in the queue
+    """
+    def __init__(self, video_path: str, start_frame: int=0, end_frame: Union[int, None]=None, frame_stride: int=1,
+                 max_size: Union[int, None]=None, prefetch: int=8):
+        if frame_stride < 1:
+            raise ValueError(f"Frame stride must be at least 1, got {frame_stride}")
+        if prefetch < 1:
+            raise ValueError(f"Prefetch must be at least 1 frame, got {prefetch}")
+        self._video_path = video_path
+        self._start_frame = start_frame
+        self._end_frame = end_frame
+        self._frame_stride = frame_stride
+        self._max_size = max_size
+        self._prefetch = prefetch
+        self._frames_read = 0
+        self._decode_seconds = 0.0
+        self._stall_seconds = 0.0
+
+    """Number of frames handed over to the consumer"""
+    @property
+    def frames_read(self):
+        return self._frames_read
+
+    """Time spent decoding (and resizing) the frames in the background thread"""
+    @property
+    def decode_seconds(self):
+        return self._decode_seconds
+
+    """Time the consumer spent waiting for a decoded frame, i.e. decoding not hidden behind the consumer's work"""
+    @property
+    def stall_seconds(self):
+        return self._stall_seconds
+
+    def __iter__(self) -> Iterator[tuple[int, np.ndarray]]:
+        """
+        Read the frames.
+        Return:
+            Iterator of tuples (frame number, frame image in BGR)
+        """
+        frames = queue.Queue(maxsize=self._prefetch)
+        stop = threading.Event()
+        decoder = threading.Thread(target=self._decode, args=(frames, stop), name="frame-decoder", daemon=True)
+        decoder.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = frames.get()
+                self._stall_seconds += time.perf_counter() - start
+                if item is _END_OF_VIDEO:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                self._frames_read += 1
+                yield item
+        finally:
+            # NB - the consumer may stop early, the decoder is unblocked by draining the queue
+            stop.set()
+            while decoder.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            decoder.join()
+
+    def _decode(self, frames: queue.Queue, stop: threading.Event) -> None:
+        video = cv2.VideoCapture(self._video_path)
+        try:
+            if self._start_frame > 0:
+                # NB - the FFmpeg backend seeks to the exact frame (decoding from the preceding keyframe)
+                video.set(cv2.CAP_PROP_POS_FRAMES, self._start_frame)
+            end_frame = self._end_frame if self._end_frame is not None else int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            for frame_no in range(self._start_frame, end_frame):
+                if stop.is_set():
+                    return
+                start = time.perf_counter()
+                if (frame_no - self._start_frame) % self._frame_stride != 0:
+                    success = video.grab()
+                    self._decode_seconds += time.perf_counter() - start
+                    if not success:
+                        break
+                    continue
+                success, frame = video.read()
+                if not success:
+                    break
+                frame = self._resize(frame)
+                self._decode_seconds += time.perf_counter() - start
+                frames.put((frame_no, frame))
+        except Exception as e:
+            frames.put(e)
+            return
+        finally:
+            video.release()
+        frames.put(_END_OF_VIDEO)
+
+    def _resize(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        if self._max_size is None or max(height, width) <= self._max_size:
+            return frame
+        scale = self._max_size / max(height, width)
+        return cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
@@ -1,6 +1,6 @@
 import cv2
 import numpy as np
-from .keypoints import KeypointQuad
+from .keypoints import KeypointQuad, KeypointQuads
 
 keypoints_to_known_coordinates_map = {
     31: dict(real_pitch=np.float32([0, 0])),
@@ -28,6 +28,162 @@ def calculate_homography_matrix(keypoints:KeypointQuad) -> np.ndarray:
     return H
 
 
+def calculate_homography_matrices(quads: KeypointQuads) -> np.ndarray:
+    """
+    Calculate the homography matrices for all frames at once.
+    Each matrix is the exact solution for 4 point pairs (normalized so that H[2,2] = 1),
+    all frames are solved as a single batch of 8x8 linear systems.
+    Args:
+        quads (KeypointQuads): Series of 4 pitch keypoints for each image/video frame
+    Return:
+        np.ndarray (F,3,3), NaN for frames without a quad or with a degenerate quad (3 collinear keypoints)
+    """
+    return _solve_homography_matrices(quads.keypoints, quads.cls_ids)
+
+
+def _solve_homography_matrices(keypoints: np.ndarray, cls_ids: np.ndarray) -> np.ndarray:
+    """
+    Solve the homography matrices for a batch of quads.
+    Args:
+        keypoints (np.ndarray): keypoint coordinates of shape (F,4,2) in YOLO normalized format
+        cls_ids (np.ndarray): keypoint class ids of shape (F,4)
+    Return:
+        np.ndarray (F,3,3)
+    """
+    src_points = keypoints.astype(np.float64)
+    dst_points = _real_pitch_points(cls_ids)
+    frames_count = len(src_points)
+
+    # Each point pair (x,y) -> (u,v) gives 2 equations for the 8 unknown matrix elements:
+    #   [x, y, 1, 0, 0, 0, -u*x, -u*y] . h = u
+    #   [0, 0, 0, x, y, 1, -v*x, -v*y] . h = v
+    x, y = src_points[..., 0], src_points[..., 1]
+    u, v = dst_points[..., 0], dst_points[..., 1]
+    zeros, ones = np.zeros_like(x), np.ones_like(x)
+    A = np.empty((frames_count, 4, 2, 8))
+    A[:, :, 0] = np.stack([x, y, ones, zeros, zeros, zeros, -u*x, -u*y], axis=-1)
+    A[:, :, 1] = np.stack([zeros, zeros, zeros, x, y, ones, -v*x, -v*y], axis=-1)
+    A = A.reshape(frames_count, 8, 8)
+    b = np.stack([u, v], axis=-1).reshape(frames_count, 8)
+
+    solvable = np.isfinite(A).all(axis=(1, 2)) & np.isfinite(b).all(axis=1) & ~_has_collinear_points(src_points)
+    h = np.full((frames_count, 9), np.nan)
+    h[:, 8] = 1
+    try:
+        h[solvable, :8] = np.linalg.solve(A[solvable], b[solvable][..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # A numerically singular system fails the whole batch - solve frame by frame instead
+        for frame in np.flatnonzero(solvable):
+            try:
+                h[frame, :8] = np.linalg.solve(A[frame], b[frame])
+            except np.linalg.LinAlgError:
+                h[frame, :8] = np.nan
+    h[~solvable] = np.nan
+    return h.reshape(frames_count, 3, 3)
+
+
+class HomographyCache:
+    """
+    Memoizes homography matrices, so that frames sharing a keypoint quad share a single matrix.
+    Quads are matched by keypoint class ids and keypoint coordinates quantized to the tolerance.
+    This covers frames which looked back to the same source frame, as well as a static camera
+    producing (nearly) the same keypoints in consecutive frames.
+    Args:
+        tolerance (float): quantization step of keypoint coordinates (YOLO normalized format);
+            0 only matches quads with identical coordinates
+    """
+    def __init__(self, tolerance: float=0.0):
+        self._tolerance = tolerance
+        self._matrices = {}
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def tolerance(self):
+        return self._tolerance
+
+    """Number of frames served with a previously calculated matrix"""
+    @property
+    def hits(self):
+        return self._hits
+
+    """Number of matrices calculated"""
+    @property
+    def misses(self):
+        return self._misses
+
+    def calculate_homography_matrices(self, quads: KeypointQuads) -> np.ndarray:
+        """
+        Calculate the homography matrices for all frames, reusing the matrices of matching quads.
+        Args:
+            quads (KeypointQuads): Series of 4 pitch keypoints for each image/video frame
+        Return:
+            np.ndarray (F,3,3), NaN for frames without a quad or with a degenerate quad
+        """
+        keys = self._make_keys(quads)
+        unique_keys, first_frames, frame_to_key = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+
+        unique_H = np.empty((len(unique_keys), 3, 3))
+        missing = []
+        for i, key in enumerate(unique_keys):
+            H = self._matrices.get(key.tobytes())
+            if H is None:
+                missing.append(i)
+            else:
+                unique_H[i] = H
+        if len(missing) > 0:
+            # The first frame of each group is the representative of the quads within the tolerance
+            missing_frames = first_frames[missing]
+            unique_H[missing] = _solve_homography_matrices(quads.keypoints[missing_frames], quads.cls_ids[missing_frames])
+            for i in missing:
+                self._matrices[unique_keys[i].tobytes()] = unique_H[i]
+
+        self._misses += len(missing)
+        self._hits += len(keys) - len(missing)
+        return unique_H[frame_to_key.reshape(-1)]
+
+    def _make_keys(self, quads: KeypointQuads) -> np.ndarray:
+        """
+        Make integer keys of shape (F,12): 4 class ids followed by 8 quantized coordinates.
+        """
+        keypoints = np.where(quads.found[:, None, None], quads.keypoints, 0).astype(np.float32).reshape(-1, 8)
+        if self._tolerance > 0:
+            quantized_keypoints = np.round(keypoints/self._tolerance).astype(np.int64)
+        else:
+            quantized_keypoints = keypoints.view(np.int32).astype(np.int64)
+        return np.concatenate([quads.cls_ids.astype(np.int64), quantized_keypoints], axis=1)
+
+
+def _real_pitch_points(cls_ids: np.ndarray) -> np.ndarray:
+    """
+    Look up the real pitch coordinates of keypoint class ids.
+    Args:
+        cls_ids (np.ndarray): keypoint class ids of any shape (negative for missing keypoints)
+    Return:
+        np.ndarray of shape cls_ids.shape + (2,), NaN for missing keypoints
+    """
+    real_pitch_by_cls_id = np.full((max(keypoints_to_known_coordinates_map) + 1, 2), np.nan)
+    for cls_id, coordinates in keypoints_to_known_coordinates_map.items():
+        real_pitch_by_cls_id[cls_id] = coordinates["real_pitch"]
+    return np.where(cls_ids[..., None] >= 0, real_pitch_by_cls_id[cls_ids], np.nan)
+
+
+def _has_collinear_points(points: np.ndarray, eps: float=1e-9) -> np.ndarray:
+    """
+    Check whether any 3 of the 4 points are collinear (such quads don't define a homography).
+    Args:
+        points (np.ndarray): points of shape (F,4,2)
+    Return:
+        np.ndarray of shape (F,) of bools
+    """
+    collinear = np.zeros(len(points), dtype=bool)
+    for i, j, k in [(0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3)]:
+        ij = points[:, j] - points[:, i]
+        ik = points[:, k] - points[:, i]
+        collinear |= np.abs(ij[:, 0]*ik[:, 1] - ij[:, 1]*ik[:, 0]) < eps
+    return collinear
+
+
 def convert_h(H, vec):
     """
     Converts point coordinates (x, y) to new coordinates using homography matrix.
@@ -47,3 +203,25 @@ def convert_h(H, vec):
     # Normalize the output vector/matrix (we want 1 in the last row, i.e. z=1)
     pt_norm = pt/pt[2]
     return pt_norm[0:2]
+
+
+
+def convert_h_batch(H, vecs):
+    """
+    Converts a batch of point coordinates (x, y) to new coordinates using homography matrix.
+    Batch counterpart of convert_h.
+    Args:
+        H (np.ndarray): A homography matrix (3,3)
+        vecs (np.ndarray): An array of shape (N,2) representing N points to convert
+    Return:
+        np.ndarray of shape (N,2)
+    """
+    if vecs.ndim != 2 or vecs.shape[1] != 2:
+        raise ValueError("Input array has to be of shape (N,2)")
+    # Add z coordinate to make the points compatible with the 3d homography matrix
+    vecs = np.c_[vecs, np.ones(len(vecs), dtype=vecs.dtype)]
+
+    pts = vecs @ H.T
+    # Normalize the output points (we want 1 in the last column, i.e. z=1)
+    pts_norm = pts/pts[:, 2:3]
+    return pts_norm[:, 0:2]
@@ -0,0 +1,69 @@
+import json
+import uuid
+import hashlib
+from typing import Any, Callable
+from celery import states
+from celery.result import AsyncResult
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+# Tasks are attached to for at most this long (must not exceed the expiry of the results in the Celery result backend)
+INFLIGHT_TASK_TTL_SECONDS = 12 * 3600
+# Delete the key only if it still holds the value (i.e. no other request replaced it meanwhile)
+_DELETE_IF_EQUAL_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+def _is_task_failed(task_id: str) -> bool:
+    return AsyncResult(task_id).state in states.PROPAGATE_STATES
+
+class InFlightTaskRegistry:
+    """
+    Registry of the analysis tasks by video checksum and analysis parameters in Redis,
+    so that identical uploads attach to the task of the first one instead of analysing the same video again.
+    A task is attached to until it fails (then the next upload submits a new task) or its registration expires.
+    Args:
+        redis_client (redis.Redis): client of the Redis server
+        ttl_seconds (int): registration time of a task
+        is_task_failed (Callable[str]): function checking whether the task with the id failed (or was revoked)
+    """
+    def __init__(self, redis_client: Any, ttl_seconds: int=INFLIGHT_TASK_TTL_SECONDS,
+                 is_task_failed: Callable[[str], bool]=_is_task_failed):
+        self._redis_client = redis_client
+        self._ttl_seconds = ttl_seconds
+        self._is_task_failed = is_task_failed
+
+    def get_or_submit(self, video_sha256sum: str, params: dict[str, Any], submit: Callable[[str], None]) -> str:
+        """
+        Get the id of the task analysing the video with the parameters, submitting a new task if there is none.
+        Args:
+            video_sha256sum (str): checksum of the video
+            params (dict): analysis parameters (JSON serializable)
+            submit (Callable[str]): function submitting the task with the given task id
+        Return:
+            id of the task
+        """
+        key = self._make_key(video_sha256sum, params)
+        while True:
+            task_id = str(uuid.uuid4())
+            # NB - the task is registered before it's submitted, so that concurrent identical uploads submit a single task
+            if self._redis_client.set(key, task_id, nx=True, ex=self._ttl_seconds):
+                try:
+                    submit(task_id)
+                except BaseException:
+                    self._redis_client.eval(_DELETE_IF_EQUAL_SCRIPT, 1, key, task_id)
+                    raise
+                return task_id
+
+            registered_task_id = self._redis_client.get(key)
+            if registered_task_id is None:
+                # The registration expired meanwhile
+                continue
+            registered_task_id = registered_task_id.decode() if isinstance(registered_task_id, bytes) else registered_task_id
+            if not self._is_task_failed(registered_task_id):
+                logger.info(f"Attaching to task {registered_task_id} analysing video {video_sha256sum}")
+                return registered_task_id
+            self._redis_client.eval(_DELETE_IF_EQUAL_SCRIPT, 1, key, registered_task_id)
+
+    def _make_key(self, video_sha256sum: str, params: dict[str, Any]) -> str:
+        params_sha256sum = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return f"ultimate:inflight:{video_sha256sum}:{params_sha256sum}"
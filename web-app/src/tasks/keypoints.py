@@ -32,6 +32,66 @@ class KeypointQuad:
     def __repr__(self) -> str:
         return f"Keypoint quad: Lines: {self._keypoint_line_keys}; Cls ids: {self._cls_ids}\n Keypoints: {self._keypoints}"
 
+class KeypointQuads:
+    """
+    Contains the best keypoint quadrangles for a series of video frames (one quad per frame).
+    Args:
+        keypoint_line_keys (np.ndarray): array of shape (F,2) of keypoint line identifiers ("" if no quad was found)
+        keypoints (np.ndarray): array of shape (F,4,2) of keypoint coordinates in YOLO normalized format (NaN if no quad was found)
+        cls_ids (np.ndarray): array of shape (F,4) of class ids identifying specific keypoints (-1 if no quad was found)
+        source_frames (np.ndarray): array of shape (F,) of frame numbers the quads were taken from (-1 if no quad was found)
+    """
+    def __init__(self, keypoint_line_keys: np.ndarray, keypoints: np.ndarray, cls_ids: np.ndarray, source_frames: np.ndarray):
+        self._keypoint_line_keys = keypoint_line_keys
+        self._keypoints = keypoints
+        self._cls_ids = cls_ids
+        self._source_frames = source_frames
+
+    """Keypoint line identifiers as numpy array of shape (F,2)"""
+    @property
+    def keypoint_line_keys(self):
+        return self._keypoint_line_keys
+
+    """Keypoints as numpy array of shape (F,4,2)"""
+    @property
+    def keypoints(self):
+        return self._keypoints
+
+    @property
+    def cls_ids(self):
+        return self._cls_ids
+
+    """Frame numbers the quads were taken from (they differ from the frame number after a look back)"""
+    @property
+    def source_frames(self):
+        return self._source_frames
+
+    """Mask of frames for which a quad was found"""
+    @property
+    def found(self):
+        return self._source_frames >= 0
+
+    def __len__(self) -> int:
+        return len(self._source_frames)
+
+    def __getitem__(self, frame_no: Union[int, slice]) -> Union[KeypointQuad, "KeypointQuads", None]:
+        if isinstance(frame_no, slice):
+            # NB - source frames keep their numbering, they aren't shifted to the start of the slice
+            return KeypointQuads(
+                keypoint_line_keys=self._keypoint_line_keys[frame_no],
+                keypoints=self._keypoints[frame_no],
+                cls_ids=self._cls_ids[frame_no],
+                source_frames=self._source_frames[frame_no])
+        if not self.found[frame_no]:
+            return None
+        return KeypointQuad(
+            keypoint_line_keys=self._keypoint_line_keys[frame_no].tolist(),
+            keypoints=self._keypoints[frame_no],
+            cls_ids=self._cls_ids[frame_no].tolist())
+
+    def __repr__(self) -> str:
+        return f"Keypoint quads: {len(self)} frames; {np.count_nonzero(self.found)} found"
+
 class KeypointsExtractor:
     """
     Initialize KeypointsExtractor.
@@ -46,7 +106,8 @@ class KeypointsExtractor:
         self._max_lookback = max_lookback
         # Filter and augment the prediction data with additional keypoint-specific columns
         self._all_frames_augmented_df = self._filter_and_augment_with_keypoint_columns(all_frames_df)
-        self._best_by_frame = {}
+        # Index the keypoints by frame once, so that all frames can be processed with array operations
+        self._keypoints_index = self._build_keypoints_index(self._all_frames_augmented_df)
 
     @property 
     def conf_threshold(self):
@@ -76,60 +137,78 @@ class KeypointsExtractor:
 
     _candidate_clsid_pairs = np.array([line["cls_ids"] for _, line in _lines_to_keypoints_map.items()])
 
+    # Keypoint lines and their class ids, sorted by the algorithm's preference (most preferred first)
+    _lines_by_pref = np.array([key for key, _ in sorted(_lines_to_keypoints_map.items(), key=lambda item: item[1]["pref"])])
+    _clsid_pairs_by_pref = np.array([line["cls_ids"] for _, line in sorted(_lines_to_keypoints_map.items(), key=lambda item: item[1]["pref"])])
+
     def get_4_best_keypoint_pairs(self, frame_no: int) -> Union[KeypointQuad, None]:
         """
         Calculate 4 best keypoint pairs.
         Args:
             frame_no (int): image/video frame number
         """
+        return self.get_all_best_keypoint_quads(total_frames=frame_no+1)[frame_no]
 
-        # Run in a loop. If no eligible lines forming the 4 corner keypoints were found, try to look back.
-        for frame_to_look in range(frame_no, frame_no-self.max_lookback, -1):
-            df = self._all_frames_augmented_df[self._all_frames_augmented_df["frame"]==frame_to_look]
-            result = self._best_by_frame[frame_no] if frame_no in self._best_by_frame else self._get_4_best_keypoint_pairs_internal(df, frame_no=frame_to_look)
-            if result is not None:
-                if frame_no not in self._best_by_frame:
-                    self._best_by_frame[frame_no] = result
-                return result
-        return None # Give up after looking at N frames back
+    def get_all_best_keypoint_quads(self, total_frames: int) -> KeypointQuads:
+        """
+        Calculate 4 best keypoint pairs for all frames at once.
+        If no eligible lines forming the 4 corner keypoints were found in a frame,
+        the quad of the nearest previous frame (up to max_lookback frames back) is used.
+        Args:
+            total_frames (int): number of image/video frames
+        """
+        present = self._keypoints_index[:total_frames, :, 2].astype(bool)
+        frames_indexed = len(present)
+        # Lines (sorted by preference) with both keypoints present, shape (F,4)
+        complete_lines = present.reshape(frames_indexed, -1, 2).all(axis=2)
+        has_quad = np.zeros(total_frames, dtype=bool)
+        has_quad[:frames_indexed] = complete_lines.sum(axis=1) >= 2
+        # Take the 2 most preferred complete lines
+        first_line = np.argmax(complete_lines, axis=1)
+        remaining_lines = complete_lines.copy()
+        remaining_lines[np.arange(frames_indexed), first_line] = False
+        second_line = np.argmax(remaining_lines, axis=1)
+        best_lines = np.stack([first_line, second_line], axis=1)
+
+        # Look back: use the latest frame with a quad, if it's less than max_lookback frames back
+        frame_nos = np.arange(total_frames)
+        latest_with_quad = np.maximum.accumulate(np.where(has_quad, frame_nos, -1))
+        found = (latest_with_quad >= 0) & (frame_nos - latest_with_quad < self.max_lookback)
+        source_frames = np.where(found, latest_with_quad, -1)
+
+        keypoint_line_keys = np.full((total_frames, 2), "", dtype=self._lines_by_pref.dtype)
+        keypoints = np.full((total_frames, 4, 2), np.nan, dtype=np.float32)
+        cls_ids = np.full((total_frames, 4), -1, dtype=int)
+        found_lines = best_lines[source_frames[found]]
+        keypoint_line_keys[found] = self._lines_by_pref[found_lines]
+        # Keypoint positions in the index, i.e. [left, right] of the first and second line
+        keypoint_positions = (found_lines[:, :, None]*2 + np.arange(2)).reshape(-1, 4)
+        keypoints[found] = self._keypoints_index[source_frames[found][:, None], keypoint_positions, 0:2]
+        cls_ids[found] = self._clsid_pairs_by_pref.flatten()[keypoint_positions]
 
+        return KeypointQuads(
+            keypoint_line_keys=keypoint_line_keys,
+            keypoints=keypoints,
+            cls_ids=cls_ids,
+            source_frames=source_frames)
 
-    def _get_4_best_keypoint_pairs_internal(self, df: pd.DataFrame, frame_no: int) -> Union[KeypointQuad, None]:
+    def _build_keypoints_index(self, df: pd.DataFrame) -> np.ndarray:
         """
-        Calculate 4 best keypoint pairs.
+        Build a dense keypoint index of shape (frames, 8, 3).
+        The second axis follows the keypoint lines sorted by preference (left keypoint first),
+        the last axis holds x, y and whether the keypoint is present (1) or not (0).
         Args:
-            df (pd.DataFrame): DataFrame containing prediction data for a single image/video frame (possibly augmented)
-            frame_no (int): image/video frame number
+            df (pd.DataFrame): DataFrame containing filtered keypoint predictions (unique cls per frame)
         """
-        # Count the number of keypoints in each keypoint line group
-        df_agg = df.groupby("keypoint_line").agg(count=("keypoint_line", "count")).reset_index()
-        df_agg["keypoint_line_pref"] = df_agg["keypoint_line"].apply(lambda c: self._lines_to_keypoints_map[c]["pref"])
-        # Sort the keypoint lines by number of keypoints present and preference
-        s_keypoints_by_count_and_pref = df_agg.sort_values(by=["count", "keypoint_line_pref"]).set_index("keypoint_line")["count"]
-        
-        # Sanity check - a situation with multiple keypoints instances of the same class may indicate a problem with the model
-        if len(s_keypoints_by_count_and_pref[s_keypoints_by_count_and_pref >=3]) > 0:
-            raise ValueError(f"Detected more than 3 keypoints of same type in frame {frame_no}")
-        
-        s_at_least_2 = s_keypoints_by_count_and_pref[s_keypoints_by_count_and_pref == 2]
-        if len(s_at_least_2) < 2:
-            # Not enough keypoint candidates
-            return None
-        keypoint_line_keys_top_2 = list(s_at_least_2.keys())[0:2]
-        keypoint_coords_list = []
-        keypoint_cls_ids = []
-        for key in keypoint_line_keys_top_2:
-            for clsid in self._lines_to_keypoints_map[key]["cls_ids"]:
-                # NB - the assumption is that there's only 1 cls in a given dataframe for a single frame
-                index_mask = df["cls"]==clsid
-                coords = np.float32(df.loc[index_mask, "x":"y"]).squeeze()
-                keypoint_coords_list.append(coords)
-                keypoint_cls_ids.append(clsid)
+        frames = df["frame"].to_numpy(dtype=int)
+        frames_count = frames.max() + 1 if len(frames) > 0 else 0
+        clsid_to_position = pd.Series(np.arange(self._clsid_pairs_by_pref.size), index=self._clsid_pairs_by_pref.flatten())
+        positions = clsid_to_position[df["cls"]].to_numpy()
 
-        return KeypointQuad(
-            keypoint_line_keys=keypoint_line_keys_top_2, 
-            keypoints=np.stack(keypoint_coords_list),
-            cls_ids=keypoint_cls_ids)
+        keypoints_index = np.zeros((frames_count, self._clsid_pairs_by_pref.size, 3), dtype=np.float32)
+        keypoints_index[frames, positions, 0:2] = df[["x", "y"]].to_numpy(dtype=np.float32)
+        keypoints_index[frames, positions, 2] = 1
+        return keypoints_index
 
     def _filter_and_augment_with_keypoint_columns(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -0,0 +1,142 @@
+import os
+import time
+import fcntl
+from collections import OrderedDict
+from typing import Callable, Union
+import numpy as np
+import torch
+import ultralytics
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+MAX_LOADED_MODELS = int(os.getenv("MAX_LOADED_MODELS", 2))
+WARMUP_IMAGE_SIZE = 640
+
+# Inference backends: the .pt model run by PyTorch, or the model exported to ONNX Runtime / OpenVINO
+TORCH_BACKEND = "torch"
+ONNX_BACKEND = "onnx"
+OPENVINO_BACKEND = "openvino"
+# Names of the exported artifacts (as created by Ultralytics next to the .pt model), by backend
+_exported_model_names = {
+    ONNX_BACKEND: "{stem}.onnx",
+    OPENVINO_BACKEND: "{stem}_openvino_model",
+}
+
+def get_device():
+    # NB - if torch package is installed in the CPU variant, the device will default to "cpu"
+    return 0 if torch.cuda.is_available() else "cpu"
+
+def get_model_backend() -> str:
+    """
+    Get the inference backend configured by the MODEL_BACKEND environment variable (default: torch).
+    """
+    backend = os.getenv("MODEL_BACKEND", TORCH_BACKEND)
+    backends = [TORCH_BACKEND, *_exported_model_names]
+    if backend not in backends:
+        raise ValueError(f"Unknown model backend {backend}, expected one of {backends}")
+    return backend
+
+def get_backend_model_path(model_path: str, backend: str, export: bool=True) -> Union[str, None]:
+    """
+    Get the path of the model artifact for the backend.
+    The .pt model is exported on first use (or when it's newer than the exported artifact) and the export is kept next to it.
+    Args:
+        model_path (str): path to the .pt model file
+        backend (str): inference backend ("torch", "onnx" or "openvino")
+        export (bool): export the model if needed (False = return None instead, e.g. where the export would take too long)
+    Return:
+        Path to the model file (.pt, .onnx) or directory (OpenVINO)
+    """
+    if backend == TORCH_BACKEND:
+        return model_path
+    stem, _ = os.path.splitext(os.path.basename(model_path))
+    exported_path = os.path.join(os.path.dirname(model_path), _exported_model_names[backend].format(stem=stem))
+    if not os.path.isfile(model_path) or _is_up_to_date(exported_path, model_path):
+        return exported_path
+    if not export:
+        return None
+
+    # NB - worker processes start at the same time, only one of them exports the model
+    with open(f"{exported_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not _is_up_to_date(exported_path, model_path):
+            start = time.perf_counter()
+            ultralytics.YOLO(model_path).export(format=backend)
+            logger.info(f"Exported YOLO model {model_path} to {exported_path} in {time.perf_counter() - start:.2f}s")
+    return exported_path
+
+def _is_up_to_date(exported_path: str, model_path: str) -> bool:
+    return os.path.exists(exported_path) and _get_mtime(exported_path) >= _get_mtime(model_path)
+
+def _get_mtime(path: str) -> float:
+    """
+    Get the modification time of a model file, or of the latest file in a model directory (OpenVINO models).
+    """
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    return max([os.path.getmtime(entry.path) for entry in os.scandir(path)], default=os.path.getmtime(path))
+
+def load_and_warm_up_model(model_path: str) -> ultralytics.YOLO:
+    """
+    Load a YOLO model and run a dummy inference, so that the first video doesn't pay the warm-up cost.
+    Args:
+        model_path (str): path to the model file
+    Return:
+        The loaded YOLO model
+    """
+    start = time.perf_counter()
+    # NB - the task of exported models can't always be guessed from the file
+    model = ultralytics.YOLO(model_path, task="detect", verbose=True)
+    loaded = time.perf_counter()
+    dummy_img = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+    model.predict(source=dummy_img, device=get_device(), verbose=False)
+    warmed_up = time.perf_counter()
+    logger.info(f"Loaded YOLO model {model_path} in {loaded - start:.2f}s, warm-up inference took {warmed_up - loaded:.2f}s")
+    return model
+
+class ModelRegistry:
+    """
+    Per-process registry of loaded YOLO models.
+    Models are keyed by model path and file modification time, so that a replaced model file is loaded again.
+    Only the most recently used models are kept in memory.
+    Args:
+        max_models (int): maximum number of models kept in memory
+        load_model (Callable[str]): function loading a model from a path
+    """
+    def __init__(self, max_models: int=MAX_LOADED_MODELS, load_model: Callable=load_and_warm_up_model):
+        self._max_models = max_models
+        self._load_model = load_model
+        self._models = OrderedDict()
+
+    @property
+    def max_models(self):
+        return self._max_models
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def get_model(self, model_path: str) -> ultralytics.YOLO:
+        """
+        Get a ready-to-use model, loading it if it isn't in the registry yet.
+        Args:
+            model_path (str): path to the model file (or directory, for OpenVINO models)
+        """
+        path = os.path.abspath(model_path)
+        key = (path, _get_mtime(path))
+        if key in self._models:
+            self._models.move_to_end(key)
+            return self._models[key]
+
+        # Drop previous versions of the model file
+        for stale_key in [k for k in self._models if k[0] == path]:
+            logger.info(f"Model file {path} changed, dropping the previously loaded model")
+            del self._models[stale_key]
+        model = self._load_model(model_path)
+        self._models[key] = model
+        while len(self._models) > self._max_models:
+            (evicted_path, _), _ = self._models.popitem(last=False)
+            logger.info(f"Evicted the least recently used model {evicted_path}")
+        return model
+
+model_registry = ModelRegistry()
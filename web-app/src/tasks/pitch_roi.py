@@ -0,0 +1,116 @@
+import math
+from typing import Union
+import numpy as np
+import torch
+import ultralytics
+
+# Classes of the pitch keypoints (corners and line ends)
+PITCH_KEYPOINT_CLASSES = list(range(31, 43))
+
+class PitchRoi:
+    """
+    Region of interest of the video frames covering the pitch, so that the inference skips the stands and the sky.
+    The ROI is the bounding box of the pitch keypoints (classes 31-42) detected in full frames, padded on each side.
+    Full frames are tracked in estimation windows: the first estimation_frames frames and again every reestimate_every frames
+    (in case the camera moved); the ROI is estimated at the end of each window and used until the next one.
+    Args:
+        padding (float): padding of the keypoints' bounding box on each side, as a ratio of its width and height
+        conf_threshold (float): confidence threshold to recognize a keypoint as valid
+        min_keypoints (int): minimum number of keypoint detections in an estimation window (otherwise the full frames are tracked)
+        estimation_frames (int): number of full frames per estimation window
+        reestimate_every (int): number of frames between the starts of estimation windows
+    """
+    def __init__(self, padding: float=0.15, conf_threshold: float=0.5, min_keypoints: int=4, estimation_frames: int=10,
+                 reestimate_every: int=300):
+        if not 0 < estimation_frames <= reestimate_every:
+            raise ValueError(f"Estimation window must be between 1 and {reestimate_every} frames, got {estimation_frames}")
+        self._padding = padding
+        self._conf_threshold = conf_threshold
+        self._min_keypoints = min_keypoints
+        self._estimation_frames = estimation_frames
+        self._reestimate_every = reestimate_every
+        self._box = None
+        self._keypoints = []
+        self._frame_shape = None
+
+    """ROI box (x1, y1, x2, y2) in pixels of the full frame, None if it wasn't estimated (yet)"""
+    @property
+    def box(self):
+        return self._box
+
+    def is_estimation_frame(self, frame_index: int) -> bool:
+        """
+        Whether the frame (counted from the first tracked frame) is tracked in full to estimate the ROI.
+        """
+        return frame_index % self._reestimate_every < self._estimation_frames
+
+    def get_box(self, frame_index: int) -> Union[tuple[int, int, int, int], None]:
+        """
+        Get the ROI box to crop the frame to, or None if the full frame is to be tracked.
+        """
+        return None if self.is_estimation_frame(frame_index) else self._box
+
+    def observe(self, frame_index: int, result: ultralytics.engine.results.Results) -> None:
+        """
+        Collect the pitch keypoints detected in a full frame, and estimate the ROI at the end of an estimation window.
+        Args:
+            frame_index (int): frame number counted from the first tracked frame
+            result (ultralytics.engine.results.Results): detections in the frame, in full-frame coordinates
+        """
+        if not self.is_estimation_frame(frame_index):
+            return
+        self._frame_shape = result.orig_shape
+        boxes = result.boxes
+        if boxes is not None and len(boxes) > 0:
+            is_keypoint = np.isin(boxes.cls.cpu().numpy(), PITCH_KEYPOINT_CLASSES) & (boxes.conf.cpu().numpy() > self._conf_threshold)
+            self._keypoints.append(boxes.xywh.cpu().numpy()[is_keypoint, 0:2])
+        if frame_index % self._reestimate_every == self._estimation_frames - 1:
+            self._box = self._estimate_box()
+            self._keypoints = []
+
+    def crop(self, frame: np.ndarray, box: tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Crop the frame to the ROI box (without copying).
+        """
+        x1, y1, x2, y2 = box
+        return frame[y1:y2, x1:x2]
+
+    def to_full_frame(self, result: ultralytics.engine.results.Results, frame: np.ndarray,
+                      box: tuple[int, int, int, int]) -> ultralytics.engine.results.Results:
+        """
+        Map the detections in a frame cropped to the ROI box back to the full frame.
+        Return:
+            Results with the full frame as the original image and the boxes in full-frame coordinates
+        """
+        data = torch.as_tensor(result.boxes.data).clone()
+        x1, y1, _, _ = box
+        data[:, [0, 2]] += x1
+        data[:, [1, 3]] += y1
+        return ultralytics.engine.results.Results(orig_img=frame, path=result.path, names=result.names, boxes=data, speed=result.speed)
+
+    def get_imgsz(self, box: tuple[int, int, int, int], frame_shape: tuple[int, int], imgsz: int, stride: int=32) -> int:
+        """
+        Get the inference image size for frames cropped to the ROI box, keeping the resolution of the full frames
+        inferred at imgsz (the crop is smaller, so is its inference image).
+        Args:
+            box (tuple[int, int, int, int]): ROI box (x1, y1, x2, y2)
+            frame_shape (tuple[int, int]): shape of the full frames (height, width)
+            imgsz (int): inference image size of the full frames
+            stride (int): model stride, the image size is rounded up to its multiple
+        """
+        x1, y1, x2, y2 = box
+        scale = imgsz / max(frame_shape[:2])
+        roi_imgsz = math.ceil(max(x2 - x1, y2 - y1) * scale / stride) * stride
+        return min(max(roi_imgsz, stride), imgsz)
+
+    def _estimate_box(self) -> Union[tuple[int, int, int, int], None]:
+        keypoints = np.concatenate(self._keypoints) if self._keypoints else np.empty((0, 2))
+        if len(keypoints) < self._min_keypoints:
+            return None
+        (x1, y1), (x2, y2) = keypoints.min(axis=0), keypoints.max(axis=0)
+        pad_x, pad_y = (x2 - x1) * self._padding, (y2 - y1) * self._padding
+        height, width = self._frame_shape[:2]
+        box = (int(max(x1 - pad_x, 0)), int(max(y1 - pad_y, 0)), int(min(math.ceil(x2 + pad_x), width)), int(min(math.ceil(y2 + pad_y), height)))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None
+        return box
@@ -1,31 +1,161 @@
 
 import os
 import pickle
-from typing import Union
-import ultralytics
-import hashlib
+import tempfile
+from collections.abc import Mapping
+from typing import Iterator, Union
+import numpy as np
 from pathlib import Path
 from celery.utils.log import get_task_logger
+from .video_hash import get_video_sha256sum
 
 logger = get_task_logger(__name__)
 
-def get_precalculated_results_if_present(video_path: str) -> Union[list[ultralytics.engine.results.Results], None]:
+# Version of the columnar results format, part of the file name (<sha256>[.stride<n>].v<version>.npy)
+RESULTS_FORMAT_VERSION = 1
+# One row per detection, sorted by frame
+_RESULTS_ROW_DTYPE = np.dtype([("frame", "<i4"), ("cls", "u1"), ("team", "i1"), ("id", "<i4"), ("x", "<f4"), ("y", "<f4")])
+# The same with float64 coordinates, decoded to exactly the analysed values (e.g. for the result cache)
+_EXACT_RESULTS_ROW_DTYPE = np.dtype([("frame", "<i4"), ("cls", "u1"), ("team", "i1"), ("id", "<i4"), ("x", "<f8"), ("y", "<f8")])
+
+class PrecalculatedResults(Mapping):
+    """
+    Final video analysis results (frame number as str -> list of detection dicts) stored as a table of detections,
+    one row per detection sorted by frame, with float32 (or exact float64) coordinates and small integer class, team and id columns.
+    Loaded from a file, the table is memory-mapped: the rows are read and converted to dicts only for the requested frames.
+    Args:
+        rows (np.ndarray): structured array of the detections (frame, cls, team, id, x, y), sorted by frame
+    """
+    def __init__(self, rows: np.ndarray):
+        if rows.dtype not in (_RESULTS_ROW_DTYPE, _EXACT_RESULTS_ROW_DTYPE):
+            raise ValueError(f"Unexpected results columns {rows.dtype}, expected {_RESULTS_ROW_DTYPE}")
+        self._rows = rows
+
+    @classmethod
+    def load(cls, path: str) -> "PrecalculatedResults":
+        """
+        Memory-map the results file (<sha256>[.stride<n>].v<version>.npy).
+        """
+        return cls(np.load(path, mmap_mode="r"))
+
+    @classmethod
+    def from_dict(cls, results: dict, exact_coordinates: bool=False) -> "PrecalculatedResults":
+        """
+        Convert final video analysis results (e.g. unpickled from a legacy .pickle file) to a table of detections.
+        Args:
+            results (dict): final video analysis results
+            exact_coordinates (bool): store the coordinates as float64 instead of float32 (twice the size of the coordinate columns)
+        """
+        frames = sorted(results, key=int)
+        row_dtype = _EXACT_RESULTS_ROW_DTYPE if exact_coordinates else _RESULTS_ROW_DTYPE
+        rows = np.empty(sum(len(results[frame]) for frame in frames), dtype=row_dtype)
+        records = [record for frame in frames for record in results[frame]]
+        rows["frame"] = np.repeat([int(frame) for frame in frames], [len(results[frame]) for frame in frames])
+        for column in ["cls", "team", "id", "x", "y"]:
+            rows[column] = [record[column] for record in records]
+        return cls(rows)
+
+    def save(self, path: str) -> None:
+        """
+        Write the results file, atomically (readers never see a partially written file).
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".results-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(self._rows))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get_frame_range(self, start_frame: Union[int, None]=None, end_frame: Union[int, None]=None) -> dict:
+        """
+        Decode the results of a range of frames.
+        Args:
+            start_frame (int): first frame (None = from the first frame)
+            end_frame (int): frame to stop at, exclusive (None = until the last frame)
+        Return:
+            dict of lists of detection dicts (cls, x, y, team, id), keyed by frame number as str
+        """
+        frame_column = self._rows["frame"]
+        # NB - binary search in the memory-mapped frame column only reads a few pages
+        start = 0 if start_frame is None else np.searchsorted(frame_column, start_frame, side="left")
+        end = len(frame_column) if end_frame is None else np.searchsorted(frame_column, end_frame, side="left")
+        rows = self._rows[start:end]
+        records = [dict(cls=cls, x=x, y=y, team=team, id=id) for cls, x, y, team, id in
+                   zip(*[rows[column].tolist() for column in ["cls", "x", "y", "team", "id"]])]
+        frames_present, block_starts = np.unique(rows["frame"], return_index=True)
+        block_ends = np.r_[block_starts[1:], len(records)]
+        return {str(frame): records[block_start:block_end] for frame, block_start, block_end
+                in zip(frames_present.tolist(), block_starts, block_ends)}
+
+    def to_dict(self) -> dict:
+        """
+        Decode the results of all the frames.
+        """
+        return self.get_frame_range()
+
+    def __getitem__(self, frame: str) -> list[dict]:
+        frame_results = self.get_frame_range(int(frame), int(frame) + 1)
+        if str(frame) not in frame_results:
+            raise KeyError(frame)
+        return frame_results[str(frame)]
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(frame) for frame in np.unique(self._rows["frame"]).tolist())
+
+    def __len__(self) -> int:
+        return len(np.unique(self._rows["frame"]))
+
+def get_results_file_name(video_sha256sum: str, frame_stride: int=1) -> str:
+    """
+    Get the name of the results file of the video with the SHA-256 checksum.
+    The results of an analysis tracking every n-th frame only (frame_stride > 1, the other frames interpolated) have the stride in the name.
+    """
+    stride_suffix = f".stride{frame_stride}" if frame_stride > 1 else ""
+    return f"{video_sha256sum}{stride_suffix}.v{RESULTS_FORMAT_VERSION}.npy"
+
+def convert_pickled_results(pickle_path: str) -> str:
+    """
+    Convert a legacy <sha256>.pickle results file to the columnar format, next to it.
+    Return:
+        path to the results file
+    """
+    with open(pickle_path, "rb") as f:
+        results = PrecalculatedResults.from_dict(pickle.load(f))
+    video_sha256sum = Path(pickle_path).name.removesuffix(".pickle")
+    results_path = str(Path(pickle_path).parent/get_results_file_name(video_sha256sum))
+    results.save(results_path)
+    return results_path
+
+def get_precalculated_results_if_present(video_path: str, frame_stride: int=1) -> Union[PrecalculatedResults, None]:
+    """
+    Get the precalculated results of the video analysed with the frame stride (legacy pickled results are all from stride 1).
+    """
     precalculated_dir = os.getenv("PRECALCULATED_DATA_DIR")
     if precalculated_dir is None or precalculated_dir == "":
          logger.info("PRECALCULATED_DATA_DIR not set, skipping")
          return None
-    
-    video_sha256sum = _calculate_sha256sum(video_path)
+
+    # NB - the checksum is indexed by file identity, the video is only read end-to-end if it wasn't hashed before
+    video_sha256sum = get_video_sha256sum(video_path)
+    maybe_results_path = Path(precalculated_dir)/get_results_file_name(video_sha256sum, frame_stride=frame_stride)
+    if maybe_results_path.is_file():
+        logger.info(f"Found precalculated results for video {video_path} saved as {maybe_results_path.name} in {precalculated_dir}")
+        return PrecalculatedResults.load(str(maybe_results_path))
+    if frame_stride > 1:
+        logger.info(f"Did not find {maybe_results_path.name} in {precalculated_dir}")
+        return None
     maybe_pickled_results_path = Path(precalculated_dir)/(video_sha256sum + ".pickle")
     if os.path.exists(maybe_pickled_results_path) and os.path.isfile(maybe_pickled_results_path):
-        logger.info(f"Found previously pickled results for video {video_path} saved as {maybe_pickled_results_path.name} in {precalculated_dir}")
-        with open(maybe_pickled_results_path, "rb") as f:
-            precalculated_results = pickle.load(f)
-            return precalculated_results
-    logger.info(f"Did not find {maybe_pickled_results_path.name} in {precalculated_dir}")
+        logger.info(f"Found previously pickled results for video {video_path} saved as {maybe_pickled_results_path.name} in {precalculated_dir}, "
+                    f"converting them to {maybe_results_path.name}")
+        try:
+            return PrecalculatedResults.load(convert_pickled_results(str(maybe_pickled_results_path)))
+        except OSError as e:
+            # NB - e.g. a read-only directory, the results are then converted again on every lookup
+            logger.warning(f"Could not save the converted results in {precalculated_dir} ({e}), converting them in memory")
+            with open(maybe_pickled_results_path, "rb") as f:
+                return PrecalculatedResults.from_dict(pickle.load(f))
+    logger.info(f"Did not find {maybe_results_path.name} nor {maybe_pickled_results_path.name} in {precalculated_dir}")
     return None
-    
-    
-def _calculate_sha256sum(filename):
-    with open(filename, 'rb', buffering=0) as f:
-        return hashlib.file_digest(f, 'sha256').hexdigest()
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import tempfile
+from typing import Any, Callable, Union
+from celery.utils.log import get_task_logger
+from .precalculated import PrecalculatedResults
+
+logger = get_task_logger(__name__)
+
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", 2048))
+# Version of the cache entries, part of the key (entries of older versions are never hit and get evicted eventually)
+RESULT_CACHE_FORMAT_VERSION = 2
+
+class AnalysisResultCache:
+    """
+    Size-bounded cache of video analysis results on disk, keyed by the content of the inputs
+    (video checksum, model checksum and analysis parameters), so that a video uploaded again is not analysed again.
+    An entry is the coordinates in the columnar format of the precalculated results (<key>.npy, memory-mapped on read),
+    with float64 coordinates so that a cached result equals the result of a new analysis,
+    and the other fields of the result (<key>.json). The entry appears atomically with its .npy file, written last.
+    The least recently used entries are evicted once the cache exceeds max_bytes (a hit refreshes the entry's modification time).
+    Args:
+        cache_dir (str): directory of the cache entries (created if missing)
+        max_bytes (int): disk budget of the cache
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    """Disk budget of the cache"""
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @staticmethod
+    def make_key(video_sha256sum: str, model_sha256sum: str, params: dict[str, Any]) -> str:
+        """
+        Make the cache key of an analysis.
+        Args:
+            video_sha256sum (str): checksum of the video
+            model_sha256sum (str): checksum of the model file
+            params (dict): analysis parameters affecting the result (JSON serializable)
+        """
+        inputs = json.dumps(dict(video=video_sha256sum, model=model_sha256sum, params=params,
+                                 format=RESULT_CACHE_FORMAT_VERSION), sort_keys=True)
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    def get(self, key: str) -> Union[dict, None]:
+        """
+        Get the cached analysis result, or None if it isn't cached (or was evicted meanwhile).
+        """
+        coordinates_path, fields_path = self._get_entry_paths(key)
+        try:
+            with open(fields_path, "r") as f:
+                fields = json.load(f)
+            coordinates = PrecalculatedResults.load(coordinates_path).to_dict()
+            os.utime(coordinates_path)
+        except FileNotFoundError:
+            return None
+        logger.info(f"Found cached analysis result {key}")
+        return {**fields, "coordinates": coordinates}
+
+    def put(self, key: str, result: dict) -> None:
+        """
+        Cache the analysis result (a dict with "coordinates" and other JSON serializable fields) and evict the least recently used entries.
+        """
+        coordinates_path, fields_path = self._get_entry_paths(key)
+        fields = {name: value for name, value in result.items() if name != "coordinates"}
+        self._write_atomically(fields_path, lambda f: f.write(json.dumps(fields).encode()))
+        PrecalculatedResults.from_dict(result["coordinates"], exact_coordinates=True).save(coordinates_path)
+        logger.info(f"Cached analysis result {key} ({os.path.getsize(coordinates_path) / 2**20:.1f}MB)")
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits its disk budget.
+        """
+        entries = []
+        for entry in os.scandir(self._cache_dir):
+            key, extension = os.path.splitext(entry.name)
+            if extension != ".npy" or not entry.is_file():
+                continue
+            try:
+                fields_size = os.path.getsize(self._get_entry_paths(key)[1])
+                entries.append((entry.stat().st_mtime, entry.stat().st_size + fields_size, key))
+            except FileNotFoundError:
+                # NB - entries are evicted by other worker processes concurrently
+                continue
+        cache_bytes = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if cache_bytes <= self._max_bytes:
+                break
+            for path in self._get_entry_paths(key):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            cache_bytes -= size
+            logger.info(f"Evicted the least recently used analysis result {key}")
+
+    def _get_entry_paths(self, key: str) -> tuple[str, str]:
+        return os.path.join(self._cache_dir, f"{key}.npy"), os.path.join(self._cache_dir, f"{key}.json")
+
+    def _write_atomically(self, path: str, write: Callable) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, prefix=".entry-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+def get_result_cache() -> Union[AnalysisResultCache, None]:
+    """
+    Get the analysis result cache in RESULT_CACHE_DIR, with a disk budget of RESULT_CACHE_MAX_MB (None if RESULT_CACHE_DIR isn't set).
+    """
+    cache_dir = os.getenv("RESULT_CACHE_DIR")
+    if cache_dir is None or cache_dir == "":
+        return None
+    return AnalysisResultCache(cache_dir, max_bytes=RESULT_CACHE_MAX_MB * 2**20)
@@ -1,49 +1,171 @@
-from typing import Any, Callable
-from celery import shared_task
+from typing import Any, Callable, Iterable, Iterator, Union
+from celery import shared_task, chord, states, uuid
 from celery import Task
+from celery.signals import worker_process_init
 from celery.utils.log import get_task_logger
-from .yolo_helper import make_callback_adapter_with_counter, convert_tracking_results_to_pandas
+from .yolo_helper import make_callback_adapter_with_counter, convert_tracking_results_to_pandas, iter_tracking_table_chunks, TEAMS_PER_FRAME
+from .yolo_helper import count_batch_images
+from .yolo_helper import TrackingTableBuilder, predict_teams_from_ring, lookup_frame_teams, APPEARANCE_REFRESH_EVERY
 from .keypoints import KeypointsExtractor
-from .homography import calculate_homography_matrix, convert_h
+from .homography import HomographyCache, convert_h_batch
 from .precalculated import get_precalculated_results_if_present
+from .result_cache import AnalysisResultCache, get_result_cache
+from .video_hash import get_video_sha256sum
+from .model_registry import model_registry, get_device, get_model_backend, get_backend_model_path, TORCH_BACKEND
+from .chunks import split_frame_ranges, stitch_chunk_tables
+from .frame_source import PrefetchingFrameReader
+from .frame_ring import SharedFrameRing, get_video_frame_shape, decode_video_into_ring
+from .pitch_roi import PitchRoi
+from .disc_focus import DiscFocus, DISC_CLASS
+import billiard
 import ultralytics
+from ultralytics.models.yolo.detect import DetectionPredictor
+from ultralytics.utils import callbacks
 import cv2
+import itertools
 import os
+import queue
+import time
+import weakref
 import pandas as pd
 import numpy as np
-import torch
 
 logger = get_task_logger(__name__)
 
 CONF_THRESHOLD=0.5
 MAX_LOOKBACK=60
+# Keypoint quads closer than this (in YOLO normalized coordinates) share a homography matrix; 0 = identical quads only
+HOMOGRAPHY_TOLERANCE=0.0
+# In streaming mode, the coordinates are published every n frames
+STREAM_CHUNK_FRAMES=150
+# In parallel mode, the video is split into ranges of n frames, each overlapping the previous one to stitch the track ids
+PARALLEL_CHUNK_FRAMES=1800
+PARALLEL_CHUNK_OVERLAP=30
+# Number of decoded frames buffered ahead of the inference
+FRAME_PREFETCH=8
+# Number of frames per forward pass of the model (torch backend only, the exported models have a static batch size of 1)
+FRAME_BATCH=8
+# Crop the frames to the pitch, estimated from the keypoints detected in full frames every PITCH_ROI_REESTIMATE_EVERY frames,
+# and infer the crops at a smaller image size (torch backend only, the exported models have a static image size)
+PITCH_ROI_INFERENCE=os.getenv("PITCH_ROI_INFERENCE") == "True"
+PITCH_ROI_ESTIMATION_FRAMES=10
+PITCH_ROI_REESTIMATE_EVERY=300
+# Infer the full frames at a lower image size and detect the disc in a high-resolution crop around its position predicted
+# from its recent trajectory (torch backend only; the crop has no extra resolution if RESIZE_FRAMES_TO_MODEL_INPUT is set)
+DISC_FOCUS_INFERENCE=os.getenv("DISC_FOCUS_INFERENCE") == "True"
+DISC_FOCUS_FRAME_IMGSZ=480
+DISC_FOCUS_CROP_SIZE=320
+DISC_FOCUS_MAX_MISSING_FRAMES=15
+# Downscale the decoded frames to the model input size in the decoding thread (saves the resize in the inference thread,
+# but team detection then crops the players from the downscaled frames)
+RESIZE_FRAMES_TO_MODEL_INPUT=False
+# In multi-process mode, number of decoded frames shared by the tracking and the team detection process
+# (a 1080p frame takes ~6MB of shared memory)
+FRAME_RING_SLOTS=16
+
+# Predictors detecting the disc in crops by model (dropped with the model, once the model registry evicted it) and image size
+_crop_predictors = weakref.WeakKeyDictionary()
+
+@worker_process_init.connect
+def _load_model_on_worker_process_init(**kwargs) -> None:
+    """
+    Load and warm up the YOLO model once per Celery worker process, before the first task arrives.
+    NB - Celery kills the worker processes not ready within worker_proc_alive_timeout, so the model isn't exported here
+    """
+    model_path = _get_model_path(export=False)
+    if model_path is None or not os.path.exists(model_path):
+        logger.warning(f"Model for backend {get_model_backend()} not found or not exported yet, it will be loaded by the first task")
+        return
+    model_registry.get_model(model_path)
 
 @shared_task(bind=True, ignore_result=False)
-def video_analysis(self: Task, video_path: str) -> object:
+def video_analysis(self: Task, video_path: str, team_mode: str=TEAMS_PER_FRAME, streaming: bool=False, frame_stride: int=1,
+                   multiprocess: bool=False) -> object:
     logger.info(f"Start analysis for video: {video_path}")
+    if streaming and team_mode != TEAMS_PER_FRAME:
+        raise ValueError(f"Streaming analysis requires team mode {TEAMS_PER_FRAME}, got {team_mode}")
+    if multiprocess and team_mode != TEAMS_PER_FRAME:
+        raise ValueError(f"Multi-process analysis requires team mode {TEAMS_PER_FRAME}, got {team_mode}")
+    if multiprocess and (streaming or frame_stride > 1):
+        raise ValueError("Multi-process analysis can't be combined with streaming nor frame stride")
+    if frame_stride < 1:
+        raise ValueError(f"Frame stride must be at least 1, got {frame_stride}")
+    if streaming and frame_stride > 1:
+        raise ValueError("Streaming analysis requires tracking every frame (frame_stride=1)")
     self.update_state(state="PROGRESS", meta={"status": 0})
 
-    maybe_precalculated_results = get_precalculated_results_if_present(video_path=video_path)
+    maybe_precalculated_results = get_precalculated_results_if_present(video_path=video_path, frame_stride=frame_stride)
     if maybe_precalculated_results is not None:
-        return  {"status": 1, "coordinates": maybe_precalculated_results }
+        # NB - all the frames are decoded, the task result is serialised by the result backend as a whole
+        result = {"status": 1, "coordinates": maybe_precalculated_results.to_dict() }
+        if frame_stride > 1:
+            video = cv2.VideoCapture(video_path)
+            total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            video.release()
+            result.update(frame_stride=frame_stride, inferred_frames=_get_inferred_frames(total_frames, frame_stride))
+        return result
+
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        result_cache_key = _get_result_cache_key(video_path, team_mode=team_mode, frame_stride=frame_stride, multiprocess=multiprocess)
+        maybe_cached_result = result_cache.get(result_cache_key)
+        if maybe_cached_result is not None:
+            return maybe_cached_result
+
+    result = _analyse_video(self, video_path, team_mode=team_mode, streaming=streaming, frame_stride=frame_stride,
+                            multiprocess=multiprocess)
+    if result_cache is not None:
+        result_cache.put(result_cache_key, result)
+    return result
 
+def _analyse_video(task: Task, video_path: str, team_mode: str, streaming: bool, frame_stride: int, multiprocess: bool) -> object:
+    """
+    Analyse the video (see video_analysis), reporting the progress as the state of the task.
+    """
     video = cv2.VideoCapture(video_path)
     total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
     logger.info(f"Found {total_frames} frames in video: {video_path}")
 
     def update_progressbar(frame):
         logger.info(f"YOLO object tracking for {video_path}: frame {frame}")
-        self.update_state(state="PROGRESS", meta={"status": frame / total_frames })
+        task.update_state(state="PROGRESS", meta={"status": frame / total_frames })
 
-    model_dir = os.getenv("MODEL_DATA_DIR", "data/model")
-    model_path = os.path.join(model_dir, "best.pt")
+    model_path = _get_model_path()
+
+    if frame_stride > 1:
+        return _analyse_with_frame_stride(video_path, total_frames=total_frames, frame_stride=frame_stride,
+                                          team_mode=team_mode, progressbar_callback=update_progressbar)
+
+    if multiprocess:
+        logger.info(f"Running YOLO detection and team detection in separate processes for video {video_path}")
+        tracking_results_df = _track_in_processes(model_path=model_path, video_path=video_path, progressbar_callback=update_progressbar)
+        tracking_results_df = _translate_table_coordinates(tracking_results_df, total_frames=total_frames)
+
+        logger.info(f"Preparing final results for video {video_path}")
+        tracking_results_dict = _convert_to_final_results(tracking_results_df)
+
+        logger.info(f"Finished analysis for for video {video_path}")
+        return {"status": 1, "coordinates": tracking_results_dict }
 
-    tracking_results = get_precalculated_results_if_present(video_path) \
-        or _track(model_path=model_path, video_path=video_path, progressbar_callback=update_progressbar)
+    # NB - in streaming mode the progress is reported together with the coordinates of each chunk,
+    # as every state update replaces the previous one. Only the new chunk is published with its range of frames [start, end),
+    # the client merges the chunks (and gets all the coordinates with the final result, even if it missed some chunks)
+    tracking_results = _track(model_path=model_path, video_path=video_path, progressbar_callback=None if streaming else update_progressbar)
+
+    if streaming:
+        logger.info(f"Running streaming analysis for video {video_path} in chunks of {STREAM_CHUNK_FRAMES} frames")
+        tracking_results_dict, chunk_start = {}, 0
+        for frames_done, chunk_results_dict in _analyse_in_chunks(tracking_results, chunk_frames=STREAM_CHUNK_FRAMES):
+            tracking_results_dict.update(chunk_results_dict)
+            task.update_state(state="PROGRESS", meta={"status": frames_done / total_frames, "coordinates": chunk_results_dict,
+                                                      "frames": [chunk_start, frames_done]})
+            chunk_start = frames_done
+        logger.info(f"Finished analysis for for video {video_path}")
+        return {"status": 1, "coordinates": tracking_results_dict }
 
     # Keypoints and perspective removal
     logger.info(f"Running YOLO detection and removing perspective from video {video_path}")
-    tracking_results_df = _translate_coordinates(tracking_results, total_frames=total_frames)
+    tracking_results_df = _translate_coordinates(tracking_results, total_frames=total_frames, team_mode=team_mode)
  
     logger.info(f"Preparing final results for video {video_path}")
     tracking_results_dict = _convert_to_final_results(tracking_results_df)
@@ -51,72 +173,617 @@ def video_analysis(self: Task, video_path: str) -> object:
     logger.info(f"Finished analysis for for video {video_path}")
     return {"status": 1, "coordinates": tracking_results_dict }
 
+def analyse_video_in_parallel(video_path: str, chunk_frames: int=PARALLEL_CHUNK_FRAMES, overlap: int=PARALLEL_CHUNK_OVERLAP,
+                              task_id: Union[str, None]=None) -> Any:
+    """
+    Dispatch the analysis of a video as a Celery chord: the frame ranges are tracked in parallel
+    by track_frame_range and merged by merge_frame_ranges. Teams are predicted in every frame.
+    Precalculated or cached results are stored as the result of merge_frame_ranges right away, without dispatching the chord.
+    Args:
+        video_path (str): path of the video
+        chunk_frames (int): number of frames per range, not counting the overlap with the previous range
+        overlap (int): number of frames shared by consecutive ranges
+        task_id (str): id of the merge_frame_ranges task (None = generated by Celery)
+    Return:
+        AsyncResult of merge_frame_ranges, with the same result as video_analysis
+    """
+    video = cv2.VideoCapture(video_path)
+    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+    frame_ranges = split_frame_ranges(total_frames, chunk_frames=chunk_frames, overlap=overlap)
+
+    maybe_precalculated_results = get_precalculated_results_if_present(video_path=video_path)
+    if maybe_precalculated_results is not None:
+        return _store_merged_result({"status": 1, "coordinates": maybe_precalculated_results.to_dict() }, task_id=task_id)
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        # NB - called by the web app, which doesn't export the model (the entries of a model not exported yet can't exist anyway)
+        result_cache_key = _get_result_cache_key(video_path, team_mode=TEAMS_PER_FRAME, frame_stride=1, frame_ranges=frame_ranges,
+                                                 export=False)
+        maybe_cached_result = result_cache.get(result_cache_key) if result_cache_key is not None else None
+        if maybe_cached_result is not None:
+            return _store_merged_result(maybe_cached_result, task_id=task_id)
+
+    logger.info(f"Dispatching analysis of video {video_path} ({total_frames} frames) in {len(frame_ranges)} frame ranges")
+    header = [track_frame_range.s(video_path=video_path, start_frame=start, end_frame=end) for start, end in frame_ranges]
+    return chord(header)(merge_frame_ranges.s(video_path=video_path, frame_ranges=frame_ranges), task_id=task_id)
+
+def _store_merged_result(result: dict, task_id: Union[str, None]) -> Any:
+    """
+    Store the result of a parallel analysis (see analyse_video_in_parallel) as the result of merge_frame_ranges.
+    Return:
+        AsyncResult of merge_frame_ranges
+    """
+    task_id = task_id or uuid()
+    merge_frame_ranges.backend.store_result(task_id, result, states.SUCCESS)
+    return merge_frame_ranges.AsyncResult(task_id)
+
+@shared_task(bind=True, ignore_result=False)
+def track_frame_range(self: Task, video_path: str, start_frame: int, end_frame: int) -> dict:
+    """
+    Track the objects and predict the teams in a range of video frames, with a fresh tracker.
+    Return:
+        Tracking table as a dict of columns (JSON serializable), with absolute frame numbers
+    """
+    logger.info(f"Start tracking frames {start_frame}-{end_frame} of video: {video_path}")
+    tracking_results = _track_frame_range(model_path=_get_model_path(), video_path=video_path,
+                                          start_frame=start_frame, end_frame=end_frame)
+    tracking_results_df = convert_tracking_results_to_pandas(tracking_results, team_mode=TEAMS_PER_FRAME)
+    tracking_results_df["frame"] += start_frame
+    logger.info(f"Finished tracking frames {start_frame}-{end_frame} of video: {video_path}")
+    return tracking_results_df.drop(columns=["cls_name"]).to_dict(orient="list")
+
+@shared_task(bind=True, ignore_result=False)
+def merge_frame_ranges(self: Task, chunk_tables: list[dict], video_path: str, frame_ranges: list[tuple[int, int]]) -> object:
+    """
+    Stitch the tracking tables of the frame ranges and remove the perspective (chord callback of analyse_video_in_parallel).
+    """
+    logger.info(f"Stitching {len(chunk_tables)} frame ranges of video {video_path}")
+    tracking_results_df = stitch_chunk_tables([pd.DataFrame(table) for table in chunk_tables], frame_ranges)
+    total_frames = frame_ranges[-1][1] if len(frame_ranges) > 0 else 0
+    tracking_results_df = _translate_table_coordinates(tracking_results_df, total_frames=total_frames)
+
+    logger.info(f"Preparing final results for video {video_path}")
+    tracking_results_dict = _convert_to_final_results(tracking_results_df)
+
+    logger.info(f"Finished analysis for for video {video_path}")
+    result = {"status": 1, "coordinates": tracking_results_dict }
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        result_cache.put(_get_result_cache_key(video_path, team_mode=TEAMS_PER_FRAME, frame_stride=1, frame_ranges=frame_ranges), result)
+    return result
+
+def _analyse_with_frame_stride(video_path: str, total_frames: int, frame_stride: int, team_mode: str,
+                               progressbar_callback: Callable) -> object:
+    """
+    Track every n-th frame of the video and interpolate the pitch coordinates of the tracks in the other frames.
+    Return:
+        Same result as video_analysis, with the stride and the list of tracked (not interpolated) frames
+    """
+    tracking_results = _track_frame_range(model_path=_get_model_path(), video_path=video_path, start_frame=0, end_frame=total_frames,
+                                          frame_stride=frame_stride, progressbar_callback=progressbar_callback)
+
+    logger.info(f"Running YOLO detection on every {frame_stride}. frame and removing perspective from video {video_path}")
+    # NB - the tracked frames are numbered consecutively until the skipped frames are filled in
+    tracked_frames = len(range(0, total_frames, frame_stride))
+    tracking_results_df = _translate_coordinates(tracking_results, total_frames=tracked_frames, team_mode=team_mode,
+                                                 max_lookback=max(MAX_LOOKBACK // frame_stride, 1))
+    tracking_results_df = _interpolate_skipped_frames(tracking_results_df, frame_stride=frame_stride, total_frames=total_frames)
+
+    logger.info(f"Preparing final results for video {video_path}")
+    tracking_results_dict = _convert_to_final_results(tracking_results_df)
+
+    logger.info(f"Finished analysis for for video {video_path}")
+    inferred_frames = _get_inferred_frames(total_frames, frame_stride)
+    return {"status": 1, "coordinates": tracking_results_dict, "frame_stride": frame_stride, "inferred_frames": inferred_frames }
+
+def _get_inferred_frames(total_frames: int, frame_stride: int) -> list[int]:
+    """
+    Get the numbers of the frames tracked by an analysis with the frame stride (the other frames are interpolated).
+    """
+    # NB - video frames start typically from 1
+    return [frame + 1 for frame in range(0, total_frames, frame_stride)]
+
+def _get_result_cache_key(video_path: str, team_mode: str, frame_stride: int, multiprocess: bool=False,
+                          frame_ranges: Union[list[tuple[int, int]], None]=None, export: bool=True) -> Union[str, None]:
+    """
+    Get the key of the analysis in the result cache: checksums of the video and the loaded model and the parameters affecting the result,
+    with the settings applied by the execution mode (the streaming analysis applies the same ones as the single-process analysis).
+    Args:
+        multiprocess (bool): multi-process analysis, which tracks the full frames (no pitch ROI, disc focus nor frame downscaling)
+        frame_ranges (list): frame ranges tracked separately by a parallel analysis (None = the video is tracked in one go)
+        export (bool): export the model if needed (False = None if the model wasn't exported yet)
+    """
+    model_path = _get_model_path(export=export)
+    if model_path is None:
+        return None
+    # NB - the checksum index works for any file or directory, the loaded model is hashed once per version
+    model_sha256sum = get_video_sha256sum(model_path)
+    params = dict(team_mode=team_mode, frame_stride=frame_stride, multiprocess=multiprocess,
+                  frame_ranges=[list(frame_range) for frame_range in frame_ranges] if frame_ranges is not None else None,
+                  backend=get_model_backend(), conf_threshold=CONF_THRESHOLD, max_lookback=MAX_LOOKBACK,
+                  homography_tolerance=HOMOGRAPHY_TOLERANCE, appearance_refresh_every=APPEARANCE_REFRESH_EVERY,
+                  resize_frames_to_model_input=RESIZE_FRAMES_TO_MODEL_INPUT and not multiprocess,
+                  pitch_roi=[PITCH_ROI_ESTIMATION_FRAMES, PITCH_ROI_REESTIMATE_EVERY] if PITCH_ROI_INFERENCE and not multiprocess else None,
+                  disc_focus=[DISC_FOCUS_FRAME_IMGSZ, DISC_FOCUS_CROP_SIZE, DISC_FOCUS_MAX_MISSING_FRAMES]
+                  if DISC_FOCUS_INFERENCE and not multiprocess else None)
+    return AnalysisResultCache.make_key(get_video_sha256sum(video_path), model_sha256sum, params)
+
+def _get_model_path(export: bool=True) -> Union[str, None]:
+    """
+    Get the path of the model for the inference backend set by MODEL_BACKEND (exported from best.pt on first use).
+    Args:
+        export (bool): export the model if needed (False = None if the model wasn't exported yet)
+    """
+    model_dir = os.getenv("MODEL_DATA_DIR", "data/model")
+    return get_backend_model_path(os.path.join(model_dir, "best.pt"), backend=get_model_backend(), export=export)
+
 def _track(model_path: str, video_path: str, progressbar_callback: Callable) -> Any:
         """
         Perform object tracking on the video with YOLOv8.
+        The frames are decoded in a background thread (see PrefetchingFrameReader), overlapping with the inference.
         Args:
             progressbar_callback (Callable[int]): a callback accepting 1 argument (frame number)
         Return:
             YOLO tracking results
         """
 
-        model = ultralytics.YOLO(model_path, verbose=True)
+        # NB - the model is loaded once per worker process and shared by subsequent tasks
+        model = model_registry.get_model(model_path)
+        yolo_progress_reporting_event = "on_predict_batch_start"
+        # Drop the progress callback of the previous task
+        model.clear_callback(yolo_progress_reporting_event)
         if progressbar_callback is not None and isinstance(progressbar_callback, Callable):
-            yolo_progress_reporting_event = "on_predict_batch_start"
+            # NB - the event is fired once per batch of frames, the callback is called for each of its frames
             progress_callback_wrapped = make_callback_adapter_with_counter(yolo_progress_reporting_event, 
-                                                                        lambda _,counter: progressbar_callback(counter))
+                                                                        lambda _,counter: progressbar_callback(counter),
+                                                                        count_items=count_batch_images)
             model.add_callback(yolo_progress_reporting_event, progress_callback_wrapped)
 
-        # NB - if torch package is installed in the CPU variant, the device will default to "cpu"
-        device = 0 if torch.cuda.is_available() else "cpu" 
-        tracking_results = model.track(source=video_path, agnostic_nms=True, show=False, device=device, stream=True)
+        frame_reader = PrefetchingFrameReader(video_path, max_size=_get_frame_max_size(model), prefetch=FRAME_PREFETCH)
+        tracking_results = _track_frames(model, frame_reader, batch_size=_get_frame_batch(), pitch_roi=_get_pitch_roi(),
+                                         disc_focus=_get_disc_focus())
 
-        return tracking_results
+        return _log_frames_per_second(tracking_results, model_path=model_path)
 
-def _translate_coordinates(tracking_results: list[ultralytics.engine.results.Results], total_frames: int) -> pd.DataFrame:
-    tracking_results_df = convert_tracking_results_to_pandas(tracking_results)
+def _track_frame_range(model_path: str, video_path: str, start_frame: int, end_frame: int, frame_stride: int=1,
+                       progressbar_callback: Callable=None) -> Iterator[ultralytics.engine.results.Results]:
+    """
+    Perform object tracking on a range of video frames with YOLOv8, starting with a fresh tracker.
+    Args:
+        start_frame (int): first frame to track
+        end_frame (int): frame to stop at (exclusive)
+        frame_stride (int): track every n-th frame only (start_frame, start_frame + n, ...), the others are skipped without decoding
+        progressbar_callback (Callable[int]): a callback accepting 1 argument (number of frames read), called for each tracked frame
+    Return:
+        YOLO tracking results, one per tracked frame
+    """
+    model = model_registry.get_model(model_path)
+    # Drop the progress callback of the previous task
+    model.clear_callback("on_predict_batch_start")
+    frame_reader = PrefetchingFrameReader(video_path, start_frame=start_frame, end_frame=end_frame, frame_stride=frame_stride,
+                                          max_size=_get_frame_max_size(model), prefetch=FRAME_PREFETCH)
+    tracking_results = _track_frames(model, frame_reader, progressbar_callback=progressbar_callback, batch_size=_get_frame_batch(),
+                                     pitch_roi=_get_pitch_roi(), disc_focus=_get_disc_focus())
+    return _log_frames_per_second(tracking_results, model_path=model_path)
 
-    keypoints_extractor = KeypointsExtractor(tracking_results_df, conf_threshold=CONF_THRESHOLD, max_lookback=MAX_LOOKBACK)
-    # Calculate homography matrices
-    H_all = []
-    for frame in range(0, total_frames):
-        kps = keypoints_extractor.get_4_best_keypoint_pairs(frame)
-        if kps is None:
-            raise RuntimeError(f"Error: couldnt detect enough keypoints for frame {frame}")
-        h = calculate_homography_matrix(kps)
-        H_all.append(h)
-        
-    def remove_perspective(row):
-         h = H_all[row["frame"]]
-         if h is None:
-              row["x"] = np.nan
-              row["y"] = np.nan
-         else:
-            # For players and referees, take the bottom centre of the bounding box
-            if row["cls"] in [0, 30]:
-                x_t, y_t = row["x"], (row["y"]+row["h"]/2)
-                coords = np.array([x_t, y_t])
+def _track_frames(model: ultralytics.YOLO, frame_reader: PrefetchingFrameReader, progressbar_callback: Callable=None,
+                  batch_size: int=1, pitch_roi: PitchRoi=None, disc_focus: DiscFocus=None) -> Iterator[ultralytics.engine.results.Results]:
+    """
+    Track the objects in the frames of the frame reader, with trackers reset before the first frame.
+    Logs the inference time and the time spent waiting for decoded frames separately.
+    Args:
+        progressbar_callback (Callable[int]): a callback accepting 1 argument (number of frames since the first one), called for each tracked frame
+        batch_size (int): number of frames per forward pass of the model
+        pitch_roi (PitchRoi): crop the frames to the pitch (None = track the full frames);
+            the results are always in full-frame coordinates
+        disc_focus (DiscFocus): detect the disc in high-resolution crops around its predicted position
+            and infer the frames at the lower image size DISC_FOCUS_FRAME_IMGSZ (None = detect the disc in the frames only)
+    """
+    if batch_size < 1:
+        raise ValueError(f"Batch must contain at least 1 frame, got {batch_size}")
+    _reset_trackers(model)
+    imgsz = _get_model_imgsz(model)
+    if disc_focus is not None:
+        crop_predictor = _get_crop_predictor(model, imgsz=disc_focus.crop_size if get_model_backend() == TORCH_BACKEND else imgsz)
+        if get_model_backend() == TORCH_BACKEND:
+            imgsz = min(imgsz, DISC_FOCUS_FRAME_IMGSZ)
+    # Crop box and full frames of the batch being tracked
+    roi_box, full_frames = None, []
+
+    def map_results_to_full_frames(predictor):
+        if roi_box is not None:
+            predictor.results = [pitch_roi.to_full_frame(result, frame, roi_box) for result, frame in zip(predictor.results, full_frames)]
+            # The tracker compensates the camera motion between consecutive images, so it gets the full frames too
+            paths, _, info = predictor.batch
+            predictor.batch = (paths, full_frames, info)
+
+    def detect_disc_in_crops(predictor):
+        nonlocal disc_crops, disc_crop_hits
+        # NB - the disc positions in a batch are all predicted from the trajectory up to the previous batch
+        _, frames, _ = predictor.batch
+        boxes = [disc_focus.get_crop_box(frame_index + i, frame.shape) for i, frame in enumerate(frames)]
+        cropped = [i for i, box in enumerate(boxes) if box is not None]
+        if not cropped:
+            return
+        crop_results = crop_predictor(source=[disc_focus.crop(frames[i], boxes[i]) for i in cropped])
+        for i, crop_result in zip(cropped, crop_results):
+            predictor.results[i] = disc_focus.merge(predictor.results[i], crop_result, boxes[i])
+        disc_crops += len(cropped)
+        disc_crop_hits += sum((crop_result.boxes.cls == DISC_CLASS).any().item() for crop_result in crop_results)
+
+    # NB - the callbacks run before the tracker's: the boxes are mapped back to the full frames before the tracker gets them,
+    # so that the tracks don't jump when the ROI changes, and the disc detected in the crops is tracked as any other disc
+    postprocess_callbacks = [callback for callback, enabled in [(map_results_to_full_frames, pitch_roi is not None),
+                                                                (detect_disc_in_crops, disc_focus is not None)] if enabled]
+    model.callbacks["on_predict_postprocess_end"][0:0] = postprocess_callbacks
+    try:
+        first_frame_no = None
+        frame_index, inference_seconds, cropped_frames = 0, 0.0, 0
+        disc_crops, disc_crop_hits = 0, 0
+        for batch in _iter_frame_batches(frame_reader, batch_size, pitch_roi):
+            frame_nos = [frame_no for frame_no, _ in batch]
+            full_frames = [frame for _, frame in batch]
+            if first_frame_no is None:
+                first_frame_no = frame_nos[0]
+            roi_box = pitch_roi.get_box(frame_index) if pitch_roi is not None else None
+            if roi_box is None:
+                source, source_imgsz = full_frames, imgsz
             else:
-                coords = row["x":"y"].to_numpy()
-            translated_coords = convert_h(h, coords)
-            row["x"] = translated_coords[0]
-            row["y"] = translated_coords[1]
-         return row
+                source = [pitch_roi.crop(frame, roi_box) for frame in full_frames]
+                source_imgsz = pitch_roi.get_imgsz(roi_box, full_frames[0].shape, imgsz) if get_model_backend() == TORCH_BACKEND else imgsz
+                cropped_frames += len(batch)
+            start = time.perf_counter()
+            # NB - the frames of a list source are predicted as one batch and passed to a single tracker in order
+            results = model.track(source=source, imgsz=source_imgsz, persist=True, agnostic_nms=True, show=False,
+                                  device=get_device(), verbose=False)
+            inference_seconds += time.perf_counter() - start
+            for frame_no, result in zip(frame_nos, results):
+                if pitch_roi is not None:
+                    pitch_roi.observe(frame_index, result)
+                if disc_focus is not None:
+                    disc_focus.observe(frame_index, result)
+                frame_index += 1
+                yield result
+                if progressbar_callback is not None:
+                    progressbar_callback(frame_no - first_frame_no + 1)
+    finally:
+        for callback in postprocess_callbacks:
+            model.callbacks["on_predict_postprocess_end"].remove(callback)
+    if pitch_roi is not None:
+        logger.info(f"Pitch ROI: {cropped_frames} of {frame_index} frames cropped, last ROI {pitch_roi.box}")
+    if disc_focus is not None:
+        logger.info(f"Disc focus: {disc_crops} of {frame_index} frames with a disc crop, disc detected in {disc_crop_hits} crops")
+    logger.info(f"Tracked {frame_reader.frames_read} frames: {inference_seconds:.1f}s inference, "
+                f"{frame_reader.stall_seconds:.1f}s waiting for decoded frames ({frame_reader.decode_seconds:.1f}s decoding in background)")
+
+def _iter_frame_batches(frames: Iterable[tuple[int, np.ndarray]], batch_size: int,
+                        pitch_roi: PitchRoi=None) -> Iterator[list[tuple[int, np.ndarray]]]:
+    """
+    Group the frames into batches of batch_size frames; with a pitch ROI, a batch doesn't span the start or the end of an estimation window.
+    """
+    frames = iter(frames)
+    if pitch_roi is None:
+        while batch := list(itertools.islice(frames, batch_size)):
+            yield batch
+        return
+    batch = []
+    for frame_index, frame in enumerate(frames):
+        if batch and pitch_roi.is_estimation_frame(frame_index) != pitch_roi.is_estimation_frame(frame_index - 1):
+            yield batch
+            batch = []
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    tracking_results_df = tracking_results_df.apply(remove_perspective, axis=1)
+def _track_in_processes(model_path: str, video_path: str, progressbar_callback: Callable) -> pd.DataFrame:
+    """
+    Track the objects and predict the teams in every frame, with the decoding, the tracking (in this process)
+    and the team detection running concurrently in separate processes.
+    The frames are decoded once into a SharedFrameRing and read by the tracking and the team detection without copying.
+    Args:
+        progressbar_callback (Callable[int]): a callback accepting 1 argument (number of frames tracked)
+    Return:
+        Tracking table (see convert_tracking_results_to_pandas)
+    """
+    model = model_registry.get_model(model_path)
+    # Drop the progress callback of the previous task
+    model.clear_callback("on_predict_batch_start")
+    # NB - billiard (unlike multiprocessing) allows the daemonic Celery worker processes to start child processes;
+    # spawned children don't inherit the state of the inference libraries
+    context = billiard.get_context("spawn")
+    frames_queue, detections_queue, teams_queue = context.Queue(), context.Queue(), context.Queue()
+    with SharedFrameRing(get_video_frame_shape(video_path), slots=FRAME_RING_SLOTS, readers=2, context=context) as ring:
+        processes = [
+            context.Process(target=decode_video_into_ring, args=(video_path, ring, frames_queue), name="Frame decoding", daemon=True),
+            context.Process(target=predict_teams_from_ring, args=(ring, detections_queue, teams_queue), name="Team detection", daemon=True),
+        ]
+        for process in processes:
+            process.start()
+        try:
+            tracking_results_df = _track_frames_in_ring(model, ring, frames_queue, detections_queue, processes, progressbar_callback)
+            frame_teams_df = _get_from_processes(teams_queue, processes)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    tracking_results_df["team"] = lookup_frame_teams(tracking_results_df, frame_teams_df)
     return tracking_results_df
 
+def _track_frames_in_ring(model: ultralytics.YOLO, ring: SharedFrameRing, frames_queue: Any, detections_queue: Any,
+                          processes: list, progressbar_callback: Callable) -> pd.DataFrame:
+    """
+    Track the objects in the frames of the ring as they are decoded, and pass the detections of each frame on to the team detection.
+    Return:
+        Tracking table without team predictions
+    """
+    _reset_trackers(model)
+    builder = TrackingTableBuilder()
+    frames, inference_seconds, stall_seconds = 0, 0.0, 0.0
+    while True:
+        start = time.perf_counter()
+        item = _get_from_processes(frames_queue, processes)
+        stall_seconds += time.perf_counter() - start
+        if item is None:
+            break
+        frame_no, slot = item
+        start = time.perf_counter()
+        result = model.track(source=ring.get(slot), persist=True, agnostic_nms=True, show=False, device=get_device(), verbose=False)[0]
+        inference_seconds += time.perf_counter() - start
+        builder.append(frame_no, result)
+        detections_queue.put((frame_no, slot, result.boxes.data.cpu().numpy(), result.names))
+        ring.release(slot)
+        frames += 1
+        if progressbar_callback is not None:
+            progressbar_callback(frames)
+    detections_queue.put(None)
+    logger.info(f"Tracked {frames} frames in the frame ring: {inference_seconds:.1f}s inference, "
+                f"{stall_seconds:.1f}s waiting for decoded frames")
+    return builder.build()
+
+def _get_frame_batch() -> int:
+    """
+    Get the number of frames per forward pass of the model for the inference backend set by MODEL_BACKEND.
+    """
+    return FRAME_BATCH if get_model_backend() == TORCH_BACKEND else 1
+
+def _reset_trackers(model: ultralytics.YOLO) -> None:
+    """
+    Reset the trackers of the model (kept by its predictor) before tracking a new video or frame range.
+    NB - model.track binds the persist argument to the tracker callbacks on its first call only,
+    so the frames are always tracked with persist=True and the trackers of the previous video are reset here instead
+    """
+    for tracker in getattr(model.predictor, "trackers", []):
+        tracker.reset()
+
+def _get_from_processes(results_queue: Any, processes: list) -> Any:
+    """
+    Get the next item from a queue filled by the processes, failing if any of them crashed (instead of waiting forever).
+    """
+    while True:
+        try:
+            return results_queue.get(timeout=1)
+        except queue.Empty:
+            for process in processes:
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError(f"{process.name} process failed with exit code {process.exitcode}")
+
+def _get_frame_max_size(model: ultralytics.YOLO) -> Union[int, None]:
+    """
+    Get the size to downscale the decoded frames to (the model input size), if enabled by RESIZE_FRAMES_TO_MODEL_INPUT.
+    """
+    if not RESIZE_FRAMES_TO_MODEL_INPUT:
+        return None
+    return _get_model_imgsz(model)
+
+def _get_model_imgsz(model: ultralytics.YOLO) -> int:
+    """
+    Get the inference image size of the model (the longer side, if the size isn't square).
+    """
+    imgsz = model.overrides.get("imgsz", 640)
+    return max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz
+
+def _get_pitch_roi() -> Union[PitchRoi, None]:
+    """
+    Get a new pitch ROI for a video (or a frame range), if enabled by PITCH_ROI_INFERENCE.
+    """
+    if not PITCH_ROI_INFERENCE:
+        return None
+    return PitchRoi(conf_threshold=CONF_THRESHOLD, estimation_frames=PITCH_ROI_ESTIMATION_FRAMES,
+                    reestimate_every=PITCH_ROI_REESTIMATE_EVERY)
+
+def _get_disc_focus() -> Union[DiscFocus, None]:
+    """
+    Get a new disc focus for a video (or a frame range), if enabled by DISC_FOCUS_INFERENCE.
+    """
+    if not DISC_FOCUS_INFERENCE:
+        return None
+    return DiscFocus(crop_size=DISC_FOCUS_CROP_SIZE, max_missing_frames=DISC_FOCUS_MAX_MISSING_FRAMES)
+
+def _get_crop_predictor(model: ultralytics.YOLO, imgsz: int) -> DetectionPredictor:
+    """
+    Get the predictor detecting the disc in crops for the model, made once per model and image size,
+    so that the tasks share the loaded model (and, for the exported models, its inference session) like the tracking does.
+    """
+    predictors = _crop_predictors.setdefault(model, {})
+    if imgsz not in predictors:
+        predictors[imgsz] = _make_crop_predictor(model, imgsz=imgsz)
+    return predictors[imgsz]
+
+def _make_crop_predictor(model: ultralytics.YOLO, imgsz: int) -> DetectionPredictor:
+    """
+    Make a predictor detecting the disc in crops, sharing the weights of the model.
+    NB - the crops are predicted in a callback of the model's own predictor, which can't be reentered;
+    the crop predictor has its own (default) callbacks, so that the crops don't reach the tracker nor the progress callback
+    """
+    overrides = {**model.overrides, "imgsz": imgsz, "conf": 0.1, "classes": [DISC_CLASS], "device": get_device(),
+                 "batch": 1, "save": False, "verbose": False, "mode": "predict"}
+    predictor = DetectionPredictor(overrides=overrides, _callbacks=callbacks.get_default_callbacks())
+    predictor.setup_model(model=model.model, verbose=False)
+    return predictor
+
+def _log_frames_per_second(tracking_results: Iterable[ultralytics.engine.results.Results], model_path: str) -> Iterator[ultralytics.engine.results.Results]:
+    """
+    Pass the tracking results through and log the tracking throughput once they are exhausted.
+    Only the time spent producing the results (decoding and inference) is counted, not the time spent processing them.
+    """
+    frames, busy_seconds = 0, 0.0
+    tracking_results = iter(tracking_results)
+    while True:
+        start = time.perf_counter()
+        result = next(tracking_results, None)
+        busy_seconds += time.perf_counter() - start
+        if result is None:
+            break
+        frames += 1
+        yield result
+    frames_per_second = frames / busy_seconds if busy_seconds > 0 else 0.0
+    logger.info(f"YOLO tracking with {get_model_backend()} backend ({os.path.basename(model_path)}): "
+                f"{frames} frames in {busy_seconds:.1f}s, {frames_per_second:.2f} frames/s")
+
+def _translate_coordinates(tracking_results: list[ultralytics.engine.results.Results], total_frames: int, team_mode: str=TEAMS_PER_FRAME,
+                           max_lookback: int=MAX_LOOKBACK) -> pd.DataFrame:
+    tracking_results_df = convert_tracking_results_to_pandas(tracking_results, team_mode=team_mode)
+    return _translate_table_coordinates(tracking_results_df, total_frames=total_frames, max_lookback=max_lookback)
+
+def _translate_table_coordinates(tracking_results_df: pd.DataFrame, total_frames: int, max_lookback: int=MAX_LOOKBACK) -> pd.DataFrame:
+    keypoints_extractor = KeypointsExtractor(tracking_results_df, conf_threshold=CONF_THRESHOLD, max_lookback=max_lookback)
+    keypoint_quads = keypoints_extractor.get_all_best_keypoint_quads(total_frames)
+    if not keypoint_quads.found.all():
+        frame = np.argmin(keypoint_quads.found)
+        raise RuntimeError(f"Error: couldnt detect enough keypoints for frame {frame}")
+    # Calculate homography matrices
+    homography_cache = HomographyCache(tolerance=HOMOGRAPHY_TOLERANCE)
+    H_all = homography_cache.calculate_homography_matrices(keypoint_quads)
+    logger.info(f"Homography matrices: {homography_cache.misses} calculated, {homography_cache.hits} reused")
+        
+    tracking_results_df[["x", "y"]] = _remove_perspective(tracking_results_df, H_all)
+    return tracking_results_df
+
+def _analyse_in_chunks(tracking_results: Iterable[ultralytics.engine.results.Results], chunk_frames: int) -> Iterator[tuple[int, dict]]:
+    """
+    Streaming counterpart of _translate_coordinates and _convert_to_final_results.
+    The tracking results are consumed incrementally and translated in chunks of consecutive frames.
+    The keypoints of the last MAX_LOOKBACK frames are carried over to the next chunk,
+    so that its first frames can look back to the previous chunk.
+    Args:
+        tracking_results (Iterable[ultralytics.engine.results.Results]): YOLO tracking results, e.g. a streaming generator
+        chunk_frames (int): number of frames per chunk
+    Return:
+        Iterator of tuples (number of frames processed so far, final results of the chunk's frames)
+    """
+    lookback_df = None
+    homography_hits, homography_misses = 0, 0
+    for first_frame, frames_count, chunk_df in iter_tracking_table_chunks(tracking_results, chunk_frames=chunk_frames):
+        # Rebase the frame numbers to the start of the lookback window
+        window_start = max(first_frame - (MAX_LOOKBACK - 1), 0)
+        keypoints_df = pd.concat([lookback_df, chunk_df[["cls", "x", "y", "conf", "frame"]]], ignore_index=True)
+        keypoints_df["frame"] -= window_start
+        keypoints_extractor = KeypointsExtractor(keypoints_df, conf_threshold=CONF_THRESHOLD, max_lookback=MAX_LOOKBACK)
+        keypoint_quads = keypoints_extractor.get_all_best_keypoint_quads(first_frame - window_start + frames_count)
+        keypoint_quads = keypoint_quads[first_frame - window_start:]
+        if not keypoint_quads.found.all():
+            frame = first_frame + np.argmin(keypoint_quads.found)
+            raise RuntimeError(f"Error: couldnt detect enough keypoints for frame {frame}")
+        homography_cache = HomographyCache(tolerance=HOMOGRAPHY_TOLERANCE)
+        H_chunk = homography_cache.calculate_homography_matrices(keypoint_quads)
+        homography_hits += homography_cache.hits
+        homography_misses += homography_cache.misses
+
+        chunk_df[["x", "y"]] = _remove_perspective(chunk_df.assign(frame=chunk_df["frame"] - first_frame), H_chunk)
+        next_window_start = first_frame + frames_count - (MAX_LOOKBACK - 1)
+        keypoints_df["frame"] += window_start
+        lookback_df = keypoints_df[keypoints_df["frame"] >= next_window_start]
+        yield first_frame + frames_count, _convert_to_final_results(chunk_df)
+    logger.info(f"Homography matrices: {homography_misses} calculated, {homography_hits} reused")
+
+def _interpolate_skipped_frames(tracking_results_df: pd.DataFrame, frame_stride: int, total_frames: int) -> pd.DataFrame:
+    """
+    Fill in the frames skipped by frame-stride tracking.
+    The pitch coordinates of each track are interpolated linearly between its positions in consecutive tracked frames
+    (a track missing from a tracked frame isn't bridged). The frames after the last tracked frame repeat its detections.
+    Args:
+        tracking_results_df (pd.DataFrame): translated tracking results with "x", "y", "id" and "frame" columns,
+            numbered by tracked frame (0, 1, 2, ... for video frames 0, frame_stride, 2*frame_stride, ...)
+        frame_stride (int): every n-th video frame was tracked
+        total_frames (int): number of video frames
+    Return:
+        pd.DataFrame with the same columns numbered by video frame, sorted by frame
+    """
+    tracking_results_df = tracking_results_df.assign(frame=tracking_results_df["frame"] * frame_stride)
+
+    tracked_df = tracking_results_df[(tracking_results_df["id"] != 0) & tracking_results_df[["x", "y"]].notna().all(axis=1)]
+    tracked_df = tracked_df.sort_values(by=["id", "frame"], kind="stable")
+    ids = tracked_df["id"].to_numpy()
+    frames = tracked_df["frame"].to_numpy()
+    coords = tracked_df[["x", "y"]].to_numpy(dtype=np.float64)
+    # Pairs of consecutive positions of a track, one stride apart
+    gaps = np.diff(frames)
+    pair_starts = np.flatnonzero((ids[1:] == ids[:-1]) & (gaps == frame_stride))
+    steps_per_pair = np.full(len(pair_starts), frame_stride - 1)
+    pair_of_row = np.repeat(pair_starts, steps_per_pair)
+    steps = np.tile(np.arange(1, frame_stride), len(pair_starts))
+    fractions = (steps / frame_stride)[:, None]
+    interpolated_df = tracked_df.iloc[pair_of_row].copy()
+    interpolated_df["frame"] = frames[pair_of_row] + steps
+    interpolated_df[["x", "y"]] = coords[pair_of_row] + (coords[pair_of_row + 1] - coords[pair_of_row]) * fractions
+
+    last_tracked_frame = (total_frames - 1) // frame_stride * frame_stride
+    last_frame_df = tracking_results_df[tracking_results_df["frame"] == last_tracked_frame]
+    tail_frames = np.arange(last_tracked_frame + 1, total_frames)
+    tail_df = last_frame_df.iloc[np.tile(np.arange(len(last_frame_df)), len(tail_frames))].copy()
+    tail_df["frame"] = np.repeat(tail_frames, len(last_frame_df))
+
+    filled_df = pd.concat([tracking_results_df, interpolated_df, tail_df], ignore_index=True)
+    return filled_df.sort_values(by="frame", kind="stable", ignore_index=True)
+
+def _remove_perspective(tracking_results_df: pd.DataFrame, H_all: np.ndarray) -> np.ndarray:
+    """
+    Project the coordinates of all detections to the real pitch, frame by frame.
+    Args:
+        tracking_results_df (pd.DataFrame): tracking results with "cls", "x", "y", "h" and "frame" columns
+        H_all (np.ndarray): homography matrices (F,3,3) indexed by frame number, NaN for frames without keypoints
+    Return:
+        np.ndarray of shape (N,2) with translated coordinates, NaN for frames without a homography matrix
+    """
+    frames = tracking_results_df["frame"].to_numpy()
+    coords = tracking_results_df[["x", "y"]].to_numpy(dtype=np.float64)
+    # For players and referees, take the bottom centre of the bounding box
+    is_person = tracking_results_df["cls"].isin([0, 30]).to_numpy()
+    coords[is_person, 1] += tracking_results_df["h"].to_numpy()[is_person]/2
+
+    translated_coords = np.full_like(coords, np.nan)
+    # Group the rows by frame and translate each frame's block at once
+    rows_by_frame = np.argsort(frames, kind="stable")
+    frames_present, block_starts = np.unique(frames[rows_by_frame], return_index=True)
+    for frame, rows in zip(frames_present, np.split(rows_by_frame, block_starts[1:])):
+        h = H_all[frame]
+        if not np.isnan(h).any():
+            translated_coords[rows] = convert_h_batch(h, coords[rows])
+    return translated_coords
+
 def _convert_to_final_results(tracking_results_df: pd.DataFrame) -> dict:
     converted_results = tracking_results_df[tracking_results_df["cls"].isin([0, 29, 30])]
     converted_results = converted_results[["cls", "x", "y", "team", "id", "frame"]]
     # NB - video frames start typically from 1
     converted_results["frame"] = converted_results["frame"] + 1
     converted_results = converted_results.dropna()
+    # Sort once by frame (keeping the order of detections within a frame),
+    # so that each frame's results form a contiguous block of records
+    converted_results = converted_results.sort_values(by="frame", kind="stable")
+    frames = converted_results["frame"].to_numpy()
+    records = converted_results.drop(columns=["frame"]).to_dict(orient="records")
+    frames_present, block_starts = np.unique(frames, return_index=True)
+    block_ends = np.r_[block_starts[1:], len(records)]
 
     final_dict = {}
-    for frame in converted_results["frame"].unique(): 
-        results_for_frame = converted_results[converted_results["frame"]==frame].drop(columns=["frame"])
+    for frame, start, end in zip(frames_present, block_starts, block_ends):
         # NB - We convert frame number to string so that it can be later JSONified correctly as a dictionary key
-        final_dict[str(frame)] = results_for_frame.to_dict(orient="records")
-         
+        final_dict[str(frame)] = records[start:end]
+
     return final_dict
@@ -1,3 +1,4 @@
+from typing import Union
 import numpy as np
 import pandas as pd
 
@@ -5,25 +6,100 @@ import cv2
 
 from sklearn.cluster import KMeans
 
+PIXEL_FEATURES = "pixels"
+COLOR_HISTOGRAM_FEATURES = "color_histogram"
+
+class TrackAppearanceCache:
+    def __init__(self, refresh_every: int=1, box_size_change: float=0.25) -> None:
+        """
+        Cache of player appearance features by YOLO track id (the team of a track doesn't change).
+        The features of a track are computed when it first appears, then every n frames or when its box size
+        changes significantly. Otherwise the cached features are reused and the player image isn't cropped at all.
+        NB - the features are cached rather than the team labels: a per-frame label is the index of a KMeans cluster
+        fitted to the players of that frame (ordered by brightness, at most 7 players per team), so a label cached
+        from another frame's fit may contradict the current one. The crops and the feature extraction are skipped,
+        the clustering still runs in every frame; for one stable team per track, use the video team mode
+        Args:
+            refresh_every (int): Recompute the features of a track every n frames (1 = every frame, i.e. no caching)
+            box_size_change (float): Recompute the features of a track if its box area changed by more than this ratio
+        Returns:
+            None
+        """
+        self.refresh_every = refresh_every
+        self.box_size_change = box_size_change
+        self.computed_crops = 0
+        self.skipped_crops = 0
+        self._entries = {}
+
+    def get(self, track_id: int, frame_no: int, box: list) -> Union[tuple[np.ndarray, float], None]:
+        """
+        Get the cached features and brightness of a track, unless they need to be recomputed.
+        Args:
+            track_id (int): YOLO track id
+            frame_no (int): The frame number.
+            box (list): The player box (x1, y1, x2, y2).
+        Returns:
+            tuple[np.ndarray, float]: The cached features and brightness, or None.
+        """
+        entry = self._entries.get(track_id)
+        if entry is None or frame_no - entry["frame_no"] >= self.refresh_every:
+            return None
+        area = _box_area(box)
+        if abs(area - entry["area"]) > self.box_size_change * entry["area"]:
+            return None
+        self.skipped_crops += 1
+        return entry["features"], entry["brightness"]
+
+    def put(self, track_id: int, frame_no: int, box: list, features: np.ndarray, brightness: float) -> None:
+        """
+        Cache the newly computed features and brightness of a track.
+        """
+        self.computed_crops += 1
+        self._entries[track_id] = dict(frame_no=frame_no, area=_box_area(box), features=features, brightness=brightness)
+
 class TeamDetector:
-    def __init__(self, img: np.ndarray, detector_results: list) -> None:
+    def __init__(self, img: np.ndarray, detector_results: list, feature_extractor: str=PIXEL_FEATURES,
+                 appearance_cache: TrackAppearanceCache=None, frame_no: int=0) -> None:
         """
         Initialize the TeamDetector object.
         Args:
             img (np.ndarray): The input image.
             detector_results (list['ultralytics.engine.results.Results']): 
+            feature_extractor (str): Player features to cluster:
+                "pixels" - raw pixels of player images resized to 128x256 (~98k dimensions)
+                "color_histogram" - HSV colour histogram of the torso region, without the pitch (40 dimensions)
+            appearance_cache (TrackAppearanceCache): Cache of player features by track id (optional);
+                players with cached features aren't cropped and have no image
+            frame_no (int): The frame number (used with appearance_cache).
         Returns:
             None
         """
+        if feature_extractor not in _feature_extractors:
+            raise ValueError(f"Unknown feature extractor {feature_extractor}, expected one of {list(_feature_extractors)}")
         self.img = img
         self.results = detector_results
+        self.feature_extractor = feature_extractor
         self.player_info = []
+        extract_features = _feature_extractors[feature_extractor]
         for result in self.results:
             for id, cls, box in zip(result.boxes.id, result.boxes.cls.tolist(), result.boxes.xyxy.tolist()):
                 if cls == 0:
+                    cached = appearance_cache.get(int(id), frame_no, box) if appearance_cache is not None else None
+                    if cached is not None:
+                        features, brightness = cached
+                        self.player_info.append({"img": None, "box": box, "id": int(id), "features": features, "brightness": brightness})
+                        continue
                     x1, y1, x2, y2 = map(int, box)
-                    cropped_img = cv2.resize(self.img[y1:y2, x1:x2], (128, 256))
-                    self.player_info.append({"img": cropped_img, "box": box, "id": int(id)})
+                    player_img = self.img[y1:y2, x1:x2]
+                    if player_img.size == 0:
+                        # Boxes thinner than a pixel (or outside the image) have no appearance, the player gets no team
+                        continue
+                    if feature_extractor == PIXEL_FEATURES:
+                        player_img = cv2.resize(player_img, (128, 256))
+                    features, brightness = extract_features(player_img), np.mean(player_img)
+                    if appearance_cache is not None:
+                        appearance_cache.put(int(id), frame_no, box, features, brightness)
+                    self.player_info.append({"img": player_img, "box": box, "id": int(id), "features": features, "brightness": brightness})
 
     def predict_teams(self) -> np.ndarray:
         """
@@ -57,6 +133,15 @@ class TeamDetector:
     
         return [player["img"] for player in self.player_info]
     
+    def get_player_features(self) -> np.ndarray:
+        """
+        Get the features used to cluster player images into teams.
+
+        Returns:
+            np.ndarray: A 2D array with one row of features per player.
+        """
+        return np.array([player["features"] for player in self.player_info])
+
     def predict_player_clusters(self, player_imgs: list[np.ndarray]) -> np.ndarray:
         """
         Predicts the team labels for a list of player images.
@@ -68,15 +153,17 @@ class TeamDetector:
             List[int]: A list of predicted team labels for each player image.
         """
         ids = [player['id'] for player in self.player_info if 'id' in player]
-        player_imgs_format = np.array([img.flatten() for img in player_imgs])
+        player_imgs_format = self.get_player_features()
 
         kmeans = KMeans(n_clusters=2)
         pred_labels_kmeans = kmeans.fit_predict(player_imgs_format)
 
-        # check if the first cluster center has a higher mean value than the second cluster center
-        cluster_centers = kmeans.cluster_centers_
-        cluster_center_means = np.mean(cluster_centers,axis=1)
-        if cluster_center_means[0] > cluster_center_means[1]:
+        # check if the players of the first cluster are brighter than the players of the second cluster
+        # (for pixel features, this is the mean value of the cluster centers)
+        player_brightness = np.array([player["brightness"] for player in self.player_info])
+        cluster_sizes = np.bincount(pred_labels_kmeans, minlength=2)
+        cluster_brightness = np.bincount(pred_labels_kmeans, weights=player_brightness, minlength=2)/np.maximum(cluster_sizes, 1)
+        if cluster_brightness[0] > cluster_brightness[1]:
             pred_labels_kmeans = np.where(pred_labels_kmeans==0, 1, 0)
     
         if len(player_imgs_format) > 14:
@@ -127,4 +214,137 @@ class TeamDetector:
         class_indices_sorted_by_distance = class_indices[np.argsort(cluster_distances[:, class_id][class_indices])]
         selected_indices = class_indices_sorted_by_distance[:n]
 
-        return selected_indices
\ No newline at end of file
+        return selected_indices
+
+
+class VideoTeamModel:
+    def __init__(self, feature_extractor: str=COLOR_HISTOGRAM_FEATURES, sample_every: int=10,
+                 appearance_cache: TrackAppearanceCache=None) -> None:
+        """
+        Team model fitted once per video (instead of once per frame), so that team labels are stable across frames.
+        Player features are collected frame by frame, the clustering model is fitted on the players
+        from a subset of frames, and every track id gets the team most of its player images were assigned to.
+        Args:
+            feature_extractor (str): Player features to cluster (see TeamDetector);
+                compact features are recommended, as the features of all players of the video are kept in memory
+            sample_every (int): Fit the clustering model on the players from every n-th frame
+            appearance_cache (TrackAppearanceCache): Cache of player features by track id (optional)
+        Returns:
+            None
+        """
+        if feature_extractor not in _feature_extractors:
+            raise ValueError(f"Unknown feature extractor {feature_extractor}, expected one of {list(_feature_extractors)}")
+        self.feature_extractor = feature_extractor
+        self.sample_every = sample_every
+        self.appearance_cache = appearance_cache
+        self.kmeans = None
+        self._swap_labels = False
+        self._ids = []
+        self._frames = []
+        self._features = []
+        self._brightness = []
+
+    def add_frame(self, frame_no: int, img: np.ndarray, detector_results: list) -> None:
+        """
+        Collect the player features of a single frame.
+        Args:
+            frame_no (int): The frame number.
+            img (np.ndarray): The input image.
+            detector_results (list['ultralytics.engine.results.Results']):
+        Returns:
+            None
+        """
+        detector = TeamDetector(img, detector_results, feature_extractor=self.feature_extractor,
+                                appearance_cache=self.appearance_cache, frame_no=frame_no)
+        if not detector.player_info:
+            return
+        self._ids.append([player["id"] for player in detector.player_info])
+        self._frames.append(np.full(len(detector.player_info), frame_no))
+        self._features.append(detector.get_player_features().astype(np.float32))
+        self._brightness.append([player["brightness"] for player in detector.player_info])
+
+    def fit(self) -> "VideoTeamModel":
+        """
+        Fit the clustering model on the players from every n-th frame.
+
+        Returns:
+            VideoTeamModel: The fitted model (self).
+        """
+        features, frames, _, brightness = self._collected()
+        if len(features) < 2:
+            return self
+        sampled = frames % self.sample_every == 0
+        if np.count_nonzero(sampled) < 2:
+            sampled = np.ones(len(features), dtype=bool)
+
+        self.kmeans = KMeans(n_clusters=2, n_init=10)
+        labels = self.kmeans.fit_predict(features[sampled])
+        # Team 1 is the cluster with brighter players (same as TeamDetector)
+        cluster_sizes = np.bincount(labels, minlength=2)
+        cluster_brightness = np.bincount(labels, weights=brightness[sampled], minlength=2)/np.maximum(cluster_sizes, 1)
+        self._swap_labels = cluster_brightness[0] > cluster_brightness[1]
+        return self
+
+    def predict(self, player_features: np.ndarray) -> np.ndarray:
+        """
+        Predict the team labels of player features.
+
+        Args:
+            player_features (np.ndarray): A 2D array with one row of features per player image.
+
+        Returns:
+            np.ndarray: The predicted team labels.
+        """
+        labels = self.kmeans.predict(player_features)
+        return np.where(labels==0, 1, 0) if self._swap_labels else labels
+
+    def predict_teams_by_track(self) -> pd.DataFrame:
+        """
+        Predict the team of every track id by majority vote of the predictions of its player images.
+
+        Returns:
+            pd.DataFrame: The team prediction (columns "id" and "pred_team").
+        """
+        features, _, ids, _ = self._collected()
+        if self.kmeans is None:
+            return pd.DataFrame(columns=["id", "pred_team"])
+        labels = self.predict(features)
+        votes = pd.DataFrame({"id": ids, "pred_team": labels})
+        return votes.groupby("id")["pred_team"].agg(lambda track_labels: np.bincount(track_labels).argmax()).reset_index()
+
+    def _collected(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        if not self._features:
+            return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+        return (np.concatenate(self._features), np.concatenate(self._frames),
+                np.concatenate(self._ids), np.concatenate(self._brightness))
+
+
+def _pixel_features(player_img: np.ndarray) -> np.ndarray:
+    return player_img.flatten()
+
+def _color_histogram_features(player_img: np.ndarray) -> np.ndarray:
+    """
+    Describe the jersey colour of a player: an 8x4 hue/saturation histogram and an 8 bin value histogram
+    of the torso region, with the green pitch pixels masked out.
+    """
+    height, width = player_img.shape[:2]
+    # NB - YOLO frames are 8-bit BGR images
+    torso_img = player_img[int(0.15*height):int(0.55*height), int(0.2*width):int(0.8*width)].astype(np.uint8)
+    if torso_img.size == 0:
+        return np.zeros(40)
+    torso_hsv = cv2.cvtColor(torso_img, cv2.COLOR_BGR2HSV)
+    not_pitch_mask = cv2.bitwise_not(cv2.inRange(torso_hsv, (30, 40, 40), (90, 255, 255)))
+    if cv2.countNonZero(not_pitch_mask) == 0:
+        not_pitch_mask = None
+    hue_saturation_hist = cv2.calcHist([torso_hsv], [0, 1], not_pitch_mask, [8, 4], [0, 180, 0, 256]).flatten()
+    value_hist = cv2.calcHist([torso_hsv], [2], not_pitch_mask, [8], [0, 256]).flatten()
+    return np.concatenate([hue_saturation_hist/max(hue_saturation_hist.sum(), 1), value_hist/max(value_hist.sum(), 1)])
+
+def _box_area(box: list) -> float:
+    x1, y1, x2, y2 = box
+    return max(x2 - x1, 0) * max(y2 - y1, 0)
+
+_feature_extractors = {
+    PIXEL_FEATURES: _pixel_features,
+    COLOR_HISTOGRAM_FEATURES: _color_histogram_features,
+}
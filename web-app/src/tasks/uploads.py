@@ -0,0 +1,197 @@
+import os
+import json
+import uuid
+import time
+import fcntl
+import hashlib
+import tempfile
+from typing import Any, BinaryIO, Callable
+from celery.utils.log import get_task_logger
+from .video_hash import COPY_CHUNK_BYTES, store_video_deduplicated
+
+logger = get_task_logger(__name__)
+
+# Directory of the uploads in progress, within the video directory
+UPLOADS_DIR_NAME = ".uploads"
+# Uploads not receiving any chunk for this long are abandoned and removed
+UPLOAD_EXPIRY_SECONDS = 24 * 3600
+
+class ChunkedUploads:
+    """
+    Resumable uploads of videos in chunks. The chunks are appended to a partial file in the video directory as they arrive
+    and hashed on the fly; a dropped upload is resumed from the offset of the partial file.
+    Every upload has its metadata (file name, size, analysis parameters) in <upload id>.json and its data in <upload id>.part.
+    Once the last chunk arrived, the video is stored under its checksum (see store_video_deduplicated) and its analysis submitted,
+    and the upload is removed. Uploads abandoned for expiry_seconds (by the modification time of their metadata,
+    refreshed by every chunk) are removed when a new upload starts.
+    NB - the SHA-256 state of the partial files is kept in the memory of the process; a partial file appended to
+    by another process (or before a restart) is hashed again from the start on its next chunk
+    Args:
+        video_data_dir (str): directory of the videos
+        expiry_seconds (int): time without chunks after which an unfinished upload is removed
+    """
+    def __init__(self, video_data_dir: str, expiry_seconds: int=UPLOAD_EXPIRY_SECONDS):
+        self._video_data_dir = video_data_dir
+        self._expiry_seconds = expiry_seconds
+        self._uploads_dir = os.path.join(video_data_dir, UPLOADS_DIR_NAME)
+        os.makedirs(self._uploads_dir, exist_ok=True)
+        # Upload id -> [offset hashed up to, SHA-256 state]
+        self._hashes = {}
+
+    def create(self, filename: str, size: int, params: dict[str, Any]) -> str:
+        """
+        Start an upload, removing the expired uploads first.
+        Args:
+            filename (str): name of the uploaded file
+            size (int): size of the file in bytes
+            params (dict): analysis parameters (JSON serializable), passed to the submit function once the upload is complete
+        Return:
+            upload id
+        """
+        if size < 1:
+            raise ValueError(f"Upload must have at least 1 byte, got {size}")
+        self.remove_expired()
+        upload_id = uuid.uuid4().hex
+        open(self._get_path(upload_id, ".part"), "wb").close()
+        self._write_metadata(upload_id, dict(filename=filename, size=size, params=params))
+        logger.info(f"Started upload {upload_id} of {filename} ({size} bytes)")
+        return upload_id
+
+    def get_status(self, upload_id: str) -> dict[str, Any]:
+        """
+        Get the status of the upload: "offset" (bytes received), "size" and "result_id" (None until the analysis was submitted).
+        Raises KeyError for unknown uploads, including the uploads removed once their analysis was submitted.
+        """
+        metadata = self._read_metadata(upload_id)
+        if "video_path" in metadata:
+            offset = metadata["size"]
+        else:
+            offset = os.path.getsize(self._get_path(upload_id, ".part"))
+        return dict(offset=offset, size=metadata["size"], result_id=None)
+
+    def append(self, upload_id: str, offset: int, stream: BinaryIO, submit: Callable[[str, str, dict], str]) -> dict[str, Any]:
+        """
+        Append a chunk to the upload; once the upload is complete, store the video, submit its analysis and remove the upload.
+        Once the video is stored, chunks are ignored: appending the last chunk again submits the analysis again if the submission failed.
+        Once the analysis is submitted, the upload is unknown (the status with the result id is only returned for the last chunk).
+        Raises KeyError for unknown uploads, ValueError if the chunk doesn't start at the current offset (e.g. it was received before)
+        or exceeds the upload size, and BlockingIOError if another chunk of the upload is being appended.
+        Args:
+            upload_id (str): upload id
+            offset (int): offset of the chunk in the file
+            stream (BinaryIO): chunk data, copied in pieces of COPY_CHUNK_BYTES
+            submit (Callable[str, str, dict]): function submitting the analysis of a video (path, SHA-256 checksum, analysis parameters),
+                returning the result id
+        Return:
+            status of the upload (see get_status)
+        """
+        # Fail for unknown uploads before creating their lock file
+        self._read_metadata(upload_id)
+        with open(self._get_path(upload_id, ".lock"), "w") as lock_file:
+            # NB - not waiting for the lock, a blocked lock call would block all the requests served by the gevent server
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            metadata = self._read_metadata(upload_id)
+            if "video_path" not in metadata:
+                received = self._append_chunk(upload_id, offset, stream, size=metadata["size"])
+                # Received chunks keep the upload from expiring
+                os.utime(self._get_path(upload_id, ".json"))
+                if received < metadata["size"]:
+                    return self.get_status(upload_id)
+                metadata = self._store(upload_id, metadata)
+            result_id = submit(metadata["video_path"], metadata["sha256sum"], metadata["params"])
+            # NB - the lock file is removed while locked, a chunk arriving meanwhile locks a new lock file and finds the upload removed
+            self._remove(upload_id)
+        return dict(offset=metadata["size"], size=metadata["size"], result_id=result_id)
+
+    def remove_expired(self) -> None:
+        """
+        Remove the uploads which didn't receive any chunk for the expiry time (skipping the uploads receiving a chunk right now).
+        """
+        expired_before = time.time() - self._expiry_seconds
+        for entry in os.scandir(self._uploads_dir):
+            upload_id, extension = os.path.splitext(entry.name)
+            if extension != ".json" or not upload_id.isalnum():
+                continue
+            try:
+                if entry.stat().st_mtime >= expired_before:
+                    continue
+            except FileNotFoundError:
+                # NB - uploads are finished or removed by other processes concurrently
+                continue
+            with open(self._get_path(upload_id, ".lock"), "w") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._remove(upload_id)
+            logger.info(f"Removed upload {upload_id}, expired after {self._expiry_seconds}s without chunks")
+
+    def _append_chunk(self, upload_id: str, offset: int, stream: BinaryIO, size: int) -> int:
+        part_path = self._get_path(upload_id, ".part")
+        with open(part_path, "ab") as f:
+            current_offset = f.tell()
+            if offset != current_offset:
+                raise ValueError(f"Upload {upload_id} continues at offset {current_offset}, got a chunk at offset {offset}")
+            hashed = self._get_hash(upload_id, part_path, current_offset)
+            while chunk := stream.read(COPY_CHUNK_BYTES):
+                if current_offset + len(chunk) > size:
+                    raise ValueError(f"Upload {upload_id} exceeds its size of {size} bytes")
+                f.write(chunk)
+                hashed[1].update(chunk)
+                current_offset += len(chunk)
+                hashed[0] = current_offset
+        return current_offset
+
+    def _store(self, upload_id: str, metadata: dict[str, Any]) -> dict[str, Any]:
+        part_path = self._get_path(upload_id, ".part")
+        sha256sum = self._get_hash(upload_id, part_path, metadata["size"])[1].hexdigest()
+        video_path = store_video_deduplicated(part_path, self._video_data_dir, metadata["filename"], sha256sum)
+        del self._hashes[upload_id]
+        logger.info(f"Finished upload {upload_id} of {metadata['filename']}, saved to {video_path}")
+        metadata = dict(metadata, sha256sum=sha256sum, video_path=video_path)
+        self._write_metadata(upload_id, metadata)
+        return metadata
+
+    def _remove(self, upload_id: str) -> None:
+        # The metadata is removed first, so that the upload is unknown from then on
+        for extension in [".json", ".part", ".lock"]:
+            try:
+                os.unlink(self._get_path(upload_id, extension))
+            except FileNotFoundError:
+                pass
+        self._hashes.pop(upload_id, None)
+
+    def _get_hash(self, upload_id: str, part_path: str, offset: int) -> list:
+        hashed = self._hashes.get(upload_id)
+        if hashed is None or hashed[0] != offset:
+            logger.info(f"Hashing the {offset} bytes received so far of upload {upload_id}")
+            sha256 = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                while chunk := f.read(COPY_CHUNK_BYTES):
+                    sha256.update(chunk)
+            hashed = [offset, sha256]
+            self._hashes[upload_id] = hashed
+        return hashed
+
+    def _read_metadata(self, upload_id: str) -> dict[str, Any]:
+        try:
+            with open(self._get_path(upload_id, ".json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(upload_id) from None
+
+    def _write_metadata(self, upload_id: str, metadata: dict[str, Any]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self._uploads_dir, prefix=".metadata-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, self._get_path(upload_id, ".json"))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _get_path(self, upload_id: str, extension: str) -> str:
+        # NB - upload ids come from the requests, only the ids made by create are valid file names
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        return os.path.join(self._uploads_dir, upload_id + extension)
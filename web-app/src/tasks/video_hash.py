@@ -0,0 +1,163 @@
+import os
+import hashlib
+import tempfile
+from typing import BinaryIO, Union
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+# Size of the chunks the uploaded videos are copied (and hashed) in
+COPY_CHUNK_BYTES = 4 * 2**20
+
+class VideoHashIndex:
+    """
+    Persistent index of the SHA-256 checksums of video files, so that a video isn't read end-to-end to look up its results.
+    A checksum is keyed by the file identity (path, size, modification time, inode): a replaced or modified file is hashed again.
+    Directories (e.g. OpenVINO models) are keyed by the identities of all their files.
+    Every entry is a small file in a directory per path, written atomically, so that the index is shared by the processes
+    (web app and workers) without locking. Indexing a new version of a file removes the entries of its previous versions.
+    Args:
+        index_dir (str): directory of the index entries (created if missing)
+    """
+    def __init__(self, index_dir: str):
+        self._index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+
+    def get(self, video_path: str) -> Union[str, None]:
+        """
+        Get the indexed checksum of the video file, or None if the file (in its current version) isn't indexed.
+        """
+        try:
+            with open(self._get_entry_path(video_path), "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def put(self, video_path: str, sha256sum: str) -> None:
+        """
+        Index the checksum of the video file in its current version.
+        """
+        entry_path = self._get_entry_path(video_path)
+        entry_dir = os.path.dirname(entry_path)
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix=".entry-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(sha256sum)
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # NB - temporary files (starting with a dot) are left to the processes writing them
+        for name in os.listdir(entry_dir):
+            if not name.startswith(".") and name != os.path.basename(entry_path):
+                logger.debug(f"Removing the stale checksum index entry {name} of {video_path}")
+                try:
+                    os.unlink(os.path.join(entry_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def get_or_calculate(self, video_path: str) -> str:
+        """
+        Get the checksum of the video file from the index, calculating and indexing it if the file isn't indexed.
+        """
+        sha256sum = self.get(video_path)
+        if sha256sum is not None:
+            return sha256sum
+        logger.info(f"SHA-256 checksum of {video_path} not indexed, calculating it")
+        sha256sum = calculate_sha256sum(video_path)
+        self.put(video_path, sha256sum)
+        return sha256sum
+
+    def _get_entry_path(self, video_path: str) -> str:
+        real_path = os.path.realpath(video_path)
+        key = real_path
+        for file_path in _get_file_paths(video_path):
+            stat = os.stat(file_path)
+            if file_path != video_path:
+                key += f"\0{os.path.relpath(file_path, video_path)}"
+            key += f"\0{stat.st_size}\0{stat.st_mtime_ns}\0{stat.st_ino}"
+        return os.path.join(self._index_dir, hashlib.sha1(real_path.encode()).hexdigest(), hashlib.sha1(key.encode()).hexdigest())
+
+def get_video_hash_index() -> VideoHashIndex:
+    """
+    Get the video checksum index in VIDEO_HASH_INDEX_DIR (default: a directory in the system temp directory).
+    """
+    return VideoHashIndex(os.getenv("VIDEO_HASH_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "video_sha256_index"))
+
+def get_video_sha256sum(video_path: str) -> str:
+    """
+    Get the SHA-256 checksum of the video file, read from the index if the file was hashed before (e.g. on upload).
+    """
+    return get_video_hash_index().get_or_calculate(video_path)
+
+def save_video_deduplicated(stream: BinaryIO, video_data_dir: str, filename: str) -> tuple[str, str]:
+    """
+    Save the uploaded video stream as <sha256><extension> in the video directory, calculating its SHA-256 checksum on the fly,
+    and index the checksum. A video uploaded again isn't stored twice: the existing file is kept and the new copy is dropped.
+    Args:
+        stream (BinaryIO): uploaded video
+        video_data_dir (str): directory of the videos
+        filename (str): name of the uploaded file (only its extension is kept)
+    Return:
+        tuple (path of the saved video, SHA-256 checksum of the video)
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=video_data_dir, prefix=".upload-")
+    try:
+        # NB - temporary files are private, the video is read by the workers
+        os.fchmod(fd, 0o644)
+        sha256 = hashlib.sha256()
+        with os.fdopen(fd, "wb") as f:
+            while chunk := stream.read(COPY_CHUNK_BYTES):
+                sha256.update(chunk)
+                f.write(chunk)
+        sha256sum = sha256.hexdigest()
+        return store_video_deduplicated(tmp_path, video_data_dir, filename, sha256sum), sha256sum
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def store_video_deduplicated(uploaded_path: str, video_data_dir: str, filename: str, sha256sum: str) -> str:
+    """
+    Move an uploaded video file to <sha256><extension> in the video directory and index its checksum.
+    If the video was uploaded before, the existing file is kept and the uploaded file is removed.
+    Args:
+        uploaded_path (str): path of the uploaded file (in the video directory, so that it's moved without copying)
+        video_data_dir (str): directory of the videos
+        filename (str): name of the uploaded file (only its extension is kept)
+        sha256sum (str): SHA-256 checksum of the uploaded file
+    Return:
+        path of the stored video
+    """
+    video_path = os.path.join(video_data_dir, sha256sum + os.path.splitext(filename)[1].lower())
+    if os.path.exists(video_path):
+        logger.info(f"Video {filename} was uploaded before as {video_path}, dropping the copy")
+        os.unlink(uploaded_path)
+    else:
+        # NB - concurrent uploads of the same video may replace each other's file, but the content is the same
+        os.replace(uploaded_path, video_path)
+    get_video_hash_index().put(video_path, sha256sum)
+    return video_path
+
+def calculate_sha256sum(filename: str) -> str:
+    """
+    Calculate the SHA-256 checksum of a file, reading it end-to-end.
+    The checksum of a directory covers the relative paths and the checksums of all its files.
+    """
+    if not os.path.isdir(filename):
+        with open(filename, 'rb', buffering=0) as f:
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+    sha256 = hashlib.sha256()
+    for file_path in _get_file_paths(filename):
+        sha256.update(os.path.relpath(file_path, filename).encode() + b"\0")
+        sha256.update(bytes.fromhex(calculate_sha256sum(file_path)))
+    return sha256.hexdigest()
+
+def _get_file_paths(path: str) -> list[str]:
+    """
+    Get the path of the file, or the sorted paths of the files in the directory and its subdirectories.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(dir_path, name) for dir_path, _, names in os.walk(path) for name in names)
@@ -1,17 +1,32 @@
+from typing import Iterable, Iterator
+import os
+import multiprocessing
 import ultralytics
 import pandas as pd
 import numpy as np
+from celery.utils.log import get_task_logger
 
-from .team_detector import TeamDetector
+from .team_detector import TeamDetector, VideoTeamModel, TrackAppearanceCache
+from .frame_ring import SharedFrameRing
 
-frames = 0
+logger = get_task_logger(__name__)
 
-def make_callback_adapter_with_counter(event_name, callback):
+# Team prediction modes: teams clustered independently in every frame or once for the whole video
+TEAMS_PER_FRAME = "frame"
+TEAMS_PER_VIDEO = "video"
+# Recompute the appearance (team features) of a track every n frames, or when its box area changes by more than the ratio
+# (default 1 = every frame, i.e. the teams are predicted from the current player images only)
+APPEARANCE_REFRESH_EVERY = int(os.getenv("APPEARANCE_REFRESH_EVERY", 1))
+APPEARANCE_BOX_SIZE_CHANGE = 0.25
+
+def make_callback_adapter_with_counter(event_name, callback, count_items=lambda component: 1):
     """
     Convert the callback function with 2 params to a callback format required by YOLO.
     Args:
         event_name: str: YOLO pipeline event name
         callback: Callable(str, int): a callback function accepting an 2 params: event_name and counter
+        count_items: Callable(component) -> int: number of items (e.g. frames) an event stands for;
+            the callback is called once per item, with the counter incremented by one each time
     Return:
         A callback in the format required by YOLO.
     """
@@ -19,44 +34,115 @@ def make_callback_adapter_with_counter(event_name, callback):
 
     def yolo_callback(component):
         nonlocal event_counter
-        event_counter += 1
-        callback(event_name, event_counter)
+        for _ in range(count_items(component)):
+            event_counter += 1
+            callback(event_name, event_counter)
 
     return yolo_callback
 
-def _convert_single_tracking_result(frame_no, boxes_result:ultralytics.engine.results.Boxes) -> pd.DataFrame:
-    box = boxes_result.boxes # sic!
-    int_vectorized = np.vectorize(np.int_, otypes=[int])
-    if box is not None:
+def count_batch_images(predictor) -> int:
+    """
+    Count the images (frames) of the batch being predicted, for the on_predict_batch_start event.
+    """
+    _, images, _ = predictor.batch
+    return len(images)
+
+class TrackingTableBuilder:
+    """
+    Growable columnar table of YOLO tracking results.
+    Detections are appended frame by frame into preallocated NumPy arrays
+    (doubling the capacity when full) and converted to a single DataFrame at the end.
+    Args:
+        initial_capacity (int): number of detections to preallocate
+    """
+    _column_dtypes = dict(cls=np.int64, x=np.float32, y=np.float32, w=np.float32, h=np.float32,
+                          conf=np.float32, id=np.int64, frame=np.int64, team=np.int64)
+
+    def __init__(self, initial_capacity: int=4096):
+        self._size = 0
+        self._columns = {name: np.empty(initial_capacity, dtype=dtype) for name, dtype in self._column_dtypes.items()}
+        self._names = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, frame_no: int, boxes_result: ultralytics.engine.results.Results, pred_teams_df: pd.DataFrame=None) -> None:
+        """
+        Append the detections of a single video frame.
+        Args:
+            frame_no (int): frame number
+            boxes_result (ultralytics.engine.results.Results): YOLO tracking results for the frame
+            pred_teams_df (pd.DataFrame): team predictions with "id" and "pred_team" columns (optional)
+        """
+        self._names.update(boxes_result.names)
+        box = boxes_result.boxes # sic!
+        if box is None:
+            return
         # NB - Torch tensors may sit on GPU if one was used, they need to be moved to CPU to convert to Numpy
-        class_ids = int_vectorized(box.cls.cpu().numpy())
+        class_ids = box.cls.cpu().numpy().astype(np.int64)
         observation_count = len(class_ids)
+        ids = box.id.cpu().numpy().astype(np.int64) if box.id is not None else np.zeros(shape=observation_count, dtype=np.int64)
+        # NB - use the normalized bounded boxes
+        xywhn = box.xywhn.cpu().numpy()
 
-        def class_id_to_name(id):
-            return boxes_result.names[int(id)]
+        self._reserve(observation_count)
+        rows = slice(self._size, self._size + observation_count)
+        self._columns["cls"][rows] = class_ids
+        self._columns["x"][rows] = xywhn[:, 0]
+        self._columns["y"][rows] = xywhn[:, 1]
+        self._columns["w"][rows] = xywhn[:, 2]
+        self._columns["h"][rows] = xywhn[:, 3]
+        self._columns["conf"][rows] = box.conf.cpu().numpy()
+        self._columns["id"][rows] = ids
+        self._columns["frame"][rows] = frame_no
+        self._columns["team"][rows] = _lookup_teams(ids, pred_teams_df)
+        self._size += observation_count
 
-        class_names = list(map(class_id_to_name, class_ids))
-        ids = int_vectorized(box.id.cpu()) if box.id is not None else np.zeros(shape=observation_count, dtype='int')
-        # NB - use the normalized bounded boxes
-        xywhn = box.xywhn.cpu() 
-        xs = xywhn[:, 0]
-        ys = xywhn[:, 1]
-        ws = xywhn[:, 2]
-        hs = xywhn[:, 3]
-        confs = box.conf.cpu()
-        data = dict(cls=class_ids, x=xs, y=ys, w=ws, h=hs, conf=confs, id=ids, frame=frame_no, cls_name=class_names)
-        df = pd.DataFrame(data=data)
-        return df
-    else:
-        return pd.DataFrame(columns=['cls', 'x', 'y', 'w', 'h', 'conf', 'id', 'frame', 'cls_name'])
-
-def convert_tracking_results_to_pandas(tracking_results: list[ultralytics.engine.results.Results]) -> pd.DataFrame:
+    def build(self) -> pd.DataFrame:
+        """
+        Convert the appended detections to a DataFrame (see convert_tracking_results_to_pandas for the columns).
+        """
+        data = {name: column[:self._size] for name, column in self._columns.items()}
+        # Class names are looked up as categories instead of creating a string per detection
+        cls_ids_with_name = np.array(sorted(self._names), dtype=np.int64)
+        data["cls_name"] = pd.Categorical.from_codes(
+            np.searchsorted(cls_ids_with_name, data["cls"]),
+            categories=[self._names[cls_id] for cls_id in cls_ids_with_name])
+        columns = ["cls", "x", "y", "w", "h", "conf", "id", "frame", "cls_name", "team"]
+        return pd.DataFrame(data=data, columns=columns)
+
+    def _reserve(self, observation_count: int) -> None:
+        capacity = len(self._columns["frame"])
+        if self._size + observation_count <= capacity:
+            return
+        new_capacity = max(2*capacity, self._size + observation_count)
+        for name, column in self._columns.items():
+            new_column = np.empty(new_capacity, dtype=column.dtype)
+            new_column[:self._size] = column[:self._size]
+            self._columns[name] = new_column
+
+def _lookup_teams(ids: np.ndarray, pred_teams_df: pd.DataFrame) -> np.ndarray:
+    """
+    Look up team predictions by object id (-1 for objects without a prediction, e.g. non-players).
+    """
+    teams = np.full(len(ids), -1, dtype=np.int64)
+    if pred_teams_df is None or len(pred_teams_df) == 0:
+        return teams
+    # NB - if an id was predicted more than once, the last prediction wins
+    pred_teams_df = pred_teams_df.drop_duplicates(subset="id", keep="last")
+    positions = pd.Index(pred_teams_df["id"]).get_indexer(ids)
+    has_prediction = positions >= 0
+    teams[has_prediction] = pred_teams_df["pred_team"].to_numpy()[positions[has_prediction]]
+    return teams
+
+def convert_tracking_results_to_pandas(tracking_results: list[ultralytics.engine.results.Results], team_mode: str=TEAMS_PER_FRAME,
+                                       appearance_refresh_every: int=APPEARANCE_REFRESH_EVERY) -> pd.DataFrame:
     """
     Convert YOLOv8 tracking output to a Pandas DataFrame.
     The DataFrame contains the following columns:
         - frame (int): frame number
         - cls (int) - class identifier
-        - cls_name (str) - class name of the tracked object
+        - cls_name (category) - class name of the tracked object
         - conf (float) - class detection confidence
         - id (int): identifier of the tracked object
         - x (int) - coordinates of the bounding boxes
@@ -64,37 +150,140 @@ def convert_tracking_results_to_pandas(tracking_results: list[ultralytics.engine
         - w (int)
         - h (int)
         - frame (int) - frame number
+        - team (int) - predicted team of players (-1 for other objects)
     Args:
         tracking_results (list[ultralytics.engine.results.Results]) - YOLO tracking results
+        team_mode (str) - "frame": cluster the players into teams in every frame;
+                          "video": fit one team model for the whole video and assign a stable team to every track id
+        appearance_refresh_every (int) - recompute the team features of a track every n frames (1 = every frame)
     """
-    dfs = [] # Will contain 1 data frame per video frame
+    if team_mode not in [TEAMS_PER_FRAME, TEAMS_PER_VIDEO]:
+        raise ValueError(f"Unknown team mode {team_mode}, expected one of {[TEAMS_PER_FRAME, TEAMS_PER_VIDEO]}")
+
+    builder = TrackingTableBuilder()
+    appearance_cache = TrackAppearanceCache(refresh_every=appearance_refresh_every, box_size_change=APPEARANCE_BOX_SIZE_CHANGE)
+    video_team_model = VideoTeamModel(appearance_cache=appearance_cache) if team_mode == TEAMS_PER_VIDEO else None
     for i, tr in enumerate(tracking_results):
-        df = _convert_single_tracking_result(i, tr)
-        
-        # init team prediction for non players
-        df["team"] = -1 
-        # update team prediction for players
-        pred_teams_df = _get_team_prediction(tr)
-        for _, row in pred_teams_df.iterrows():
-            df.loc[df['id'] == row['id'], 'team'] = row['pred_team']
+        if video_team_model is not None:
+            video_team_model.add_frame(i, tr.orig_img, tr)
+            builder.append(i, tr)
+        else:
+            pred_teams_df = _get_team_prediction(tr, appearance_cache=appearance_cache, frame_no=i)
+            builder.append(i, tr, pred_teams_df)
+    logger.info(f"Team detection: {appearance_cache.computed_crops} player images processed, "
+                f"{appearance_cache.skipped_crops} skipped thanks to cached track appearance")
 
-        dfs.append(df)
+    df = builder.build()
+    if video_team_model is not None:
+        pred_teams_df = video_team_model.fit().predict_teams_by_track()
+        df["team"] = _lookup_teams(df["id"].to_numpy(), pred_teams_df)
+    return df
 
-    return pd.concat(dfs)
+def iter_tracking_table_chunks(tracking_results: Iterable[ultralytics.engine.results.Results], chunk_frames: int,
+                               appearance_refresh_every: int=APPEARANCE_REFRESH_EVERY) -> Iterator[tuple[int, int, pd.DataFrame]]:
+    """
+    Convert YOLOv8 tracking output to Pandas DataFrames of chunk_frames consecutive frames each.
+    Streaming counterpart of convert_tracking_results_to_pandas: the results are consumed one by one,
+    so a streaming generator never holds more than one frame image. Teams are predicted in every frame.
+    Args:
+        tracking_results (Iterable[ultralytics.engine.results.Results]) - YOLO tracking results, e.g. model.track(stream=True)
+        chunk_frames (int) - number of frames per chunk (the last chunk may be shorter)
+        appearance_refresh_every (int) - recompute the team features of a track every n frames (1 = every frame)
+    Return:
+        Iterator of tuples (first frame number, number of frames, DataFrame); the frame numbers in the DataFrame are not rebased
+    """
+    if chunk_frames < 1:
+        raise ValueError(f"Chunk must contain at least 1 frame, got {chunk_frames}")
+
+    appearance_cache = TrackAppearanceCache(refresh_every=appearance_refresh_every, box_size_change=APPEARANCE_BOX_SIZE_CHANGE)
+    builder = TrackingTableBuilder()
+    first_frame = 0
+    frames_count = 0
+    for i, tr in enumerate(tracking_results):
+        pred_teams_df = _get_team_prediction(tr, appearance_cache=appearance_cache, frame_no=i)
+        builder.append(i, tr, pred_teams_df)
+        frames_count += 1
+        if frames_count == chunk_frames:
+            yield first_frame, frames_count, builder.build()
+            builder = TrackingTableBuilder()
+            first_frame += frames_count
+            frames_count = 0
+    if frames_count > 0:
+        yield first_frame, frames_count, builder.build()
+    logger.info(f"Team detection: {appearance_cache.computed_crops} player images processed, "
+                f"{appearance_cache.skipped_crops} skipped thanks to cached track appearance")
+
+def predict_teams_from_ring(ring: SharedFrameRing, detections_queue: multiprocessing.Queue, teams_queue: multiprocessing.Queue,
+                            appearance_refresh_every: int=APPEARANCE_REFRESH_EVERY) -> None:
+    """
+    Predict the teams in every frame, reading the frames from the shared frame ring (target of the team detection process).
+    Args:
+        ring (SharedFrameRing): frame ring, each slot is released once the players were cropped
+        detections_queue (multiprocessing.Queue): tuples (frame number, slot, boxes data of the tracking results, class names),
+            followed by None after the last frame
+        teams_queue (multiprocessing.Queue): receives a single DataFrame with "frame", "id" and "pred_team" columns
+        appearance_refresh_every (int) - recompute the team features of a track every n frames (1 = every frame)
+    """
+    appearance_cache = TrackAppearanceCache(refresh_every=appearance_refresh_every, box_size_change=APPEARANCE_BOX_SIZE_CHANGE)
+    frame_teams = []
+    try:
+        for frame_no, slot, boxes_data, names in iter(detections_queue.get, None):
+            try:
+                pred_teams_df = _get_team_prediction_in_ring(ring, slot, boxes_data, names,
+                                                             appearance_cache=appearance_cache, frame_no=frame_no)
+            finally:
+                ring.release(slot)
+            frame_teams.append(pred_teams_df.assign(frame=frame_no))
+    finally:
+        ring.close()
+    logger.info(f"Team detection: {appearance_cache.computed_crops} player images processed, "
+                f"{appearance_cache.skipped_crops} skipped thanks to cached track appearance")
+    teams_df = pd.concat(frame_teams, ignore_index=True) if frame_teams else pd.DataFrame(columns=["id", "pred_team", "frame"])
+    teams_queue.put(teams_df[["frame", "id", "pred_team"]])
+
+def lookup_frame_teams(tracking_results_df: pd.DataFrame, frame_teams_df: pd.DataFrame) -> np.ndarray:
+    """
+    Look up team predictions by frame and object id (-1 for objects without a prediction, e.g. non-players).
+    Args:
+        tracking_results_df (pd.DataFrame): tracking table with "frame" and "id" columns
+        frame_teams_df (pd.DataFrame): team predictions with "frame", "id" and "pred_team" columns
+    """
+    teams = np.full(len(tracking_results_df), -1, dtype=np.int64)
+    if len(frame_teams_df) == 0:
+        return teams
+    # NB - if an id was predicted more than once in a frame, the last prediction wins
+    frame_teams_df = frame_teams_df.drop_duplicates(subset=["frame", "id"], keep="last")
+    positions = pd.MultiIndex.from_frame(frame_teams_df[["frame", "id"]].astype(np.int64)) \
+        .get_indexer(pd.MultiIndex.from_frame(tracking_results_df[["frame", "id"]].astype(np.int64)))
+    has_prediction = positions >= 0
+    teams[has_prediction] = frame_teams_df["pred_team"].to_numpy()[positions[has_prediction]]
+    return teams
+
+def _get_team_prediction_in_ring(ring: SharedFrameRing, slot: int, boxes_data: np.ndarray, names: dict,
+                                 appearance_cache: TrackAppearanceCache, frame_no: int) -> pd.DataFrame:
+    """
+    Get the team prediction for the frame in the ring slot and the tracked boxes (N,7) of the frame.
+    NB - no reference to the frame outlives the call, so that the slot can be reused
+    """
+    boxes_result = ultralytics.engine.results.Results(orig_img=ring.get(slot), path="", names=names, boxes=boxes_data)
+    return _get_team_prediction(boxes_result, appearance_cache=appearance_cache, frame_no=frame_no)
 
-def _get_team_prediction(tracking_results: list[ultralytics.engine.results.Results]) -> pd.DataFrame:
+def _get_team_prediction(tracking_results: list[ultralytics.engine.results.Results],
+                         appearance_cache: TrackAppearanceCache=None, frame_no: int=0) -> pd.DataFrame:
     """
     Get the team prediction from the tracking results.
     Args:
         tracking_results (ultralytics.engine.results.Results): The tracking results.
+        appearance_cache (TrackAppearanceCache): Cache of player features by track id (optional).
+        frame_no (int): The frame number (used with appearance_cache).
     Returns:
         pd.DataFrame: The team prediction.
     """
     frame = tracking_results.orig_img
-    detector = TeamDetector(frame, tracking_results)
+    detector = TeamDetector(frame, tracking_results, appearance_cache=appearance_cache, frame_no=frame_no)
     lst_player_imgs = detector.get_player_images()
 
     if not lst_player_imgs:
         return pd.DataFrame(columns=["id", "pred_team"])
 
-    return detector.predict_player_clusters(lst_player_imgs)
\ No newline at end of file
+    return detector.predict_player_clusters(lst_player_imgs)
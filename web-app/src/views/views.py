@@ -1,8 +1,12 @@
 import logging
 from celery.result import AsyncResult
 from flask import request, jsonify, Blueprint
+import redis
 
 from tasks import tasks
+from tasks.inflight import InFlightTaskRegistry
+from tasks.uploads import ChunkedUploads
+from tasks.video_hash import save_video_deduplicated
 
 import os
 import tempfile
@@ -10,6 +14,9 @@ import tempfile
 bp = Blueprint("tasks", __name__, url_prefix="/tasks")
 logger = logging.getLogger(__name__)
 
+inflight_registry = InFlightTaskRegistry(redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379")))
+chunked_uploads = ChunkedUploads(os.getenv("VIDEO_DATA_DIR", tempfile.gettempdir()))
+
 @bp.get("/result/<id>")
 def result(id: str) -> dict[str, object]:
     result = AsyncResult(id)
@@ -29,13 +36,92 @@ def upload():
     file = request.files['file']
     
     video_data_dir = os.getenv("VIDEO_DATA_DIR", tempfile.gettempdir())
-    video_path = os.path.join(video_data_dir, file.filename)
+    # NB - the checksum is calculated while saving, so that the analysis doesn't read the whole video again to look it up;
+    # the video is saved under its checksum, so that the same video uploaded again isn't stored twice
+    video_path, video_sha256sum = save_video_deduplicated(file.stream, video_data_dir, file.filename)
+    logger.info(f"File {file.filename} saved to {video_path}")
+
+    result_id = _submit_analysis(video_path, video_sha256sum, _get_analysis_params(streaming=request.form.get("streaming") == "true"))
+    return {"result_id": result_id}
+
+@bp.post('/uploads')
+def create_upload():
+    """
+    Start a resumable upload of a video in chunks.
+    Request: JSON with "filename", "size" (bytes) and "streaming" (bool, optional)
+    Response: "upload_id" and the status of the upload (see upload_status)
+    """
+    body = request.get_json(silent=True) or {}
+    filename, size = body.get("filename"), body.get("size")
+    if not isinstance(filename, str) or not filename or not isinstance(size, int) or size < 1:
+        return jsonify({'message': 'Expected the file name and its size (bytes) of the upload'}), 400
+    upload_id = chunked_uploads.create(filename, size, params=_get_analysis_params(streaming=body.get("streaming") is True))
+    return {"upload_id": upload_id, **chunked_uploads.get_status(upload_id)}
+
+@bp.get('/uploads/<upload_id>')
+def upload_status(upload_id: str):
+    """
+    Get the status of a resumable upload: "offset" (bytes received, to resume the upload from), "size" and "result_id" (None).
+    Once the upload is complete and the video analysis submitted, the upload is removed (404).
+    """
+    try:
+        return chunked_uploads.get_status(upload_id)
+    except KeyError:
+        return jsonify({'message': f'Unknown upload {upload_id}'}), 404
+
+@bp.put('/uploads/<upload_id>')
+def upload_chunk(upload_id: str):
+    """
+    Append the request body to a resumable upload at the offset given by the Upload-Offset header.
+    The body is written to disk as it arrives; the video analysis is submitted as soon as the last chunk is received.
+    Response: the status of the upload (see upload_status), with the "result_id" of the analysis for the last chunk;
+    409 with the status if the chunk doesn't continue the upload
+    """
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset is None:
+        return jsonify({'message': 'Expected the offset of the chunk in the Upload-Offset header'}), 400
+    try:
+        return chunked_uploads.append(upload_id, offset, request.stream, submit=_submit_analysis)
+    except KeyError:
+        return jsonify({'message': f'Unknown upload {upload_id}'}), 404
+    except (BlockingIOError, ValueError) as e:
+        message = f'Another chunk of upload {upload_id} is being received' if isinstance(e, BlockingIOError) else str(e)
+        try:
+            # NB - the other chunk may have completed (and removed) the upload meanwhile
+            return jsonify({'message': message, **chunked_uploads.get_status(upload_id)}), 409
+        except KeyError:
+            return jsonify({'message': f'Unknown upload {upload_id}'}), 404
 
-    file.save(video_path)
-    logger.info(f"File saved to {video_path}")
+def _get_analysis_params(streaming: bool) -> dict[str, bool]:
+    """
+    Get the parameters of the analysis of an uploaded video.
+    The analysis modes exclude each other; the modes enabled by the deployment take precedence over the client's request:
+    PARALLEL_VIDEO_ANALYSIS, then MULTIPROCESS_VIDEO_ANALYSIS, then streaming (the default of the dashboard), then a single process.
+    Args:
+        streaming (bool): whether the client asked to receive the coordinates in chunks while the video is being analysed
+    """
+    # Frame ranges of the video are analysed by all the workers at once
+    parallel = os.getenv("PARALLEL_VIDEO_ANALYSIS") == "True"
+    # In multi-process mode, frame decoding, tracking and team detection run concurrently on separate cores
+    multiprocess = os.getenv("MULTIPROCESS_VIDEO_ANALYSIS") == "True" and not parallel
+    # In streaming mode, the coordinates are published in chunks while the video is being analysed
+    streaming = streaming and not parallel and not multiprocess
+    return dict(parallel=parallel, streaming=streaming, multiprocess=multiprocess)
 
-    # TO CONSIDER - send task by name
-    # current_app.extensions["celery"].send_task('video_analysis', args=[video_path])
-    result = tasks.video_analysis.delay(video_path=video_path)
+def _submit_analysis(video_path: str, video_sha256sum: str, params: dict[str, bool]) -> str:
+    """
+    Submit the analysis of an uploaded video, unless the same video is already analysed with the same parameters.
+    Return:
+        id of the analysis result
+    """
+    def submit(task_id: str) -> None:
+        # TO CONSIDER - send task by name
+        # current_app.extensions["celery"].send_task('video_analysis', args=[video_path])
+        if params["parallel"]:
+            tasks.analyse_video_in_parallel(video_path=video_path, task_id=task_id)
+        else:
+            tasks.video_analysis.apply_async(kwargs=dict(video_path=video_path, streaming=params["streaming"],
+                                                         multiprocess=params["multiprocess"]), task_id=task_id)
 
-    return {"result_id": result.id}
\ No newline at end of file
+    # Identical uploads (same video and analysis parameters) attach to the task of the first one
+    return inflight_registry.get_or_submit(video_sha256sum, params, submit)
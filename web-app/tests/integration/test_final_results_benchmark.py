@@ -0,0 +1,51 @@
+import pytest
+import pickle
+import time
+import pandas as pd
+import numpy as np
+from src.tasks import tasks
+
+
+def _read_tracking_results_as_dataframe(pickled_results_path: str) -> pd.DataFrame:
+    """Unpickles Ultralytics YOLO tracking results and flattens the boxes to a DataFrame (without team detection)"""
+    with open(pickled_results_path, "rb") as f:
+        tracking_results = pickle.load(f)
+
+    dfs = []
+    for frame_no, result in enumerate(tracking_results):
+        xywhn = result.boxes.xywhn.numpy()
+        df = pd.DataFrame(data=dict(
+            cls=result.boxes.cls.numpy().astype(int),
+            x=xywhn[:, 0],
+            y=xywhn[:, 1],
+            team=-1,
+            id=result.boxes.id.numpy().astype(int),
+            frame=frame_no))
+        dfs.append(df)
+    return pd.concat(dfs)
+
+
+def _measure_seconds_per_frame(df: pd.DataFrame, repeat: int=3) -> float:
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tasks._convert_to_final_results(df)
+        best = min(best, time.perf_counter() - start)
+    return best / df["frame"].nunique()
+
+
+@pytest.mark.parametrize("small_results_path,large_results_path", [
+                             ("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle",
+                              "./tests/data/tracking_set_ultralytics/machine_vs_condors_pool_001.pickle")])
+def test_convert_to_final_results_scales_linearly(small_results_path, large_results_path):
+    small_df = _read_tracking_results_as_dataframe(small_results_path)
+    large_df = _read_tracking_results_as_dataframe(large_results_path)
+    assert small_df["frame"].nunique() == 10
+    assert large_df["frame"].nunique() == 1501
+
+    small_seconds_per_frame = _measure_seconds_per_frame(small_df)
+    large_seconds_per_frame = _measure_seconds_per_frame(large_df)
+    print(f"10 frames: {small_seconds_per_frame*1e6:.1f} us/frame; 1501 frames: {large_seconds_per_frame*1e6:.1f} us/frame")
+
+    # A linear builder keeps the cost per frame flat (fixed overheads even make it drop for long videos)
+    assert large_seconds_per_frame < 3 * small_seconds_per_frame
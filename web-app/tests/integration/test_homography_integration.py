@@ -0,0 +1,42 @@
+import pytest
+import pickle
+import pandas as pd
+from numpy.testing import assert_allclose
+from src.tasks.keypoints import KeypointsExtractor
+from src.tasks.homography import calculate_homography_matrix, calculate_homography_matrices
+from src.tasks.tasks import CONF_THRESHOLD, MAX_LOOKBACK
+
+
+def _read_tracking_results_as_dataframe(pickled_results_path: str) -> pd.DataFrame:
+    """Unpickles Ultralytics YOLO tracking results and flattens the boxes to a DataFrame"""
+    with open(pickled_results_path, "rb") as f:
+        tracking_results = pickle.load(f)
+
+    dfs = []
+    for frame_no, result in enumerate(tracking_results):
+        xywhn = result.boxes.xywhn.numpy()
+        df = pd.DataFrame(data=dict(
+            cls=result.boxes.cls.numpy().astype(int),
+            x=xywhn[:, 0],
+            y=xywhn[:, 1],
+            conf=result.boxes.conf.numpy(),
+            frame=frame_no))
+        dfs.append(df)
+    return pd.concat(dfs)
+
+
+@pytest.mark.parametrize("pickled_results_path,expected_total_frames", [
+                             ("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle", 10),
+                             ("./tests/data/tracking_set_ultralytics/machine_vs_condors_pool_001.pickle", 1501)])
+def test_calculate_homography_matrices_same_as_per_frame(pickled_results_path, expected_total_frames):
+    df = _read_tracking_results_as_dataframe(pickled_results_path)
+    keypoints_extractor = KeypointsExtractor(df, conf_threshold=CONF_THRESHOLD, max_lookback=MAX_LOOKBACK)
+    quads = keypoints_extractor.get_all_best_keypoint_quads(expected_total_frames)
+    assert quads.found.all()
+
+    H_all = calculate_homography_matrices(quads)
+
+    assert H_all.shape == (expected_total_frames, 3, 3)
+    for frame in range(expected_total_frames):
+        H = calculate_homography_matrix(quads[frame])
+        assert_allclose(H_all[frame], H, rtol=1e-6, atol=1e-8, err_msg=f"Homography matrix differs for frame {frame}")
@@ -0,0 +1,65 @@
+import pytest
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+import pandas as pd
+import torch
+import ultralytics
+from src.tasks.team_detector import TeamDetector, PIXEL_FEATURES, COLOR_HISTOGRAM_FEATURES
+
+VIDEO_PATH = "./tests/data/videos/machine_vs_condors_pool_001-supertiny.mp4"
+PATH_PREFIX = Path("./tests/data/tracking_set_supertiny_txt")
+
+
+def _read_frames_with_player_boxes(video_path: str) -> list[ultralytics.engine.results.Results]:
+    """Reads the video frames and attaches the player boxes from the labels (YOLO txt format, with track ids)"""
+    video = cv2.VideoCapture(video_path)
+    results = []
+    frame_no = 0
+    while True:
+        ok, img = video.read()
+        if not ok:
+            break
+        labels_path = PATH_PREFIX/f"{Path(video_path).stem}_{frame_no}.txt"
+        df = pd.read_csv(labels_path, sep=" ", header=None, names=["cls", "x", "y", "w", "h", "conf", "id"])
+        height, width = img.shape[:2]
+        x1 = (df["x"] - df["w"]/2) * width
+        y1 = (df["y"] - df["h"]/2) * height
+        x2 = (df["x"] + df["w"]/2) * width
+        y2 = (df["y"] + df["h"]/2) * height
+        boxes = torch.tensor(np.stack([x1, y1, x2, y2, df["id"], df["conf"], df["cls"]], axis=1), dtype=torch.float32)
+        results.append(ultralytics.engine.results.Results(orig_img=img, path=video_path, names={0: "person"}, boxes=boxes))
+        frame_no += 1
+    return results
+
+
+def _predict_teams(result: ultralytics.engine.results.Results, feature_extractor: str, repeat: int=3) -> tuple[np.ndarray, float]:
+    best = np.inf
+    for _ in range(repeat):
+        # NB - KMeans initialization is random, seed it to compare the feature extractors on the same terms
+        np.random.seed(0)
+        start = time.perf_counter()
+        detector = TeamDetector(result.orig_img, [result], feature_extractor=feature_extractor)
+        pred_teams_df = detector.predict_player_clusters(detector.get_player_images())
+        best = min(best, time.perf_counter() - start)
+    return pred_teams_df["pred_team"].to_numpy(), best
+
+
+@pytest.mark.parametrize("video_path", [(VIDEO_PATH)])
+def test_color_histogram_features_faster_and_agree_with_pixel_features(video_path):
+    results = _read_frames_with_player_boxes(video_path)
+    assert len(results) == 2
+
+    agreements = []
+    for result in results:
+        pixel_labels, pixel_seconds = _predict_teams(result, PIXEL_FEATURES)
+        histogram_labels, histogram_seconds = _predict_teams(result, COLOR_HISTOGRAM_FEATURES)
+        # Cluster labels may be swapped between the two feature extractors
+        agreement = max(np.mean(pixel_labels == histogram_labels), np.mean(pixel_labels != histogram_labels))
+        agreements.append(agreement)
+        print(f"{len(pixel_labels)} players: pixels {pixel_seconds*1000:.1f} ms; "
+              f"color histogram {histogram_seconds*1000:.1f} ms; agreement {agreement:.0%}")
+        assert histogram_seconds < pixel_seconds
+
+    assert np.mean(agreements) >= 0.8
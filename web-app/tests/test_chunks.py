@@ -0,0 +1,46 @@
+import pytest
+import pickle
+import numpy as np
+import pandas as pd
+from src.tasks import chunks
+from src.tasks.yolo_helper import TrackingTableBuilder
+
+def test_split_frame_ranges():
+    assert chunks.split_frame_ranges(10, chunk_frames=4, overlap=2) == [(0, 4), (2, 8), (6, 10)]
+    assert chunks.split_frame_ranges(8, chunk_frames=4, overlap=0) == [(0, 4), (4, 8)]
+    assert chunks.split_frame_ranges(0, chunk_frames=4, overlap=2) == []
+
+def test_split_frame_ranges_invalid_overlap():
+    with pytest.raises(ValueError):
+        chunks.split_frame_ranges(10, chunk_frames=4, overlap=5)
+
+def test_box_iou():
+    boxes_a = np.array([[0.5, 0.5, 0.2, 0.2], [0.5, 0.5, 0.2, 0.2], [0.5, 0.5, 0.2, 0.2]])
+    boxes_b = np.array([[0.5, 0.5, 0.2, 0.2], [0.6, 0.5, 0.2, 0.2], [0.9, 0.9, 0.1, 0.1]])
+    np.testing.assert_array_almost_equal(chunks._box_iou(boxes_a, boxes_b), [1.0, 1/3, 0.0])
+
+@pytest.mark.parametrize("pickled_results_path", [("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle")])
+def test_stitch_chunk_tables_restores_track_ids(pickled_results_path: str):
+    with open(pickled_results_path, "rb") as f:
+        tracking_results = pickle.load(f)
+    builder = TrackingTableBuilder()
+    for i, tr in enumerate(tracking_results):
+        builder.append(i, tr)
+    df = builder.build()
+
+    frame_ranges = chunks.split_frame_ranges(len(tracking_results), chunk_frames=4, overlap=2)
+    chunk_tables = []
+    for i, (start, end) in enumerate(frame_ranges):
+        # Every range is tracked independently, i.e. its track ids are unrelated to the other ranges
+        chunk_df = df[(df["frame"] >= start) & (df["frame"] < end)].copy()
+        chunk_df["id"] = np.where(chunk_df["id"] != 0, chunk_df["id"] + 1000*i, 0)
+        chunk_tables.append(chunk_df)
+
+    stitched_df = chunks.stitch_chunk_tables(chunk_tables, frame_ranges)
+
+    assert len(stitched_df) == len(df)
+    assert stitched_df["frame"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(stitched_df.drop(columns=["id"]), df.drop(columns=["id"]))
+    # Every original track maps to exactly one stitched track and vice versa
+    id_pairs = pd.DataFrame({"id": df["id"], "stitched_id": stitched_df["id"]}).drop_duplicates()
+    assert id_pairs["id"].is_unique and id_pairs["stitched_id"].is_unique
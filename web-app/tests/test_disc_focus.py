@@ -0,0 +1,45 @@
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+from src.tasks.disc_focus import DiscFocus
+
+NAMES = {0: "player", 29: "disc"}
+
+def _result(frame: np.ndarray, boxes: list[list[float]]) -> Results:
+    return Results(orig_img=frame, path="", names=NAMES, boxes=torch.tensor(boxes, dtype=torch.float32).reshape(-1, 6))
+
+def test_disc_focus_predicts_position_from_trajectory():
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    sut = DiscFocus(crop_size=40, max_missing_frames=5)
+    assert sut.predict_position(0) is None
+
+    sut.observe(0, _result(frame, [[18, 18, 22, 22, 0.9, 29], [0, 0, 10, 10, 0.9, 0]]))
+    assert sut.predict_position(1) == (20, 20)
+    # The disc wasn't detected in frame 1, nor is the low-confidence detection in frame 2 a trajectory point
+    sut.observe(2, _result(frame, [[38, 28, 42, 32, 0.9, 29], [90, 90, 94, 94, 0.1, 29]]))
+
+    assert sut.predict_position(3) == (50, 35)
+    assert sut.get_crop_box(3, frame.shape) == (30, 15, 70, 55)
+    assert sut.predict_position(8) is None
+
+def test_disc_focus_crop_box_lies_within_frame():
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    sut = DiscFocus(crop_size=40)
+    sut.observe(0, _result(frame, [[195, 2, 199, 6, 0.9, 29]]))
+
+    box = sut.get_crop_box(1, frame.shape)
+
+    assert box == (160, 0, 200, 40)
+    assert sut.crop(frame, box).shape == (40, 40, 3)
+
+def test_disc_focus_merges_best_crop_disc_into_frame_detections():
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    box = (100, 50, 140, 90)
+    result = _result(frame, [[0, 0, 10, 10, 0.9, 0], [110, 60, 114, 64, 0.3, 29]])
+    sut = DiscFocus(crop_size=40)
+
+    merged = sut.merge(result, _result(sut.crop(frame, box), [[10, 10, 13, 13, 0.8, 29], [20, 20, 23, 23, 0.4, 29]]), box)
+
+    np.testing.assert_allclose(merged.boxes.data.numpy(), [[0, 0, 10, 10, 0.9, 0], [110, 60, 113, 63, 0.8, 29]])
+    assert merged.orig_shape == (100, 200)
+    assert sut.merge(result, _result(sut.crop(frame, box), []), box) is result
@@ -0,0 +1,52 @@
+import billiard
+import pytest
+import cv2
+import numpy as np
+from src.tasks.frame_ring import SharedFrameRing, get_video_frame_shape, decode_video_into_ring
+
+VIDEO_PATH = "./tests/data/videos/machine_vs_condors_pool_001-supertiny.mp4"
+
+def _read_all_frames(video_path: str) -> list[np.ndarray]:
+    video = cv2.VideoCapture(video_path)
+    frames = []
+    success, frame = video.read()
+    while success:
+        frames.append(frame)
+        success, frame = video.read()
+    video.release()
+    return frames
+
+def test_shared_frame_ring_reuses_slot_released_by_all_readers():
+    frame = np.arange(2*3*3, dtype=np.uint8).reshape(2, 3, 3)
+    with SharedFrameRing(frame.shape, slots=1, readers=2) as sut:
+        slot = sut.put(frame)
+        np.testing.assert_array_equal(sut.get(slot), frame)
+
+        sut.release(slot)
+        with pytest.raises(TimeoutError):
+            sut.put(frame, timeout=0.1)
+        sut.release(slot)
+        assert sut.put(frame + 1, timeout=1) == slot
+        np.testing.assert_array_equal(sut.get(slot), frame + 1)
+
+def test_shared_frame_ring_rejects_unexpected_frame_shape():
+    with SharedFrameRing((2, 3, 3), slots=1) as sut:
+        with pytest.raises(ValueError):
+            sut.put(np.zeros((3, 2, 3), dtype=np.uint8))
+
+def test_decode_video_into_ring_in_child_process():
+    expected_frames = _read_all_frames(VIDEO_PATH)
+    context = billiard.get_context("spawn")
+    frames_queue = context.Queue()
+    with SharedFrameRing(get_video_frame_shape(VIDEO_PATH), slots=1, readers=1, context=context) as sut:
+        decoder = context.Process(target=decode_video_into_ring, args=(VIDEO_PATH, sut, frames_queue))
+        decoder.start()
+        frame_nos = []
+        for frame_no, slot in iter(frames_queue.get, None):
+            np.testing.assert_array_equal(sut.get(slot), expected_frames[frame_no])
+            frame_nos.append(frame_no)
+            sut.release(slot)
+        decoder.join()
+
+    assert frame_nos == list(range(len(expected_frames)))
+    assert decoder.exitcode == 0
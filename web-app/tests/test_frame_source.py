@@ -0,0 +1,53 @@
+import pytest
+import cv2
+import numpy as np
+from src.tasks.frame_source import PrefetchingFrameReader
+
+VIDEO_PATH = "./tests/data/videos/machine_vs_condors_pool_001-supertiny.mp4"
+
+def _read_all_frames(video_path: str) -> list[np.ndarray]:
+    video = cv2.VideoCapture(video_path)
+    frames = []
+    success, frame = video.read()
+    while success:
+        frames.append(frame)
+        success, frame = video.read()
+    video.release()
+    return frames
+
+def test_prefetching_frame_reader_reads_frames_in_order():
+    expected_frames = _read_all_frames(VIDEO_PATH)
+    sut = PrefetchingFrameReader(VIDEO_PATH, prefetch=1)
+
+    frames = list(sut)
+
+    assert [frame_no for frame_no, _ in frames] == list(range(len(expected_frames)))
+    for (_, frame), expected_frame in zip(frames, expected_frames):
+        np.testing.assert_array_equal(frame, expected_frame)
+    assert sut.frames_read == len(expected_frames)
+    assert sut.decode_seconds > 0
+
+def test_prefetching_frame_reader_stride_and_resize():
+    expected_frames = _read_all_frames(VIDEO_PATH)
+    sut = PrefetchingFrameReader(VIDEO_PATH, start_frame=1, frame_stride=2, max_size=640)
+
+    frames = list(sut)
+
+    assert [frame_no for frame_no, _ in frames] == list(range(1, len(expected_frames), 2))
+    height, width = expected_frames[0].shape[:2]
+    assert frames[0][1].shape == (round(height*640/max(height, width)), round(width*640/max(height, width)), 3)
+
+def test_prefetching_frame_reader_stops_early():
+    sut = PrefetchingFrameReader(VIDEO_PATH, prefetch=1)
+    for frame_no, _ in sut:
+        break
+    assert frame_no == 0
+    assert sut.frames_read == 1
+
+def test_prefetching_frame_reader_reraises_decoding_errors(monkeypatch):
+    def failing_resize(self, frame):
+        raise RuntimeError("resize failed")
+    monkeypatch.setattr(PrefetchingFrameReader, "_resize", failing_resize)
+
+    with pytest.raises(RuntimeError, match="resize failed"):
+        list(PrefetchingFrameReader(VIDEO_PATH))
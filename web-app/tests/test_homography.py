@@ -1,7 +1,7 @@
 import numpy as np
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_array_equal
 import pytest
-from src.tasks.keypoints import KeypointQuad
+from src.tasks.keypoints import KeypointQuad, KeypointQuads
 import src.tasks.homography as hg
 
 
@@ -43,3 +43,64 @@ def generate_sample_keypoints_and_real_pitch_expected_values():
 def test_convert_2d_point(h, keypoints, expected):
     result = hg.convert_h(h, np.float32(keypoints))
     assert_array_almost_equal(result, np.float32(expected), decimal=6)
+
+@pytest.mark.parametrize("h", generate_sample_homography_matrix())
+def test_convert_2d_points_batch(h):
+    keypoints_and_expected = generate_sample_keypoints_and_real_pitch_expected_values()
+    keypoints = np.float32([keypoints for keypoints, _ in keypoints_and_expected])
+    expected = np.float32([expected for _, expected in keypoints_and_expected])
+    result = hg.convert_h_batch(h, keypoints)
+    assert result.shape == (4, 2)
+    assert_array_almost_equal(result, expected, decimal=6)
+    for vec, row in zip(keypoints, result):
+        assert_array_almost_equal(row, hg.convert_h(h, vec))
+
+def test_convert_2d_points_batch_invalid_shape():
+    with pytest.raises(ValueError):
+        hg.convert_h_batch(np.eye(3), np.float32([0.5, 0.5]))
+
+def test_calculate_homography_matrices():
+    keypoints = list(generate_sample_keypoints())[0]
+    collinear_keypoints = np.float32([[0.1, 0.1], [0.2, 0.2], [0.3, 0.3], [0.2, 0.5]])
+    quads = KeypointQuads(
+        keypoint_line_keys=np.array([keypoints.keypoint_line_keys, keypoints.keypoint_line_keys, ["", ""]]),
+        keypoints=np.stack([keypoints.keypoints, collinear_keypoints, np.full((4, 2), np.nan, dtype=np.float32)]),
+        cls_ids=np.array([keypoints.cls_ids, keypoints.cls_ids, [-1, -1, -1, -1]]),
+        source_frames=np.array([0, 1, -1]))
+
+    H_all = hg.calculate_homography_matrices(quads)
+
+    assert H_all.shape == (3, 3, 3)
+    assert_array_almost_equal(H_all[0], hg.calculate_homography_matrix(keypoints))
+    # Degenerate quad (3 collinear keypoints) and missing quad
+    assert np.isnan(H_all[1]).all()
+    assert np.isnan(H_all[2]).all()
+
+def test_homography_cache_reuses_matrices():
+    keypoints = list(generate_sample_keypoints())[0]
+    shifted_keypoints = keypoints.keypoints + np.float32(1e-6)
+    moved_keypoints = keypoints.keypoints + np.float32(0.01)
+    quads = KeypointQuads(
+        keypoint_line_keys=np.array([keypoints.keypoint_line_keys]*4),
+        keypoints=np.stack([keypoints.keypoints, keypoints.keypoints, shifted_keypoints, moved_keypoints]),
+        cls_ids=np.array([keypoints.cls_ids]*4),
+        source_frames=np.array([0, 0, 2, 3]))
+
+    exact_cache = hg.HomographyCache()
+    H_all = exact_cache.calculate_homography_matrices(quads)
+    assert_array_almost_equal(H_all, hg.calculate_homography_matrices(quads))
+    assert exact_cache.misses == 3
+    assert exact_cache.hits == 1
+
+    cache = hg.HomographyCache(tolerance=1e-4)
+    H_all = cache.calculate_homography_matrices(quads)
+    assert cache.misses == 2
+    assert cache.hits == 2
+    # The slightly shifted quad shares the matrix of the first frame
+    assert_array_equal(H_all[2], H_all[0])
+    assert not np.allclose(H_all[3], H_all[0])
+
+    # Matrices are remembered across calls
+    cache.calculate_homography_matrices(quads)
+    assert cache.misses == 2
+    assert cache.hits == 6
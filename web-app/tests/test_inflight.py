@@ -0,0 +1,56 @@
+import pytest
+from src.tasks.inflight import InFlightTaskRegistry
+
+class _RedisClient:
+    """Minimal in-memory stand-in for the Redis commands used by the registry."""
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode()
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def eval(self, script, numkeys, key, value):
+        if self.values.get(key) == value.encode():
+            del self.values[key]
+            return 1
+        return 0
+
+def test_inflight_registry_attaches_identical_uploads_to_first_task():
+    submitted = []
+    sut = InFlightTaskRegistry(_RedisClient(), is_task_failed=lambda task_id: False)
+
+    task_id = sut.get_or_submit("video", dict(streaming=False), submitted.append)
+
+    assert sut.get_or_submit("video", dict(streaming=False), submitted.append) == task_id
+    assert sut.get_or_submit("video", dict(streaming=True), submitted.append) != task_id
+    assert sut.get_or_submit("other video", dict(streaming=False), submitted.append) != task_id
+    assert submitted[0] == task_id
+    assert len(submitted) == 3
+
+def test_inflight_registry_submits_new_task_after_failure():
+    submitted = []
+    sut = InFlightTaskRegistry(_RedisClient(), is_task_failed=lambda task_id: task_id == submitted[0])
+    failed_task_id = sut.get_or_submit("video", {}, submitted.append)
+
+    task_id = sut.get_or_submit("video", {}, submitted.append)
+
+    assert task_id != failed_task_id
+    assert submitted == [failed_task_id, task_id]
+    assert sut.get_or_submit("video", {}, submitted.append) == task_id
+
+def test_inflight_registry_unregisters_task_failed_to_submit():
+    def submit_failing(task_id: str):
+        raise ConnectionError("broker unavailable")
+    client = _RedisClient()
+    sut = InFlightTaskRegistry(client)
+
+    with pytest.raises(ConnectionError):
+        sut.get_or_submit("video", {}, submit_failing)
+
+    assert client.values == {}
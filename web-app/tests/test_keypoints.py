@@ -117,3 +117,29 @@ def test_get_4_best_keypoint_pairs_not_enough_keypoints_but_fallback_to_previous
     sut = KeypointsExtractor(df, 0.6)
     result = sut.get_4_best_keypoint_pairs(frame_no=295)
     assert result is not None
+
+def test_get_all_best_keypoint_quads_with_fallback_to_previous_frames():
+    file_path296 = PATH_PREFIX/"pony_vs_the_killjoys_pool_004_296_only_one_kp.txt"
+    df296 = _read_predictions_and_filter_keypoints(file_path296, is_tracking=True, frame_no=2)
+    file_path295 = PATH_PREFIX/"pony_vs_the_killjoys_pool_004_295_not_enough_with_fallback.txt"
+    df295 = _read_predictions_and_filter_keypoints(file_path295, is_tracking=True, frame_no=1)
+    file_path294 = PATH_PREFIX/"pony_vs_the_killjoys_pool_004_294.txt"
+    df294 = _read_predictions_and_filter_keypoints(file_path294, is_tracking=True, frame_no=0)
+    df = pd.concat([df294, df295, df296])
+
+    sut = KeypointsExtractor(df, 0.6, max_lookback=4)
+    result = sut.get_all_best_keypoint_quads(total_frames=5)
+    assert len(result) == 5
+    assert result.keypoints.shape == (5,4,2)
+    assert result.cls_ids.shape == (5,4)
+    # Frames 1 and 2 fall back to frame 0; frame 3 has no data but is still within the look back;
+    # frame 4 is too far from frame 0
+    assert_array_equal(result.source_frames, [0, 0, 0, 0, -1])
+    assert_array_equal(result.found, [True, True, True, True, False])
+    assert result[4] is None
+    for frame_no in range(4):
+        assert result[frame_no].keypoint_line_keys == ["TF", "TC"]
+        assert result[frame_no].cls_ids == [34,35,31,32]
+        assert_array_equal(result[frame_no].keypoints, result.keypoints[0])
+    assert np.isnan(result.keypoints[4]).all()
+    assert_array_equal(result.cls_ids[4], [-1, -1, -1, -1])
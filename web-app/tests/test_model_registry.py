@@ -0,0 +1,80 @@
+import os
+import pytest
+from src.tasks import model_registry
+from src.tasks.model_registry import ModelRegistry
+
+
+def _make_model_files(tmp_path, names):
+    paths = []
+    for name in names:
+        path = tmp_path/name
+        path.write_bytes(b"weights")
+        paths.append(str(path))
+    return paths
+
+def test_model_registry_loads_each_model_once(tmp_path):
+    model_path, = _make_model_files(tmp_path, ["best.pt"])
+    loaded = []
+    sut = ModelRegistry(max_models=2, load_model=lambda path: loaded.append(path) or object())
+
+    model = sut.get_model(model_path)
+    assert sut.get_model(model_path) is model
+    assert loaded == [model_path]
+
+def test_model_registry_reloads_changed_model_file(tmp_path):
+    model_path, = _make_model_files(tmp_path, ["best.pt"])
+    sut = ModelRegistry(max_models=2, load_model=lambda path: object())
+
+    model = sut.get_model(model_path)
+    mtime = os.path.getmtime(model_path)
+    os.utime(model_path, (mtime + 10, mtime + 10))
+
+    assert sut.get_model(model_path) is not model
+    assert len(sut) == 1
+
+def test_model_registry_evicts_least_recently_used(tmp_path):
+    first_path, second_path, third_path = _make_model_files(tmp_path, ["first.pt", "second.pt", "third.pt"])
+    loaded = []
+    sut = ModelRegistry(max_models=2, load_model=lambda path: loaded.append(path) or object())
+
+    sut.get_model(first_path)
+    sut.get_model(second_path)
+    sut.get_model(first_path)
+    # Evicts the second model, which is the least recently used one
+    sut.get_model(third_path)
+    assert len(sut) == 2
+    sut.get_model(first_path)
+    sut.get_model(second_path)
+    assert loaded == [first_path, second_path, third_path, second_path]
+
+def test_get_backend_model_path_exports_missing_models_once(tmp_path, monkeypatch):
+    model_path, onnx_path = _make_model_files(tmp_path, ["best.pt", "best.onnx"])
+    exported = []
+
+    class FakeYOLO:
+        def __init__(self, path):
+            self.path = path
+
+        def export(self, format):
+            exported.append(format)
+            (tmp_path/"best_openvino_model").mkdir()
+            (tmp_path/"best_openvino_model"/"best.xml").write_bytes(b"model")
+
+    monkeypatch.setattr(model_registry.ultralytics, "YOLO", FakeYOLO)
+
+    assert model_registry.get_backend_model_path(model_path, backend="torch") == model_path
+    # The ONNX model is up to date, only the OpenVINO model is exported
+    assert model_registry.get_backend_model_path(model_path, backend="onnx") == onnx_path
+    openvino_path = model_registry.get_backend_model_path(model_path, backend="openvino")
+    assert openvino_path == str(tmp_path/"best_openvino_model")
+    assert model_registry.get_backend_model_path(model_path, backend="openvino") == openvino_path
+    assert exported == ["openvino"]
+
+def test_get_model_backend(monkeypatch):
+    monkeypatch.delenv("MODEL_BACKEND", raising=False)
+    assert model_registry.get_model_backend() == "torch"
+    monkeypatch.setenv("MODEL_BACKEND", "openvino")
+    assert model_registry.get_model_backend() == "openvino"
+    monkeypatch.setenv("MODEL_BACKEND", "tensorrt")
+    with pytest.raises(ValueError):
+        model_registry.get_model_backend()
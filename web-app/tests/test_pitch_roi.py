@@ -0,0 +1,51 @@
+import pytest
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+from src.tasks.pitch_roi import PitchRoi
+
+NAMES = {0: "player", 31: "keypoint"}
+
+def _result(frame: np.ndarray, boxes: list[list[float]]) -> Results:
+    return Results(orig_img=frame, path="", names=NAMES, boxes=torch.tensor(boxes, dtype=torch.float32).reshape(-1, 6))
+
+def test_pitch_roi_estimated_from_keypoints_at_end_of_window():
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    sut = PitchRoi(padding=0.1, min_keypoints=2, estimation_frames=2, reestimate_every=5)
+
+    # Keypoint centres (50,20) and (150,80); the player and the low-confidence keypoint are ignored
+    sut.observe(0, _result(frame, [[48, 18, 52, 22, 0.9, 31], [0, 0, 10, 10, 0.9, 0], [190, 90, 194, 94, 0.1, 31]]))
+    assert sut.box is None
+    sut.observe(1, _result(frame, [[148, 78, 152, 82, 0.9, 31]]))
+
+    assert sut.box == (40, 14, 160, 86)
+    assert [sut.get_box(i) for i in range(6)] == [None, None, sut.box, sut.box, sut.box, None]
+
+def test_pitch_roi_not_estimated_without_enough_keypoints():
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    sut = PitchRoi(min_keypoints=2, estimation_frames=1)
+
+    sut.observe(0, _result(frame, [[48, 18, 52, 22, 0.9, 31]]))
+
+    assert sut.get_box(1) is None
+
+def test_pitch_roi_maps_crop_detections_to_full_frame():
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    box = (40, 14, 160, 86)
+    sut = PitchRoi()
+    crop = sut.crop(frame, box)
+    assert crop.shape == (72, 120, 3)
+
+    result = sut.to_full_frame(_result(crop, [[10, 20, 30, 40, 0.9, 0]]), frame, box)
+
+    assert result.orig_shape == (100, 200)
+    np.testing.assert_allclose(result.boxes.xyxy.numpy(), [[50, 34, 70, 54]])
+    np.testing.assert_allclose(result.boxes.xywhn.numpy(), [[60/200, 44/100, 20/200, 20/100]])
+
+@pytest.mark.parametrize("box,expected_imgsz", [((0, 0, 1920, 1080), 640), ((400, 300, 1600, 900), 416), ((0, 0, 10, 10), 32)])
+def test_pitch_roi_image_size_keeps_resolution(box: tuple, expected_imgsz: int):
+    assert PitchRoi().get_imgsz(box, frame_shape=(1080, 1920), imgsz=640) == expected_imgsz
+
+def test_pitch_roi_rejects_estimation_window_longer_than_period():
+    with pytest.raises(ValueError):
+        PitchRoi(estimation_frames=10, reestimate_every=5)
@@ -0,0 +1,55 @@
+import pickle
+import hashlib
+import pytest
+import numpy as np
+from src.tasks.precalculated import PrecalculatedResults, convert_pickled_results, get_precalculated_results_if_present, get_results_file_name
+
+RESULTS = {
+    "1": [dict(cls=0, x=1.5, y=2.25, team=0, id=3), dict(cls=29, x=10.0, y=20.0, team=-1, id=7)],
+    "3": [dict(cls=30, x=-4.0, y=0.5, team=-1, id=12)],
+    "10": [dict(cls=0, x=1.75, y=2.5, team=1, id=3)],
+}
+
+def test_precalculated_results_round_trip_through_memory_mapped_file(tmp_path):
+    path = str(tmp_path / "results.v1.npy")
+    PrecalculatedResults.from_dict(RESULTS).save(path)
+
+    sut = PrecalculatedResults.load(path)
+
+    assert isinstance(sut._rows, np.memmap)
+    assert sut.to_dict() == RESULTS
+    assert sut.get_frame_range(2, 10) == {"3": RESULTS["3"]}
+    assert sut["10"] == RESULTS["10"]
+    assert list(sut) == ["1", "3", "10"]
+    with pytest.raises(KeyError):
+        sut["2"]
+
+def test_convert_pickled_results_writes_columnar_file_found_by_lookup(tmp_path, monkeypatch):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"frames")
+    video_sha256sum = hashlib.sha256(b"frames").hexdigest()
+    with open(tmp_path / f"{video_sha256sum}.pickle", "wb") as f:
+        pickle.dump(RESULTS, f)
+    monkeypatch.setenv("PRECALCULATED_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("VIDEO_HASH_INDEX_DIR", str(tmp_path / "index"))
+    assert get_precalculated_results_if_present(str(video_path)).to_dict() == RESULTS
+    assert (tmp_path / f"{video_sha256sum}.v1.npy").is_file()
+    (tmp_path / f"{video_sha256sum}.v1.npy").unlink()
+
+    results_path = convert_pickled_results(str(tmp_path / f"{video_sha256sum}.pickle"))
+    (tmp_path / f"{video_sha256sum}.pickle").unlink()
+
+    assert results_path == str(tmp_path / f"{video_sha256sum}.v1.npy")
+    assert get_precalculated_results_if_present(str(video_path)).to_dict() == RESULTS
+
+def test_precalculated_results_only_found_for_the_same_frame_stride(tmp_path, monkeypatch):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"frames")
+    video_sha256sum = hashlib.sha256(b"frames").hexdigest()
+    monkeypatch.setenv("PRECALCULATED_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("VIDEO_HASH_INDEX_DIR", str(tmp_path / "index"))
+    PrecalculatedResults.from_dict(RESULTS).save(str(tmp_path / get_results_file_name(video_sha256sum, frame_stride=3)))
+
+    assert get_precalculated_results_if_present(str(video_path)) is None
+    assert get_precalculated_results_if_present(str(video_path), frame_stride=2) is None
+    assert get_precalculated_results_if_present(str(video_path), frame_stride=3).to_dict() == RESULTS
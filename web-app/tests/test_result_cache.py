@@ -0,0 +1,32 @@
+import os
+from src.tasks.result_cache import AnalysisResultCache
+
+RESULT = {"status": 1, "coordinates": {"1": [dict(cls=0, x=0.1, y=2.3, team=0, id=3)]}, "frame_stride": 2, "inferred_frames": [1]}
+
+def test_result_cache_round_trip(tmp_path):
+    sut = AnalysisResultCache(str(tmp_path), max_bytes=2**20)
+    key = AnalysisResultCache.make_key("video", "model", dict(team_mode="frame", frame_stride=2))
+
+    assert sut.get(key) is None
+    sut.put(key, RESULT)
+
+    # The coordinates aren't rounded to float32
+    assert sut.get(key) == RESULT
+    assert AnalysisResultCache.make_key("video", "model", dict(team_mode="video", frame_stride=2)) != key
+
+def test_result_cache_evicts_least_recently_used_entries(tmp_path):
+    sut = AnalysisResultCache(str(tmp_path), max_bytes=2**20)
+    for key in ["a", "b"]:
+        sut.put(key, RESULT)
+    entry_bytes = sum(os.path.getsize(tmp_path / name) for name in ["a.npy", "a.json"])
+    os.utime(tmp_path / "a.npy", (1, 1))
+    os.utime(tmp_path / "b.npy", (2, 2))
+    # Reading "a" makes "b" the least recently used entry
+    assert sut.get("a") is not None
+
+    sut = AnalysisResultCache(str(tmp_path), max_bytes=2*entry_bytes)
+    sut.put("c", RESULT)
+
+    assert sut.get("b") is None
+    assert sut.get("a") == RESULT
+    assert sut.get("c") == RESULT
@@ -1,4 +1,11 @@
+import pytest
+import pickle
 from src.tasks import tasks
+from src.tasks import model_registry as model_registry_module
+from src.tasks.pitch_roi import PitchRoi
+from src.tasks.precalculated import PrecalculatedResults, get_results_file_name
+from src.tasks.video_hash import get_video_sha256sum
+import cv2
 import pandas as pd
 import numpy as np
 
@@ -30,3 +37,146 @@ def test_convert_to_final_results():
     assert final_results["1"][0]["y"] == 6.411272e+01
 
 
+def test_remove_perspective():
+    # Frame 0 is scaled by 2, frame 1 is shifted by (1, 1), frame 2 has no homography matrix
+    H_all = np.array([np.diag([2.0, 2.0, 1.0]), [[1.0, 0, 1], [0, 1.0, 1], [0, 0, 1.0]], np.full((3, 3), np.nan)])
+    data = dict(
+        cls=[0, 29, 30, 0, 29],
+        x=[0.1, 0.2, 0.3, 0.4, 0.5],
+        y=[0.1, 0.2, 0.3, 0.4, 0.5],
+        h=[0.2, 0.2, 0.2, 0.2, 0.2],
+        frame=[1, 0, 0, 2, 1])
+    df = pd.DataFrame(data=data)
+
+    result = tasks._remove_perspective(df, H_all)
+
+    assert result.shape == (5, 2)
+    # Players and referees are translated by the bottom centre of the bounding box
+    np.testing.assert_array_almost_equal(result[0], [1.1, 1.2])
+    np.testing.assert_array_almost_equal(result[1], [0.4, 0.4])
+    np.testing.assert_array_almost_equal(result[2], [0.6, 0.8])
+    assert np.isnan(result[3]).all()
+    np.testing.assert_array_almost_equal(result[4], [1.5, 1.5])
+
+def test_convert_to_final_results_unsorted_frames():
+    data = dict(cls=[0, 29, 0, 30, 0], x=[1.0, 2.0, 3.0, 4.0, 5.0], y=[1.0, 2.0, 3.0, 4.0, np.nan],
+                team=[0, -1, 1, -1, 0], id=[1, 2, 3, 4, 5], frame=[2, 0, 2, 0, 1])
+    df = pd.DataFrame(data=data)
+
+    final_results = tasks._convert_to_final_results(df)
+
+    # Frame 1 (i.e. video frame 2) only contains a NaN and is dropped
+    assert list(final_results.keys()) == ["1", "3"]
+    assert [r["id"] for r in final_results["1"]] == [2, 4]
+    assert [r["id"] for r in final_results["3"]] == [1, 3]
+
+@pytest.mark.parametrize("pickled_results_path", [("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle")])
+def test_analyse_in_chunks_same_as_whole_video(pickled_results_path: str):
+    with open(pickled_results_path, "rb") as f:
+        tracking_results = pickle.load(f)
+    some_img = np.zeros((2800, 2800, 3))
+    for result in tracking_results:
+        result.orig_img = some_img
+    total_frames = len(tracking_results)
+
+    expected = tasks._convert_to_final_results(tasks._translate_coordinates(tracking_results, total_frames=total_frames))
+    chunks = list(tasks._analyse_in_chunks(iter(tracking_results), chunk_frames=3))
+
+    assert [frames_done for frames_done, _ in chunks] == [3, 6, 9, 10]
+    result = {}
+    for _, chunk_results in chunks:
+        assert not set(result).intersection(chunk_results)
+        result.update(chunk_results)
+    assert list(result) == list(expected)
+    for frame, records in expected.items():
+        np.testing.assert_array_almost_equal([[r["x"], r["y"], r["id"]] for r in result[frame]],
+                                             [[r["x"], r["y"], r["id"]] for r in records])
+
+def test_interpolate_skipped_frames():
+    # Tracked frames 0 and 1 are video frames 0 and 3; track 2 is missing in the second tracked frame
+    data = dict(cls=[0, 0, 29, 0], x=[0.0, 5.0, 1.0, 3.0], y=[10.0, 7.0, 1.0, 4.0], team=[1, -1, -1, 1],
+                id=[1, 2, 0, 1], frame=[0, 0, 0, 1])
+    df = pd.DataFrame(data=data)
+
+    result = tasks._interpolate_skipped_frames(df, frame_stride=3, total_frames=5)
+
+    assert result["frame"].is_monotonic_increasing
+    track_1 = result[result["id"] == 1]
+    assert track_1["frame"].tolist() == [0, 1, 2, 3, 4]
+    np.testing.assert_array_almost_equal(track_1[["x", "y"]], [[0, 10], [1, 8], [2, 6], [3, 4], [3, 4]])
+    assert (track_1["team"] == 1).all()
+    # Tracks are only interpolated between consecutive tracked frames, untracked objects aren't interpolated
+    assert result[result["id"] == 2]["frame"].tolist() == [0]
+    assert result[result["id"] == 0]["frame"].tolist() == [0]
+
+def test_iter_frame_batches_split_at_pitch_roi_estimation_windows():
+    frames = [(frame_no, None) for frame_no in range(12)]
+    pitch_roi = PitchRoi(estimation_frames=3, reestimate_every=8)
+
+    batches = list(tasks._iter_frame_batches(frames, batch_size=4, pitch_roi=pitch_roi))
+
+    assert [[frame_no for frame_no, _ in batch] for batch in batches] == [[0, 1, 2], [3, 4, 5, 6], [7], [8, 9, 10], [11]]
+    assert len(list(tasks._iter_frame_batches(frames, batch_size=4))) == 3
+
+def test_load_model_on_worker_process_init_does_not_export(tmp_path, monkeypatch):
+    (tmp_path / "best.pt").write_bytes(b"weights")
+    monkeypatch.setenv("MODEL_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("MODEL_BACKEND", "onnx")
+    monkeypatch.setattr(model_registry_module.ultralytics, "YOLO", lambda path: pytest.fail("The model must not be exported"))
+    loaded = []
+    monkeypatch.setattr(tasks.model_registry, "get_model", loaded.append)
+
+    tasks._load_model_on_worker_process_init()
+    assert loaded == []
+
+    # The model exported by a task is loaded by the next worker processes
+    (tmp_path / "best.onnx").write_bytes(b"exported weights")
+    tasks._load_model_on_worker_process_init()
+    assert loaded == [str(tmp_path / "best.onnx")]
+
+def test_video_analysis_returns_precalculated_results_of_the_same_frame_stride(tmp_path, monkeypatch):
+    video_path = "./tests/data/videos/machine_vs_condors_pool_001-supertiny.mp4"
+    monkeypatch.setenv("PRECALCULATED_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("VIDEO_HASH_INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.delenv("RESULT_CACHE_DIR", raising=False)
+    monkeypatch.setattr(tasks.video_analysis, "update_state", lambda **kwargs: None)
+    coordinates = {"1": [dict(cls=0, x=1.5, y=2.25, team=0, id=3)]}
+    results_file_name = get_results_file_name(get_video_sha256sum(video_path), frame_stride=2)
+    PrecalculatedResults.from_dict(coordinates).save(str(tmp_path / results_file_name))
+    total_frames = int(cv2.VideoCapture(video_path).get(cv2.CAP_PROP_FRAME_COUNT))
+
+    result = tasks.video_analysis(video_path, frame_stride=2)
+
+    assert result == {"status": 1, "coordinates": coordinates, "frame_stride": 2,
+                      "inferred_frames": list(range(1, total_frames + 1, 2))}
+
+def test_crop_predictor_made_once_per_model_and_image_size(monkeypatch):
+    made = []
+    monkeypatch.setattr(tasks, "_make_crop_predictor", lambda model, imgsz: made.append((model, imgsz)) or object())
+    class Model:
+        pass
+    model, other_model = Model(), Model()
+
+    predictor = tasks._get_crop_predictor(model, imgsz=320)
+
+    assert tasks._get_crop_predictor(model, imgsz=320) is predictor
+    assert tasks._get_crop_predictor(model, imgsz=640) is not predictor
+    assert tasks._get_crop_predictor(other_model, imgsz=320) is not predictor
+    assert len(made) == 3
+
+def test_result_cache_key_depends_on_the_settings_applied_by_the_execution_mode(monkeypatch):
+    monkeypatch.setattr(tasks, "_get_model_path", lambda export=True: "best.pt")
+    monkeypatch.setattr(tasks, "get_video_sha256sum", lambda path: path)
+    def get_key(**kwargs):
+        return tasks._get_result_cache_key("video.mp4", team_mode=tasks.TEAMS_PER_FRAME, frame_stride=1, **kwargs)
+    single_key, multiprocess_key = get_key(), get_key(multiprocess=True)
+
+    monkeypatch.setattr(tasks, "PITCH_ROI_INFERENCE", True)
+    assert get_key() != single_key
+    # The multi-process analysis doesn't crop the frames to the pitch
+    assert get_key(multiprocess=True) == multiprocess_key
+    assert get_key(frame_ranges=[(0, 10), (5, 20)]) == get_key(frame_ranges=[[0, 10], [5, 20]]) != get_key()
+    monkeypatch.setattr(tasks, "APPEARANCE_REFRESH_EVERY", 5)
+    assert get_key(multiprocess=True) != multiprocess_key
+    monkeypatch.setattr(tasks, "_get_model_path", lambda export=True: "best.pt" if export else None)
+    assert get_key(export=False) is None
@@ -0,0 +1,39 @@
+import warnings
+from types import SimpleNamespace
+import numpy as np
+from src.tasks.team_detector import TeamDetector, TrackAppearanceCache, COLOR_HISTOGRAM_FEATURES
+
+
+def test_track_appearance_cache_refreshes_by_cadence_and_box_size():
+    sut = TrackAppearanceCache(refresh_every=3, box_size_change=0.25)
+    box = [10, 10, 20, 30]
+    features = np.ones(40)
+
+    # Unknown track
+    assert sut.get(1, frame_no=0, box=box) is None
+    sut.put(1, frame_no=0, box=box, features=features, brightness=0.5)
+
+    cached_features, brightness = sut.get(1, frame_no=1, box=[11, 11, 21, 31])
+    assert cached_features is features
+    assert brightness == 0.5
+    # Box area changed too much
+    assert sut.get(1, frame_no=2, box=[10, 10, 30, 30]) is None
+    # Features are too old
+    assert sut.get(1, frame_no=3, box=box) is None
+    # Other tracks are cached separately
+    assert sut.get(2, frame_no=1, box=box) is None
+
+    assert sut.computed_crops == 1
+    assert sut.skipped_crops == 1
+
+def test_team_detector_skips_empty_player_crops():
+    img = np.full((100, 100, 3), 128, dtype=np.uint8)
+    # The second player's box is thinner than a pixel
+    boxes = SimpleNamespace(id=np.array([1, 2]), cls=np.array([0.0, 0.0]), xyxy=np.array([[10, 10, 30, 50], [40, 10, 40.5, 50]]))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        sut = TeamDetector(img, [SimpleNamespace(boxes=boxes)], feature_extractor=COLOR_HISTOGRAM_FEATURES)
+
+    assert [player["id"] for player in sut.player_info] == [1]
+    assert not np.isnan(sut.player_info[0]["brightness"])
@@ -0,0 +1,80 @@
+import io
+import os
+import hashlib
+import pytest
+from src.tasks.uploads import ChunkedUploads
+
+CONTENT = os.urandom(25)
+
+@pytest.fixture
+def video_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("VIDEO_HASH_INDEX_DIR", str(tmp_path / "index"))
+    video_dir = tmp_path / "uploads"
+    video_dir.mkdir()
+    return video_dir
+
+def test_chunked_upload_resumed_after_dropped_chunk_submits_analysis_once(video_dir):
+    submitted = []
+    def submit(video_path: str, sha256sum: str, params: dict) -> str:
+        submitted.append((video_path, sha256sum, params))
+        return "result"
+    sut = ChunkedUploads(str(video_dir))
+    upload_id = sut.create("game.mp4", len(CONTENT), params=dict(streaming=True))
+
+    assert sut.append(upload_id, 0, io.BytesIO(CONTENT[:10]), submit)["offset"] == 10
+    # The chunk was sent again, e.g. as its response was lost
+    with pytest.raises(ValueError):
+        sut.append(upload_id, 0, io.BytesIO(CONTENT[:10]), submit)
+    # Another process (without the hash of the received chunks) continues the upload
+    sut = ChunkedUploads(str(video_dir))
+    assert sut.get_status(upload_id) == dict(offset=10, size=len(CONTENT), result_id=None)
+    status = sut.append(upload_id, 10, io.BytesIO(CONTENT[10:]), submit)
+    # The upload is removed once the analysis is submitted
+    with pytest.raises(KeyError):
+        sut.append(upload_id, 10, io.BytesIO(CONTENT[10:]), submit)
+
+    sha256sum = hashlib.sha256(CONTENT).hexdigest()
+    assert status == dict(offset=len(CONTENT), size=len(CONTENT), result_id="result")
+    assert submitted == [(str(video_dir / f"{sha256sum}.mp4"), sha256sum, dict(streaming=True))]
+    assert (video_dir / f"{sha256sum}.mp4").read_bytes() == CONTENT
+    assert os.listdir(video_dir / ".uploads") == []
+
+def test_chunked_upload_submits_analysis_again_after_failed_submission(video_dir):
+    def submit_failing(video_path: str, sha256sum: str, params: dict) -> str:
+        raise ConnectionError("broker unavailable")
+    sut = ChunkedUploads(str(video_dir))
+    upload_id = sut.create("game.mp4", len(CONTENT), params={})
+    with pytest.raises(ConnectionError):
+        sut.append(upload_id, 0, io.BytesIO(CONTENT), submit_failing)
+    assert sut.get_status(upload_id)["offset"] == len(CONTENT)
+
+    status = sut.append(upload_id, len(CONTENT), io.BytesIO(b""), lambda video_path, sha256sum, params: "result")
+
+    assert status["result_id"] == "result"
+    with pytest.raises(KeyError):
+        sut.get_status(upload_id)
+
+def test_chunked_upload_rejects_data_beyond_its_size_and_unknown_uploads(video_dir):
+    sut = ChunkedUploads(str(video_dir))
+    upload_id = sut.create("game.mp4", 5, params={})
+
+    with pytest.raises(ValueError):
+        sut.append(upload_id, 0, io.BytesIO(CONTENT), lambda video_path, sha256sum, params: "result")
+    with pytest.raises(KeyError):
+        sut.get_status("unknown")
+    with pytest.raises(KeyError):
+        sut.get_status("../index")
+
+def test_chunked_uploads_remove_expired_uploads_on_create(video_dir):
+    sut = ChunkedUploads(str(video_dir), expiry_seconds=60)
+    abandoned_id = sut.create("game.mp4", len(CONTENT), params={})
+    sut.append(abandoned_id, 0, io.BytesIO(CONTENT[:10]), lambda video_path, sha256sum, params: "result")
+    active_id = sut.create("game.mp4", len(CONTENT), params={})
+    os.utime(video_dir / ".uploads" / f"{abandoned_id}.json", (1, 1))
+
+    new_id = sut.create("game.mp4", len(CONTENT), params={})
+
+    with pytest.raises(KeyError):
+        sut.get_status(abandoned_id)
+    assert sorted(os.listdir(video_dir / ".uploads")) == sorted([f"{active_id}.json", f"{active_id}.part",
+                                                                  f"{new_id}.json", f"{new_id}.part"])
@@ -0,0 +1,71 @@
+import io
+import os
+import hashlib
+from src.tasks import video_hash
+from src.tasks.video_hash import VideoHashIndex, save_video_deduplicated
+
+def test_video_hash_index_calculates_checksum_once(tmp_path, monkeypatch):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"frames")
+    sut = VideoHashIndex(str(tmp_path / "index"))
+
+    assert sut.get(str(video_path)) is None
+    assert sut.get_or_calculate(str(video_path)) == hashlib.sha256(b"frames").hexdigest()
+    monkeypatch.setattr(video_hash, "calculate_sha256sum", lambda filename: "not expected")
+    assert sut.get_or_calculate(str(video_path)) == hashlib.sha256(b"frames").hexdigest()
+
+def test_video_hash_index_misses_modified_file(tmp_path):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"frames")
+    sut = VideoHashIndex(str(tmp_path / "index"))
+    sut.put(str(video_path), "abc")
+
+    video_path.write_bytes(b"other frames")
+
+    assert sut.get(str(video_path)) is None
+
+def test_video_hash_index_removes_entries_of_previous_versions(tmp_path):
+    video_path = tmp_path / "video.mp4"
+    other_video_path = tmp_path / "other.mp4"
+    video_path.write_bytes(b"frames")
+    other_video_path.write_bytes(b"other frames")
+    sut = VideoHashIndex(str(tmp_path / "index"))
+    sut.put(str(video_path), "abc")
+    sut.put(str(other_video_path), "def")
+
+    video_path.write_bytes(b"new frames")
+    sut.put(str(video_path), "ghi")
+
+    assert sut.get(str(video_path)) == "ghi"
+    assert sut.get(str(other_video_path)) == "def"
+    assert sum(len(names) for _, _, names in os.walk(tmp_path / "index")) == 2
+
+def test_save_video_deduplicated_indexes_uploaded_video(tmp_path, monkeypatch):
+    monkeypatch.setenv("VIDEO_HASH_INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.setattr(video_hash, "COPY_CHUNK_BYTES", 4)
+    video_dir = tmp_path / "uploads"
+    video_dir.mkdir()
+    content = os.urandom(10)
+
+    video_path, sha256sum = save_video_deduplicated(io.BytesIO(content), str(video_dir), "Game.MP4")
+    # The same video uploaded again under another name
+    assert save_video_deduplicated(io.BytesIO(content), str(video_dir), "game-copy.mp4") == (video_path, sha256sum)
+
+    assert sha256sum == hashlib.sha256(content).hexdigest()
+    assert video_path == str(video_dir / f"{sha256sum}.mp4")
+    assert os.listdir(video_dir) == [f"{sha256sum}.mp4"]
+    assert (video_dir / f"{sha256sum}.mp4").read_bytes() == content
+    assert VideoHashIndex(str(tmp_path / "index")).get(video_path) == sha256sum
+
+def test_video_hash_index_hashes_directory_files(tmp_path):
+    model_dir = tmp_path / "best_openvino_model"
+    model_dir.mkdir()
+    (model_dir / "best.xml").write_bytes(b"graph")
+    (model_dir / "best.bin").write_bytes(b"weights")
+    sut = VideoHashIndex(str(tmp_path / "index"))
+
+    sha256sum = sut.get_or_calculate(str(model_dir))
+    (model_dir / "best.bin").write_bytes(b"other weights")
+
+    assert sut.get(str(model_dir)) is None
+    assert sut.get_or_calculate(str(model_dir)) != sha256sum
@@ -1,9 +1,12 @@
 import pytest
 import pickle
 
+import billiard
 import ultralytics
 from src.tasks import yolo_helper
+from src.tasks.frame_ring import SharedFrameRing
 import numpy as np
+import pandas as pd
 
 @pytest.mark.parametrize("pickled_results_path", [("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle")])
 def test_yolo_tracking_results_conversion_to_dataframe(pickled_results_path: str):
@@ -14,6 +17,70 @@ def test_yolo_tracking_results_conversion_to_dataframe(pickled_results_path: str
     assert len(df["frame"].unique()) == 10
     expected_columns = ["cls", "x", "y", "w", "h", "conf", "id", "frame"]
     assert set(df.columns).issuperset(set(expected_columns))
+    assert df["cls_name"].dtype == "category"
+    assert (df["cls_name"].astype(str) == df["cls"].map(tracking_results[0].names)).all()
+    assert df.index.is_unique
+
+@pytest.mark.parametrize("pickled_results_path", [("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle")])
+def test_tracking_table_builder_grows(pickled_results_path: str):
+    tracking_results = _unpickle_tracking_results_and_pad_orig_img(pickled_results_path)
+    sut = yolo_helper.TrackingTableBuilder(initial_capacity=1)
+    for i, tr in enumerate(tracking_results):
+        sut.append(i, tr)
+
+    df = sut.build()
+    assert len(df) == len(sut) == sum(len(tr.boxes) for tr in tracking_results)
+    assert df["frame"].is_monotonic_increasing
+    assert (df["team"] == -1).all()
+    last_boxes = tracking_results[-1].boxes
+    np.testing.assert_array_equal(df["id"].tail(len(last_boxes)), last_boxes.id.numpy().astype(int))
+    np.testing.assert_array_almost_equal(df[["x", "y", "w", "h"]].tail(len(last_boxes)), last_boxes.xywhn.numpy())
+
+def test_lookup_teams():
+    pred_teams_df = pd.DataFrame({"id": [3, 1, 3], "pred_team": [0.0, 1.0, 1.0]})
+    teams = yolo_helper._lookup_teams(np.array([1, 2, 3, 1]), pred_teams_df)
+    # Objects without a prediction get -1, the last prediction of an id wins
+    np.testing.assert_array_equal(teams, [1, -1, 1, 1])
+
+def test_callback_adapter_counts_batch_images():
+    calls = []
+    sut = yolo_helper.make_callback_adapter_with_counter("on_predict_batch_start", lambda event, counter: calls.append(counter),
+                                                         count_items=yolo_helper.count_batch_images)
+    for batch_size in [3, 1]:
+        predictor = type("Predictor", (), {"batch": (["image0.jpg"]*batch_size, [None]*batch_size, "")})
+        sut(predictor)
+    # The callback is called once per image, as if the images were predicted one by one
+    assert calls == [1, 2, 3, 4]
+
+def test_lookup_frame_teams():
+    tracking_results_df = pd.DataFrame({"frame": [0, 0, 1, 1], "id": [1, 2, 1, 2]})
+    frame_teams_df = pd.DataFrame({"frame": [0, 1, 1], "id": [1, 1, 1], "pred_team": [0.0, 0.0, 1.0]})
+    teams = yolo_helper.lookup_frame_teams(tracking_results_df, frame_teams_df)
+    # The team of an object is looked up in its frame, the last prediction of an id in a frame wins
+    np.testing.assert_array_equal(teams, [0, -1, 1, -1])
+
+@pytest.mark.parametrize("pickled_results_path", [("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle")])
+def test_predict_teams_from_ring_in_child_process(pickled_results_path: str):
+    tracking_results = _unpickle_tracking_results_and_pad_orig_img(pickled_results_path)
+    frame = np.random.default_rng(0).integers(0, 256, size=(*tracking_results[0].orig_shape, 3), dtype=np.uint8)
+    context = billiard.get_context("spawn")
+    detections_queue, teams_queue = context.Queue(), context.Queue()
+    with SharedFrameRing(frame.shape, slots=2, readers=1, context=context) as ring:
+        process = context.Process(target=yolo_helper.predict_teams_from_ring, args=(ring, detections_queue, teams_queue))
+        process.start()
+        for i, tr in enumerate(tracking_results):
+            detections_queue.put((i, ring.put(frame, timeout=60), tr.boxes.data.numpy(), tr.names))
+        detections_queue.put(None)
+        frame_teams_df = teams_queue.get(timeout=60)
+        process.join()
+        # All the slots were released
+        for _ in range(ring.slots):
+            ring.put(frame, timeout=1)
+
+    assert process.exitcode == 0
+    players = [(i, int(id)) for i, tr in enumerate(tracking_results) for id, cls in zip(tr.boxes.id, tr.boxes.cls) if cls == 0]
+    assert sorted(zip(frame_teams_df["frame"], frame_teams_df["id"])) == sorted(players)
+    assert frame_teams_df["pred_team"].isin([0, 1]).all()
 
 def _unpickle_tracking_results_and_pad_orig_img(pickled_results_path: str) -> list[ultralytics.engine.results.Results]:
     """Unpickles Ultralytics YOLO tracking results and fill orig_img with dummy data"""
@@ -27,3 +94,18 @@ def _unpickle_tracking_results_and_pad_orig_img(pickled_results_path: str) -> li
             setattr(result, "orig_img", some_img)
         assert result.orig_img is not None
     return tracking_results
+
+@pytest.mark.parametrize("pickled_results_path", [("./tests/data/tracking_set_ultralytics/tiny_tracking_results.pickle")])
+def test_yolo_tracking_results_conversion_with_teams_per_video(pickled_results_path: str):
+    tracking_results = _unpickle_tracking_results_and_pad_orig_img(pickled_results_path)
+    df = yolo_helper.convert_tracking_results_to_pandas(tracking_results, team_mode=yolo_helper.TEAMS_PER_VIDEO)
+    assert len(df["frame"].unique()) == 10
+
+    players_df = df[df["cls"] == 0]
+    assert players_df["team"].isin([0, 1]).all()
+    # Every track id keeps its team across frames
+    assert (players_df.groupby("id")["team"].nunique() == 1).all()
+
+def test_yolo_tracking_results_conversion_unknown_team_mode():
+    with pytest.raises(ValueError):
+        yolo_helper.convert_tracking_results_to_pandas([], team_mode="unknown")